@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+How many bytes does each parsed row take?
+
+Makes up ROWS rows (a sale and a payment each, to ROWS/10 customers),
+runs them through csv_parser.Parse, and reports the memory held by what
+came out, per row. The rows themselves are not counted.
+
+$ python3 benchmarks/memory_per_row.py [--rows 100000]
+
+To compare against another version of ekaterina, point --tree at a
+checkout of it:
+$ git worktree add /tmp/ekaterina-before <commit>
+$ python3 benchmarks/memory_per_row.py --tree /tmp/ekaterina-before
+"""
+import os
+import sys
+import argparse
+import tracemalloc
+
+def make_rows(count):
+    customers = max(1, count // 10)
+    return [{"CUSTOMER_NAME": "Customer {}".format(row % customers),
+             "CUSTOMER_ID": str(row % customers),
+             "SALE_DESCRIPTION": "Sale {}".format(row),
+             "QUANTITY": str(1 + row % 7),
+             "UNIT_PRICE": "{}.25".format(row % 1000),
+             "INCOME_ACCOUNT": "Income:Sales",
+             "SALE_DATE": "2021-01-{:02d}".format(1 + row % 28),
+             "CURRENCY": "NPR",
+             "PAYMENT_AMOUNT": "{}.50".format(row % 500),
+             "PAYMENT_DATE": "2021-01-{:02d}".format(1 + row % 28)}
+            for row in range(count)]
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("--rows", type=int, default=100000)
+    argparser.add_argument("--tree", default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), ".."),
+                           help="the ekaterina source tree to measure")
+    args = argparser.parse_args()
+
+    sys.path.insert(0, os.path.abspath(args.tree))
+    from ekaterina.parsers import csv_parser
+
+    rows = make_rows(args.rows)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    parsed = csv_parser.Parse(rows)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print("tree:          ", os.path.abspath(args.tree))
+    print("rows:          ", args.rows)
+    print("transactions:  ", len(parsed))
+    print("bytes held:    ", after - before)
+    print("bytes per row: ", round((after - before) / args.rows, 1))
+
+if __name__ == "__main__":
+    main()
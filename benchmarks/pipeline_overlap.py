@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+How much of the parsing does pipeline.Run hide behind the writing?
+
+Makes up a book (as write_path_scaling.py does) and ROWS rows for it,
+grouped by customer, and imports them into two fresh copies of the
+book: one step after the other (csv_parser.Parse, then
+mazurka.danse_mazurka and the save, each timed on its own), and
+pipelined (pipeline.Run, with grouped_by_customer). The parsing is
+overlapped where pipelined comes to less than parse + write.
+
+$ python3 benchmarks/pipeline_overlap.py [--rows 20000] [--size 1000]
+      [--backend xml|sqlite3]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import gnucash
+
+import write_path_scaling as scaling
+from ekaterina import mazurka
+from ekaterina import pipeline
+from ekaterina.parsers import csv_parser
+
+def import_one_step_at_a_time(uri, rows):
+    """Return (seconds parsing, seconds writing and saving)"""
+    session = gnucash.Session(uri)
+    try:
+        start = time.perf_counter()
+        parsed = csv_parser.Parse(rows)
+        parsed_at = time.perf_counter()
+        mazurka.danse_mazurka(session.book, parsed)
+        session.save()
+        return (parsed_at - start, time.perf_counter() - parsed_at)
+    finally:
+        session.end()
+
+def import_pipelined(uri, rows):
+    start = time.perf_counter()
+    pipeline.Run(iter(rows), uri, grouped_by_customer=True)
+    return time.perf_counter() - start
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("--rows", type=int, default=20000)
+    argparser.add_argument("--size", type=int, default=1000,
+                           help="invoices in the book to begin with")
+    argparser.add_argument("--backend", choices=("xml", "sqlite3"),
+                           default="sqlite3")
+    args = argparser.parse_args()
+
+    (customers, accounts) = scaling.book_shape(args.size)
+    rows = scaling.make_rows(customers, accounts, args.rows, "2021-01-01")
+    rows.sort(key=lambda row: row["CUSTOMER_ID"])
+    with tempfile.TemporaryDirectory() as directory:
+        book = os.path.join(directory, "book.gnucash")
+        scaling.make_book(book, args.backend, args.size)
+        copies = []
+        for name in ("sequential", "pipelined"):
+            copy = os.path.join(directory, name + ".gnucash")
+            shutil.copy(book, copy)
+            copies.append(scaling.book_uri(args.backend, copy))
+        csv_parser.clear_caches()
+        (parse, write) = import_one_step_at_a_time(copies[0], rows)
+        csv_parser.clear_caches()
+        pipelined = import_pipelined(copies[1], rows)
+
+    print("rows:       ", args.rows)
+    print("parse:      ", "{:.2f}s".format(parse))
+    print("write:      ", "{:.2f}s".format(write))
+    print("sequential: ", "{:.2f}s".format(parse + write))
+    print("pipelined:  ", "{:.2f}s".format(pipelined))
+    print("overlapped: ", "{:.2f}s".format(parse + write - pipelined))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Does decoding the numbers and dates a column at a time pay?
+
+Makes up ROWS rows (a sale and a payment each, to ROWS/10 customers, as
+in memory_per_row.py), and times csv_parser.Parse on them, cell by cell
+(scalar) and with vectorized=True. The decoding is timed on its own
+too: csv_parser.decode_columns, against decoding the same cells one by
+one with csv_parser.decode_cell (as parse_record does without it).
+Each is timed --repeat times; the best time is reported.
+
+$ python3 benchmarks/vectorized_decoding.py [--rows 100000] [--repeat 3]
+
+Needs NumPy. To compare against another version of ekaterina, point
+--tree at a checkout of it (See: memory_per_row.py).
+"""
+import os
+import sys
+import time
+import argparse
+
+def make_rows(count):
+    customers = max(1, count // 10)
+    return [{"CUSTOMER_NAME": "Customer {}".format(row % customers),
+             "CUSTOMER_ID": str(row % customers),
+             "SALE_DESCRIPTION": "Sale {}".format(row),
+             "QUANTITY": str(1 + row % 7),
+             "UNIT_PRICE": "{}.25".format(row % 1000),
+             "INCOME_ACCOUNT": "Income:Sales",
+             "SALE_DATE": "2021-01-{:02d}".format(1 + row % 28),
+             "CURRENCY": "NPR",
+             "PAYMENT_AMOUNT": "{}.50".format(row % 500),
+             "PAYMENT_DATE": "2021-01-{:02d}".format(1 + row % 28)}
+            for row in range(count)]
+
+def best_time(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def decode_cell_by_cell(csv_parser, records, kinds):
+    for (record, (is_sale, is_payment)) in zip(records, kinds):
+        fields = ((csv_parser.SALE_DECODED_FIELDS if is_sale else set())
+                  | (csv_parser.PAYMENT_DECODED_FIELDS if is_payment else set()))
+        for field in fields:
+            text = csv_parser.get(field, record)
+            if text:
+                csv_parser.decode_cell(field, text)
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("--rows", type=int, default=100000)
+    argparser.add_argument("--repeat", type=int, default=3)
+    argparser.add_argument("--tree", default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), ".."),
+                           help="the ekaterina source tree to measure")
+    args = argparser.parse_args()
+
+    sys.path.insert(0, os.path.abspath(args.tree))
+    from ekaterina.parsers import csv_parser, columnar
+    if not columnar.HAVE_NUMPY:
+        sys.exit("NumPy is not installed: nothing to compare.")
+
+    rows = make_rows(args.rows)
+    kinds = [csv_parser.record_kind(record) for record in rows]
+    timings = [
+        ("decode, cell by cell:", lambda: decode_cell_by_cell(
+            csv_parser, rows, kinds)),
+        ("decode, by column:   ", lambda: csv_parser.decode_columns(
+            rows, kinds=kinds)),
+        ("Parse, scalar:       ", lambda: csv_parser.Parse(rows)),
+        ("Parse, vectorized:   ", lambda: csv_parser.Parse(
+            rows, vectorized=True)),
+    ]
+
+    print("tree:                 ", os.path.abspath(args.tree))
+    print("rows:                 ", args.rows)
+    for (name, function) in timings:
+        csv_parser.clear_caches()
+        print(name, " {:.3f}s".format(best_time(function, args.repeat)))
+
+if __name__ == "__main__":
+    main()
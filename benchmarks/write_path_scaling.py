@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Does writing to a book get slower as the book grows?
+
+For each book size, makes up a .gnucash book with that many invoices
+(and a tenth as many customers, and a hundredth as many income accounts),
+then imports the same spreadsheet's worth of rows into a fresh copy of
+it, timing mazurka.danse_mazurka and session.save(). The book's
+gnucash_laska.AccountTree is built beforehand, and timed on its own
+(tree). danse_mazurka always looks accounts up in a tree (it builds one
+if it isn't given any), so the lookups it replaced are timed separately:
+every account the rows refer to is looked up from the root of the book
+(root lookups: mazurka.ekat_to_gnc_Account without a tree), and then in
+the tree (tree lookups). The tree pays for itself where tree + tree
+lookups comes to less than root lookups. Along the way, the parts of the
+write path that might depend on the size of the book are timed on their
+own too:
+
+customers  mazurka.ekat_to_gnc_Customer (GNCBook.CustomerLookupByID)
+accounts   mazurka.ekat_to_gnc_Account
+IDs        mazurka.next_invoice_ID (the invoice counter)
+lots       mazurka.OpenLotIndex.index_account (the scans for open lots)
+
+$ python3 benchmarks/write_path_scaling.py [--sizes 1000,10000,100000,1000000]
+      [--rows 1000] [--backend xml|sqlite3] [--books DIR]
+
+Making the big books takes a while, so they are kept in --books (if
+given) and reused on the next run. Each measurement is made on a copy.
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import functools
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import gnucash
+from gnucash import gnucash_core_c
+
+from ekaterina import mazurka
+from ekaterina.parsers import csv_parser
+from ekaterina.utils import gnucash_laska
+
+CURRENCY = "NPR"
+RECEIVABLE_ACCOUNT = "Assets:Accounts Receivable"
+TRANSFER_ACCOUNT = "Assets:Cash"
+
+def new_session(uri):
+    try:
+        from gnucash import SessionOpenMode
+    except ImportError: # GNUCash < 4
+        return gnucash.Session(uri, is_new=True)
+    return gnucash.Session(uri, SessionOpenMode.SESSION_NEW_STORE)
+
+def book_uri(backend, path):
+    return "{}://{}".format(backend, os.path.abspath(path))
+
+def customer_ID(number):
+    return "{:06d}".format(number)
+
+def income_account(number):
+    return "Income:Sales {}".format(number)
+
+def add_account(GNCBook, parent, name, account_type, currency):
+    account = gnucash.Account(GNCBook)
+    account.BeginEdit()
+    account.SetName(name)
+    account.SetType(account_type)
+    account.SetCommodity(currency)
+    parent.append_child(account)
+    account.CommitEdit()
+    return account
+
+def make_rows(customers, accounts, count, date, offset=0):
+    """count sale rows (every other one with a payment), customer by customer"""
+    rows = []
+    for row in range(offset, offset + count):
+        customer = row % customers
+        record = {"CUSTOMER_NAME": "Customer {}".format(customer),
+                  "CUSTOMER_ID": customer_ID(customer),
+                  "SALE_DESCRIPTION": "Sale {}".format(row),
+                  "QUANTITY": str(1 + row % 7),
+                  "UNIT_PRICE": "{}.25".format(row % 1000),
+                  "INCOME_ACCOUNT": income_account(row % accounts),
+                  "SALE_DATE": date,
+                  "CURRENCY": CURRENCY,
+                  "POST_DATE": date,
+                  "DUE_DATE": date,
+                  "RECEIVABLE_ACCOUNT": RECEIVABLE_ACCOUNT}
+        if row % 2 == 0:
+            record.update({"PAYMENT_AMOUNT": "{}.50".format(row % 500),
+                           "PAYMENT_DATE": date,
+                           "POSTED_ACCOUNT": RECEIVABLE_ACCOUNT,
+                           "PAYMENT_TRANSFER_ACCOUNT": TRANSFER_ACCOUNT})
+        rows.append(record)
+    return rows
+
+def book_shape(size):
+    """Book size (invoices) -> (customers, income accounts)"""
+    return (max(1, size // 10), max(1, size // 100))
+
+def make_book(path, backend, size):
+    """Make a book with `size` posted invoices in it, at path"""
+    customers, accounts = book_shape(size)
+    session = new_session(book_uri(backend, path))
+    try:
+        book = session.book
+        currency = book.get_table().lookup("CURRENCY", CURRENCY)
+        root = book.get_root_account()
+        assets = add_account(book, root, "Assets",
+                             gnucash_core_c.ACCT_TYPE_ASSET, currency)
+        add_account(book, assets, "Accounts Receivable",
+                    gnucash_core_c.ACCT_TYPE_RECEIVABLE, currency)
+        add_account(book, assets, "Cash",
+                    gnucash_core_c.ACCT_TYPE_CASH, currency)
+        income = add_account(book, root, "Income",
+                             gnucash_core_c.ACCT_TYPE_INCOME, currency)
+        for number in range(accounts):
+            add_account(book, income, "Sales {}".format(number),
+                        gnucash_core_c.ACCT_TYPE_INCOME, currency)
+        for number in range(customers):
+            gnucash.gnucash_business.Customer(
+                book, customer_ID(number), currency,
+                "Customer {}".format(number))
+        # csv_parser merges each customer's sales into one invoice, so
+        # one round of rows makes one invoice per customer.
+        OpenLots = mazurka.OpenLotIndex()
+        for round_number in range(size // customers):
+            rows = make_rows(customers, accounts, customers, "2020-01-01",
+                             offset=round_number * customers)
+            mazurka.danse_mazurka(book, csv_parser.Parse(rows), OpenLots)
+        session.save()
+    finally:
+        session.end()
+
+class Stopwatch:
+
+    """Adds up the time spent in the functions it wraps"""
+    def __init__(self):
+        self.seconds = {}
+        self.originals = []
+
+    def wrap(self, owner, name, label):
+        function = getattr(owner, name)
+        self.seconds[label] = 0.0
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.seconds[label] += time.perf_counter() - start
+        setattr(owner, name, timed)
+        self.originals.append((owner, name, function))
+
+    def unwrap(self):
+        for (owner, name, function) in reversed(self.originals):
+            setattr(owner, name, function)
+        self.originals = []
+
+def time_lookups(GNCBook, EkatAccounts, Accounts=None):
+    """How long looking up every one of the ekaterina.Accounts takes"""
+    start = time.perf_counter()
+    for EkatAccount in EkatAccounts:
+        mazurka.ekat_to_gnc_Account(GNCBook, EkatAccount, Accounts)
+    return time.perf_counter() - start
+
+def measure(path, backend, size, rows):
+    """Import `rows` rows into (a copy of) the book; return the timings"""
+    customers, accounts = book_shape(size)
+    parsed = csv_parser.Parse(make_rows(customers, accounts, rows,
+                                        "2021-01-01"))
+    EkatAccounts = [EkatAccount for transaction in parsed
+                    for EkatAccount in csv_parser.get_accounts(transaction)]
+    stopwatch = Stopwatch()
+    session = gnucash.Session(book_uri(backend, path))
+    try:
+        root_lookup_seconds = time_lookups(session.book, EkatAccounts)
+        start = time.perf_counter()
+        Accounts = gnucash_laska.AccountTree(session.book)
+        tree_seconds = time.perf_counter() - start
+        tree_lookup_seconds = time_lookups(session.book, EkatAccounts,
+                                           Accounts)
+        # (The lookups above aren't the write's: they're not counted in.)
+        stopwatch.wrap(mazurka, "ekat_to_gnc_Customer", "customers")
+        stopwatch.wrap(mazurka, "ekat_to_gnc_Account", "accounts")
+        stopwatch.wrap(mazurka, "next_invoice_ID", "IDs")
+        stopwatch.wrap(mazurka.OpenLotIndex, "index_account", "lots")
+        start = time.perf_counter()
+        mazurka.danse_mazurka(session.book, parsed, Accounts=Accounts)
+        mazurka_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        session.save()
+        save_seconds = time.perf_counter() - start
+    finally:
+        session.end()
+        stopwatch.unwrap()
+    return dict(stopwatch.seconds, transactions=len(parsed),
+                root_lookups=root_lookup_seconds, tree=tree_seconds,
+                tree_lookups=tree_lookup_seconds, mazurka=mazurka_seconds,
+                save=save_seconds)
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("--sizes", default="1000,10000,100000,1000000",
+                           help="book sizes (invoices), comma separated")
+    argparser.add_argument("--rows", type=int, default=1000,
+                           help="rows to import into each book")
+    argparser.add_argument("--backend", choices=("xml", "sqlite3"),
+                           default="xml")
+    argparser.add_argument("--books", help="keep the books made here")
+    args = argparser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    books = args.books or tempfile.mkdtemp(prefix="ekaterina-books-")
+    os.makedirs(books, exist_ok=True)
+    scratch = tempfile.mkdtemp(prefix="ekaterina-scaling-")
+
+    columns = ["book size", "customers", "accounts", "root lookups s",
+               "tree s", "tree lookups s", "mazurka s", "rows/s",
+               "customers s", "accounts s", "IDs s", "lots s", "save s"]
+    print(" | ".join("{:>11}".format(column) for column in columns))
+    try:
+        for size in sizes:
+            book = os.path.join(books, "book-{}.{}".format(size, args.backend))
+            if not os.path.exists(book):
+                make_book(book, args.backend, size)
+            copy = os.path.join(scratch, os.path.basename(book))
+            shutil.copy(book, copy)
+            timings = measure(copy, args.backend, size, args.rows)
+            customers, accounts = book_shape(size)
+            print(" | ".join("{:>11}".format(value) for value in [
+                size, customers, accounts,
+                "{:.2f}".format(timings["root_lookups"]),
+                "{:.2f}".format(timings["tree"]),
+                "{:.2f}".format(timings["tree_lookups"]),
+                "{:.2f}".format(timings["mazurka"]),
+                "{:.0f}".format(args.rows / timings["mazurka"]),
+                "{:.2f}".format(timings["customers"]),
+                "{:.2f}".format(timings["accounts"]),
+                "{:.2f}".format(timings["IDs"]),
+                "{:.2f}".format(timings["lots"]),
+                "{:.2f}".format(timings["save"])]), flush=True)
+    finally:
+        shutil.rmtree(scratch)
+        if not args.books:
+            shutil.rmtree(books)
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,185 @@
 import sys
+import argparse
 
 import gnucash
 
+from ekaterina import batch
+from ekaterina import catalog
 from ekaterina import mazurka
+from ekaterina import pipeline
+from ekaterina import progress
+from ekaterina import watermark
 from ekaterina import classes as Ekat
-from ekaterina.readers import ods_reader
+from ekaterina.readers import registry
+from ekaterina.parsers import rules
 from ekaterina.parsers import csv_parser
 
-if len(sys.argv) < 3:
-    print("USAGE: ekaterina ODS_FILE GNUCASH_FILE")
-    sys.exit(1)
+argparser = argparse.ArgumentParser(prog="ekaterina")
+argparser.add_argument("odsfile", metavar="ODS_FILE",
+                       help=("a spreadsheet: .ods, .xlsx or .csv (which may "
+                             "be compressed)"))
+argparser.add_argument("gnucashfile", metavar="GNUCASH_FILE")
+argparser.add_argument("--sheet", action="append", dest="sheets",
+                       metavar="NAME", help="read the sheet with this name")
+argparser.add_argument("--sheet-index", action="append", dest="sheets",
+                       type=int, metavar="N",
+                       help="read the N-th sheet (counting from 0)")
+argparser.add_argument("--all-sheets", action="store_true",
+                       help="read every sheet")
+argparser.add_argument("--merge-payments", action="store_true",
+                       help=("merge a customer's payments made on the same "
+                             "day, to and from the same accounts"))
+argparser.add_argument("--deferred-autopay", action="store_true",
+                       help=("post all the invoices first, then apply the "
+                             "customers' credits to them in one go"))
+argparser.add_argument("--vectorized", action="store_true",
+                       help=("decode the numbers and dates a column at a "
+                             "time (needs NumPy)"))
+argparser.add_argument("--rejects", metavar="CSV_FILE",
+                       help=("set the rows that can't be parsed aside in "
+                             "CSV_FILE (with why), and import the rest"))
+argparser.add_argument("--max-entries-per-invoice",
+                       type=csv_parser.positive_int, metavar="N",
+                       help=("split a customer's sales into invoices of at "
+                             "most N entries"))
+argparser.add_argument("--split-invoices-by",
+                       choices=sorted(csv_parser.SPLIT_PERIODS),
+                       dest="split_period",
+                       help=("split a customer's sales into an invoice per "
+                             "day, week, month or year of sale"))
+argparser.add_argument("--rules", metavar="RULES_FILE",
+                       help=("fill in the columns a row leaves empty (accounts, "
+                             "descriptions) by the rules in RULES_FILE"))
+argparser.add_argument("--preflight", action="store_true",
+                       help=("check the customers and accounts against the "
+                             "book's catalog (See: ekaterina.catalog) before "
+                             "anything else"))
+argparser.add_argument("--incremental", action="store_true",
+                       help=("import only the rows added since the last "
+                             "--incremental import of this spreadsheet (all "
+                             "of them the first time)"))
+argparser.add_argument("--reimport", action="store_true",
+                       help=("with --incremental: import every row again, "
+                             "even though the spreadsheet has changed since "
+                             "its last import (what it had then will be in "
+                             "the book twice)"))
+argparser.add_argument("--pipelined", action="store_true",
+                       help=("read, parse and write at the same time "
+                             "(the totals can not be shown beforehand)"))
+argparser.add_argument("--grouped-by-customer", action="store_true",
+                       help=("the rows of each customer come together "
+                             "(lets --pipelined write customers sooner)"))
+args = argparser.parse_args()
+if args.all_sheets:
+    if args.sheets:
+        argparser.error("--all-sheets does not go with --sheet or "
+                        "--sheet-index")
+    args.sheets = registry.ALL_SHEETS
+if args.pipelined and args.rejects:
+    argparser.error("--rejects does not work with --pipelined")
+if args.pipelined and args.preflight:
+    argparser.error("--preflight does not work with --pipelined")
+if args.reimport and not args.incremental:
+    argparser.error("--reimport only goes with --incremental")
+compiled_rules = None
+if args.rules:
+    try:
+        compiled_rules = rules.load_rules(args.rules)
+    except rules.RulesError as error:
+        argparser.error(str(error))
 
-odsfile = sys.argv[1]
-gnucashfile = sys.argv[2]
+odsfile = args.odsfile
+gnucashfile = args.gnucashfile
 print("*" * 80)
 print(".ods file:", odsfile)
+if args.sheets:
+    print("sheets:", args.sheets)
 print(".gnucash file:", gnucashfile)
 print("*" * 80)
 input("Press Enter to continue, Ctrl+C to cancel. ")
 
-read = ods_reader.Read(odsfile)
-parsed = csv_parser.Parse(read)
+def print_batch(Batch):
+    Batch.write(gnucashfile)
+    if args.incremental:
+        marks.set(odsfile, mark, Batch.ID, sheets=args.sheets)
+        marks.save()
+    print("Batch: {} (to undo it: python3 -m ekaterina.rollback {} {})".format(
+        Batch.ID, Batch.ID, gnucashfile))
+
+Batch = batch.Batch()
+
+# (Incremental imports need the rows whole. See: watermark.py)
+reader_options = (watermark.reader_options() if args.incremental
+                  else csv_parser.reader_options(
+                      compiled_rules, quarantine=args.rejects is not None))
+try:
+    read = registry.Read(odsfile, sheets=args.sheets, **reader_options)
+except registry.ReaderError as error:
+    sys.exit(str(error))
+
+if args.incremental:
+    try:
+        marks = watermark.Watermarks(gnucashfile)
+    except watermark.WatermarkError as error:
+        sys.exit(str(error))
+    try:
+        (read, mark, incremental) = watermark.new_rows(
+            read, marks.get(odsfile, args.sheets), reimport=args.reimport)
+    except watermark.WatermarkError as error:
+        sys.exit("{}. Nothing was written. (To import it all the same: "
+                 "--reimport)".format(error))
+    print("*" * 80)
+    if incremental:
+        print("Rows already imported = {}, new rows = {}".format(
+            mark.rows - len(read), len(read)))
+    else:
+        print("Importing every row ({}): the spreadsheet is new{}".format(
+            len(read), " (or --reimport)" if args.reimport else ""))
+    if not read:
+        print("Nothing new to import.")
+        sys.exit(0)
+
+if args.pipelined:
+    print("*" * 80)
+    print("Pipelined: the totals will not be shown before writing.")
+    print("*" * 80)
+    input("POSITIVELY SURE? (CTRL+C TO CANCEL!!!): ")
+    print("\nWriting to the .gnucash file, as the rows are read.\n")
+    written = pipeline.Run(
+        read, gnucashfile,
+        grouped_by_customer=args.grouped_by_customer,
+        merge_payments_on_the_same_day=args.merge_payments,
+        deferred_autopay=args.deferred_autopay,
+        Batch=Batch,
+        max_entries_per_invoice=args.max_entries_per_invoice,
+        split_period=args.split_period,
+        rules=compiled_rules)
+    print("Transactions written:", len(written))
+    print_batch(Batch)
+    print("Done.")
+    sys.exit(0)
+
+rejects = None if args.rejects is None else []
+parsed = csv_parser.Parse(
+    read, merge_payments_on_the_same_day=args.merge_payments,
+    vectorized=args.vectorized, rejects=rejects,
+    max_entries_per_invoice=args.max_entries_per_invoice,
+    split_period=args.split_period, rules=compiled_rules)
+if rejects is not None:
+    # Even with none: a rejects file left from the last run would pass
+    # for this run's.
+    csv_parser.write_rejects(rejects, args.rejects)
+    print("*" * 80)
+    print("Rows rejected = {} (See: {})".format(len(rejects), args.rejects))
+
+if args.preflight:
+    with catalog.Refresh(gnucashfile) as book_catalog:
+        report = catalog.Preflight(parsed, book_catalog)
+    if any(report):
+        print("*" * 80)
+        print(catalog.format_preflight(report))
+    if report.unknown_customers or report.unknown_accounts:
+        sys.exit("Preflight failed: nothing was written.")
 
 total_parsed_payment_amount = sum(
     [  ekat_payment.get_payment_amount().to_double()
@@ -46,7 +205,11 @@ input("POSITIVELY SURE? (CTRL+C TO CANCEL!!!): ")
 print("\nWriting to the .gnucash file.\n")
 gncsession = gnucash.Session(gnucashfile)
 gncbook = gncsession.book
-mazurka.danse_mazurka(gncbook, parsed)
+mazurka.danse_mazurka(gncbook, parsed,
+                      deferred_autopay=args.deferred_autopay,
+                      Batch=Batch,
+                      progress=progress.terminal_progress())
 gncsession.save()
 gncsession.end()
+print_batch(Batch)
 print("Done.")
@@ -0,0 +1,168 @@
+"""
+Import batches: what an import made, so that it can be unmade.
+
+Undoing a bad import used to mean going back to a backup of the whole
+book, and losing everything done since. Now, each import is a Batch:
+- every invoice and payment transaction the Mazurka makes is tagged
+  with the batch ID (in its notes), and
+- the GUIDs of everything it made (invoices, their entries, payment
+  transactions) are kept in a sidecar file next to the book, once the
+  book has been saved: <book>.batches/<batch ID>.json
+
+Rollback() then goes straight to those objects, and deletes them (and
+only them: anything that isn't tagged with the batch is left alone),
+without looking at the rest of the book.
+
+The lot links GnuCash makes as it applies payments to invoices (and
+credits to invoices, with Autopay) aren't tagged: they're GnuCash's.
+Unposting the batch's invoices takes the links to them away (GnuCash
+does that itself), and the links of the batch's payments to anything
+else (invoices from before, say) are deleted along with the payments.
+So nothing is left linking lots to what's gone.
+"""
+import os
+import json
+import secrets
+import datetime
+
+from ekaterina.utils import gnucash_laska
+
+class BatchError(Exception):
+    pass
+
+TAG_PREFIX = "ekaterina-batch: "
+
+def new_batch_ID():
+    """A batch ID: when it was made, and a bit of randomness"""
+    return "{}-{}".format(datetime.datetime.now().strftime("%Y%m%d-%H%M%S"),
+                          secrets.token_hex(3))
+
+def batches_directory(gnucashfile):
+    return "{}.batches".format(gnucashfile)
+
+def batch_path(gnucashfile, batch_ID):
+    return os.path.join(batches_directory(gnucashfile),
+                        "{}.json".format(batch_ID))
+
+class Batch:
+
+    """
+    The objects an import made, by their GUIDs (strings).
+
+    Pass one to mazurka.danse_mazurka to have it filled in; write() it
+    once the book has been saved.
+    """
+    def __init__(self, ID=None):
+        self.ID = ID or new_batch_ID()
+        self.invoices = []
+        self.entries = []
+        self.transactions = []
+
+    @property
+    def tag(self):
+        """What the notes of the batch's invoices and payments say"""
+        return TAG_PREFIX + self.ID
+
+    def add_invoice(self, GNCInvoice):
+        self.invoices.append(gnucash_laska.get_guid_string(GNCInvoice))
+        self.entries.extend(gnucash_laska.get_guid_string(entry)
+                            for entry in GNCInvoice.GetEntries())
+
+    def add_transaction(self, GNCTransaction):
+        self.transactions.append(gnucash_laska.get_guid_string(GNCTransaction))
+
+    def __len__(self):
+        return len(self.invoices) + len(self.transactions)
+
+    def to_dict(self):
+        return {"batch": self.ID, "invoices": self.invoices,
+                "entries": self.entries, "transactions": self.transactions}
+
+    @classmethod
+    def from_dict(cls, batch):
+        Batch = cls(batch["batch"])
+        Batch.invoices = list(batch["invoices"])
+        Batch.entries = list(batch["entries"])
+        Batch.transactions = list(batch["transactions"])
+        return Batch
+
+    def write(self, gnucashfile):
+        """Write the batch's sidecar file (See: batch_path), and return it"""
+        path = batch_path(gnucashfile, self.ID)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as sidecar:
+            json.dump(dict(self.to_dict(), book=os.path.abspath(gnucashfile),
+                           created=datetime.datetime.now().isoformat()),
+                      sidecar, indent=1)
+        return path
+
+def read_batch(gnucashfile, batch_ID):
+    """Return the Batch of that ID, from its sidecar file"""
+    path = batch_path(gnucashfile, batch_ID)
+    try:
+        with open(path) as sidecar:
+            return Batch.from_dict(json.load(sidecar))
+    except FileNotFoundError:
+        raise BatchError("No batch '{}' for '{}' (no {})".format(
+            batch_ID, gnucashfile, path))
+    except (ValueError, KeyError) as error:
+        raise BatchError("Could not read '{}': {!r}".format(path, error))
+
+def Rollback(GNCBook, Batch):
+    """
+    Delete everything the Batch made from GNCBook: its invoices first,
+    unposted (which takes the lot links to them with it), along with
+    their entries, and then its payment transactions, along with their
+    lot links to whatever else they paid.
+
+    Objects that are gone already, or that aren't tagged with the batch
+    (or, for entries, aren't in an invoice of the batch), are left
+    alone. Return {"deleted": n, "missing": n, "untagged": n, "links":
+    n}, where deleted counts invoices and payments.
+    """
+    counts = {"deleted": 0, "missing": 0, "untagged": 0, "links": 0}
+    Invoices = {}
+    for guid in Batch.invoices:
+        Invoice = gnucash_laska.lookup_invoice(GNCBook, guid)
+        if Invoice is None:
+            counts["missing"] += 1
+        elif Invoice.GetNotes() != Batch.tag:
+            counts["untagged"] += 1
+        else:
+            if Invoice.IsPosted():
+                Invoice.Unpost(True)
+            Invoices[guid] = Invoice
+    # Invoices don't take their entries with them.
+    for guid in Batch.entries:
+        Entry = gnucash_laska.lookup_entry(GNCBook, guid)
+        if Entry is None:
+            continue
+        Invoice = Entry.GetInvoice()
+        if Invoice is None or \
+           gnucash_laska.get_guid_string(Invoice) not in Invoices:
+            continue
+        Invoice.RemoveEntry(Entry)
+        Entry.BeginEdit()
+        Entry.Destroy()
+    for Invoice in Invoices.values():
+        Invoice.BeginEdit()
+        Invoice.Destroy()
+        counts["deleted"] += 1
+
+    for guid in Batch.transactions:
+        Transaction = gnucash_laska.lookup_transaction(GNCBook, guid)
+        if Transaction is None:
+            counts["missing"] += 1
+        elif Transaction.GetNotes() != Batch.tag:
+            counts["untagged"] += 1
+        else:
+            for Link in gnucash_laska.get_lot_links(Transaction):
+                Link.BeginEdit()
+                Link.Destroy()
+                Link.CommitEdit()
+                counts["links"] += 1
+            Transaction.BeginEdit()
+            Transaction.Destroy()
+            Transaction.CommitEdit()
+            counts["deleted"] += 1
+    return counts
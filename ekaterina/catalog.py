@@ -0,0 +1,299 @@
+"""
+A catalog of a book: its customers, accounts, currencies and invoice
+IDs, in a small SQLite file next to it, <book>.catalog.sqlite.
+
+Finding out whether a spreadsheet's customers and accounts are in the
+book used to mean opening the book: loading the whole of a big XML
+book, and locking it while at it. The catalog has all it takes to check
+a spreadsheet beforehand (See: Preflight), without the book.
+
+The catalog remembers the modification time (and size) of the book it
+was made from. Refresh() makes it again only if the book has changed
+since; otherwise, it's used as is, and the book is not opened at all.
+
+Usage:
+    python3 -m ekaterina.catalog GNUCASH_FILE [--force] \\
+        [--check SPREADSHEET [--check SPREADSHEET ...]]
+"""
+import os
+import sys
+import sqlite3
+import argparse
+import datetime
+import collections
+
+import gnucash
+
+from ekaterina.readers import registry
+from ekaterina.parsers import csv_parser
+from ekaterina.utils import gnucash_laska
+from ekaterina import classes as Ekat
+
+class CatalogError(Exception):
+    pass
+
+SCHEMA = """
+CREATE TABLE book (path TEXT, mtime_ns INTEGER, size INTEGER, made TEXT,
+                   invoices INTEGER, last_invoice_id TEXT);
+CREATE TABLE customers (id TEXT PRIMARY KEY, name TEXT, currency TEXT);
+CREATE TABLE accounts (name TEXT, currency TEXT, type INTEGER);
+CREATE INDEX accounts_name ON accounts (name);
+"""
+
+def catalog_path(gnucashfile):
+    return "{}.catalog.sqlite".format(gnucashfile)
+
+def book_stamp(gnucashfile):
+    """What the catalog goes by to tell whether the book has changed"""
+    try:
+        stat = os.stat(gnucashfile)
+    except OSError as error:
+        raise CatalogError("Could not read '{}': {}".format(gnucashfile, error))
+    return (stat.st_mtime_ns, stat.st_size)
+
+def iter_customers(GNCBook):
+    """Yield every gnucash.Customer in the book, one at a time"""
+    query = gnucash.Query()
+    query.search_for("gncCustomer")
+    query.set_book(GNCBook)
+    try:
+        for result in query.run():
+            yield gnucash.gnucash_business.Customer(instance=result)
+    finally:
+        query.destroy()
+
+def invoice_ID_order(ID):
+    """Sorts invoice IDs the way the counter hands them out"""
+    return (len(ID), ID)
+
+def extract(GNCBook):
+    """
+    Return what goes into a catalog, out of GNCBook: (customers,
+    accounts, invoice count, last invoice ID), where customers are
+    (ID, name, currency) and accounts (full name, currency, type).
+    """
+    # (The exporter already knows its way around the invoices.)
+    from ekaterina.exporters.csv_exporter import iter_invoices
+
+    customers = [(Customer.GetID(), Customer.GetName(),
+                  Customer.GetCurrency().get_mnemonic())
+                 for Customer in iter_customers(GNCBook)]
+    Accounts = gnucash_laska.AccountTree(GNCBook)
+    accounts = [(name, Account.GetCommodity().get_mnemonic(), Account.GetType())
+                for (name, same_name) in Accounts.accounts.items()
+                for Account in same_name]
+    invoice_IDs = [Invoice.GetID() for Invoice in iter_invoices(GNCBook)]
+    last_invoice_ID = max(invoice_IDs, key=invoice_ID_order, default=None)
+    return (customers, accounts, len(invoice_IDs), last_invoice_ID)
+
+def write_catalog(path, gnucashfile, stamp, customers, accounts, invoices,
+                  last_invoice_ID):
+    """
+    Write a catalog to path. It's written next to it first, and moved
+    into place once it's complete, so a catalog is never half-written.
+    """
+    temporary = path + ".new"
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    connection = sqlite3.connect(temporary)
+    try:
+        with connection:
+            connection.executescript(SCHEMA)
+            connection.execute(
+                "INSERT INTO book VALUES (?, ?, ?, ?, ?, ?)",
+                (os.path.abspath(gnucashfile), stamp[0], stamp[1],
+                 datetime.datetime.now().isoformat(), invoices,
+                 last_invoice_ID))
+            connection.executemany(
+                "INSERT OR REPLACE INTO customers VALUES (?, ?, ?)", customers)
+            connection.executemany(
+                "INSERT INTO accounts VALUES (?, ?, ?)", accounts)
+    finally:
+        connection.close()
+    os.replace(temporary, path)
+
+def Build(gnucashfile, path=None):
+    """Make the book's catalog (opening the book, read only). Return it."""
+    path = path or catalog_path(gnucashfile)
+    stamp = book_stamp(gnucashfile)
+    session = gnucash_laska.open_session_read_only(gnucashfile)
+    try:
+        extracted = extract(session.book)
+    finally:
+        session.end()
+    write_catalog(path, gnucashfile, stamp, *extracted)
+    return Catalog(path)
+
+def Refresh(gnucashfile, path=None, force=False):
+    """
+    Return the book's Catalog, made again first only if the book has
+    changed since it was made (or if forced to).
+    """
+    path = path or catalog_path(gnucashfile)
+    if not force and os.path.exists(path):
+        catalog = Catalog(path)
+        if catalog.is_fresh(gnucashfile):
+            return catalog
+        catalog.close()
+    return Build(gnucashfile, path)
+
+class KnownAccounts:
+
+    """
+    The catalog's account names, for csv_parser.Parse's known_accounts
+    (like a gnucash_laska.AccountTree, without the gnucash.Accounts).
+    """
+    def __init__(self, names):
+        self.accounts = set(names)
+
+    def __contains__(self, full_name):
+        return full_name in self.accounts
+
+    def names(self):
+        return list(self.accounts)
+
+    def suggest(self, full_name):
+        return gnucash_laska.suggest_account_names(full_name, self.accounts)
+
+class Catalog:
+
+    """A book's catalog, read from its SQLite file (See: Build, Refresh)"""
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise CatalogError("No catalog at '{}'".format(path))
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        try:
+            (self.book, self.mtime_ns, self.size, self.made, self.invoices,
+             self.last_invoice_ID) = self.connection.execute(
+                 "SELECT path, mtime_ns, size, made, invoices, last_invoice_id"
+                 " FROM book").fetchone()
+        except (sqlite3.DatabaseError, TypeError) as error:
+            self.connection.close()
+            raise CatalogError("'{}' is not a catalog: {}".format(path, error))
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def is_fresh(self, gnucashfile):
+        """Whether the book is just as it was when the catalog was made"""
+        return book_stamp(gnucashfile) == (self.mtime_ns, self.size)
+
+    def customer(self, ID):
+        """Return the customer's (name, currency), or None"""
+        return self.connection.execute(
+            "SELECT name, currency FROM customers WHERE id = ?",
+            (ID,)).fetchone()
+
+    def customers(self):
+        """{ID: (name, currency)}"""
+        return {ID: (name, currency) for (ID, name, currency)
+                in self.connection.execute("SELECT * FROM customers")}
+
+    def known_accounts(self):
+        return KnownAccounts(name for (name,) in self.connection.execute(
+            "SELECT name FROM accounts"))
+
+    def currencies(self):
+        """The currencies of the book's customers and accounts"""
+        return {currency for (currency,) in self.connection.execute(
+            "SELECT currency FROM customers UNION SELECT currency FROM accounts")}
+
+# What Preflight found: unknown customers [(ID, name)], customers the
+# spreadsheet names otherwise [(ID, name in the book, name in the
+# spreadsheet)], customers billed in another currency [(ID, book
+# currency, spreadsheet currency)], and unknown accounts [error message].
+PreflightReport = collections.namedtuple(
+    "PreflightReport", ["unknown_customers", "renamed_customers",
+                        "other_currencies", "unknown_accounts"])
+
+def Preflight(parsed_transactions, catalog):
+    """
+    Check what csv_parser.Parse made of a spreadsheet against the
+    catalog, the way it would go with the book itself. Return a
+    PreflightReport.
+    """
+    customers = catalog.customers()
+    report = PreflightReport([], [], [], [])
+    seen = set()
+    for transaction in parsed_transactions:
+        if isinstance(transaction, Ekat.Invoice):
+            Customer = transaction.get_customer()
+            currency = str(transaction.get_currency())
+        else:
+            Customer = transaction.Customer
+            currency = None
+        ID = Customer.get_ID()
+        if (ID, currency) in seen:
+            continue
+        seen.add((ID, currency))
+        known = customers.get(ID)
+        if known is None:
+            if (ID, Customer.get_name()) not in report.unknown_customers:
+                report.unknown_customers.append((ID, Customer.get_name()))
+            continue
+        (name, book_currency) = known
+        if name != Customer.get_name() and \
+           (ID, name, Customer.get_name()) not in report.renamed_customers:
+            report.renamed_customers.append((ID, name, Customer.get_name()))
+        if currency is not None and currency != book_currency:
+            report.other_currencies.append((ID, book_currency, currency))
+    try:
+        csv_parser.check_accounts(parsed_transactions, catalog.known_accounts())
+    except gnucash_laska.AccountLookupError as error:
+        report.unknown_accounts.extend(str(error).split("\n"))
+    return report
+
+def format_preflight(report):
+    lines = []
+    for (ID, name) in report.unknown_customers:
+        lines.append("Unknown customer: {} ({})".format(ID, name))
+    for (ID, book_name, name) in report.renamed_customers:
+        lines.append("Customer {} is '{}' in the book, '{}' here".format(
+            ID, book_name, name))
+    for (ID, book_currency, currency) in report.other_currencies:
+        lines.append("Customer {} is billed in {} in the book, {} here".format(
+            ID, book_currency, currency))
+    lines.extend(report.unknown_accounts)
+    return "\n".join(lines)
+
+def main():
+    argparser = argparse.ArgumentParser(prog="python3 -m ekaterina.catalog")
+    argparser.add_argument("gnucashfile", metavar="GNUCASH_FILE")
+    argparser.add_argument("--force", action="store_true",
+                           help="make the catalog again, changed or not")
+    argparser.add_argument("--check", action="append", default=[],
+                           metavar="SPREADSHEET",
+                           help="check a spreadsheet against the catalog")
+    args = argparser.parse_args()
+
+    try:
+        catalog = Refresh(args.gnucashfile, force=args.force)
+    except CatalogError as error:
+        argparser.error(str(error))
+    with catalog:
+        print("Catalog: {} (made {}): {} customers, {} invoices, last "
+              "invoice ID: {}".format(catalog.path, catalog.made,
+                                      len(catalog.customers()),
+                                      catalog.invoices,
+                                      catalog.last_invoice_ID))
+        failed = False
+        for spreadsheet in args.check:
+            parsed = csv_parser.Parse(registry.Read(
+                spreadsheet, **csv_parser.reader_options()))
+            report = Preflight(parsed, catalog)
+            problems = format_preflight(report)
+            print("{}: {}".format(spreadsheet, "\n" + problems if problems
+                                  else "OK"))
+            failed = failed or bool(report.unknown_customers
+                                    or report.unknown_accounts)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -19,6 +19,9 @@ data in intermediate form. And these objects also act as a filter.
 They are almost statically typed. We need to make absolutely sure that
 no bad data passes through this stage.
 
+They are also immutable, and light: there may be hundreds of thousands
+of them in an import, so none of them carries a __dict__ around.
+
 The following classes will be referred to as ekaterina.X class.
 """
 import re
@@ -27,12 +30,52 @@ import datetime
 
 from ekaterina.utils import gnucash_laska
 
-class Account:
+class Record:
+
+    """
+    The base of all the classes here.
+
+    Each class lists its attributes in __slots__, which does away with
+    the per-object __dict__. And an attribute, once set (in __init__),
+    can not be changed.
+    """
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        if hasattr(self, name):
+            raise AttributeError("Can not change '{}': {} is immutable"
+                                 .format(name, type(self).__name__))
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        raise AttributeError("Can not delete '{}': {} is immutable"
+                             .format(name, type(self).__name__))
+
+    @classmethod
+    def from_validated(cls, **attributes):
+        """
+        Make an object straight out of its attributes (named as in
+        __slots__), without any of the checks in __init__.
+
+        This is for values that have already been checked, all in one go:
+        the parser's, for instance. Anything else must go through the
+        constructor.
+        """
+        record = cls.__new__(cls)
+        for (name, value) in attributes.items():
+            object.__setattr__(record, name, value)
+        return record
+
+class Account(Record):
 
     """An intermediate form to hold GNUCash Account identifiers"""
+    __slots__ = ("account",)
+
     def __init__(self, account_identifier):
-        assert isinstance(account_identifier, str)
-        assert gnucash_laska.is_valid_account_specification(account_identifier)
+        assert isinstance(account_identifier, str), "Expected string"
+        assert gnucash_laska.is_valid_account_specification(
+            account_identifier), "Invalid account: {!r}".format(
+                account_identifier)
         self.account = account_identifier
 
     def __str__(self):
@@ -44,9 +87,11 @@ class Account:
         """
         return self.account
 
-class Currency:
+class Currency(Record):
 
     """An intermediate form for Currency"""
+    __slots__ = ("currency",)
+
     def __init__(self, intl_curr_symbol):
         assert isinstance(intl_curr_symbol, str), "Expected string"
         assert gnucash_laska.is_valid_currency(intl_curr_symbol), "Invalid currency code."
@@ -59,9 +104,11 @@ class Currency:
     def __eq__(self, other):
         return self.currency == other.currency
 
-class Customer:
+class Customer(Record):
 
     """An approximation of a GNUCash Customer"""
+    __slots__ = ("name", "ID")
+
     def __init__(self, name, ID):
         assert isinstance(name, str), "Customer name must be a string"
         assert isinstance(ID, int), "Customer ID must be an integer"
@@ -81,13 +128,16 @@ class Customer:
     def get_ID(self):
         return self.ID
 
-class Sale:
+class Sale(Record):
 
     """
     Sale (noun): an act of selling.
     Each Sale() object approximates a single entry in a GNUCash Invoice.
     A bunch of Sales (made to 1 customer) may go into an Invoice.
     """
+    __slots__ = ("customer", "description", "quantity", "unitprice",
+                 "notes", "income_account", "date", "currency")
+
     def __init__(self, customer, description, quantity, unitprice,
                  notes, income_account, date, currency):
         """
@@ -149,7 +199,7 @@ class Sale:
     def get_incomeaccount(self):
         return self.income_account
 
-class SalesList:
+class SalesList(Record):
 
     """
     A List of Sales.
@@ -157,6 +207,7 @@ class SalesList:
     This class provides the necessary type-checking before a sales list
     is passed to an Invoice() constructor.
     """
+    __slots__ = ("sales", "customer", "currency")
 
     def __init__(self, *sales):
         if len(sales) == 0:
@@ -176,7 +227,7 @@ class SalesList:
         self.customer = customer
         self.currency = currency
 
-class Invoice:
+class Invoice(Record):
 
     """
     An approximation of a GNUCash Invoice.
@@ -184,6 +235,9 @@ class Invoice:
     A list of Sale()s to a single customer. A single Sale() object can make
     a GNUCash Invoice.
     """
+    __slots__ = ("customer", "sales", "postdate", "duedate",
+                 "ReceivableAC", "description")
+
     def __init__(self, customer, sales, postdate=None, duedate=None,
                  ReceivableAC=Account("Assets:Accounts Receivable"),
                  description=None):
@@ -229,7 +283,11 @@ class Invoice:
     def get_ReceivableAC(self):
         return self.ReceivableAC
 
-class Payment:
+class Payment(Record):
+
+    __slots__ = ("Customer", "PaymentAmount", "Refund", "Memo", "PaymentDate",
+                 "PostedAccount", "TransferAccount",
+                 "Num", "GList", "AutoPay", "Transaction")
 
     def __init__(self, Customer, PaymentAmount, Refund=0, Memo="Payment Received",
                  PaymentDate=datetime.date.today(),
@@ -0,0 +1,301 @@
+"""
+Watch-folder import: keep the book open, and import spreadsheets as they
+are dropped into an inbox.
+
+Every run of `python3 -m ekaterina` loads the whole .gnucash file, imports
+one spreadsheet and saves the whole thing back. For a spreadsheet every
+hour, loading and saving the book is most of the work. Here, the book is
+loaded once, and so are the caches built on it (the AccountTree, the
+OpenLotIndex), which stay warm from one spreadsheet to the next. (The
+customers and accounts csv_parser makes, and what the rules made of the
+cells, aren't the book's: they're let go of after each spreadsheet.)
+
+The daemon:
+- polls the inbox for spreadsheets (.ods, .xlsx, .csv, compressed .csv:
+  See readers/registry.py). A file is picked up
+  once it has stopped growing (i.e. it's the same on two polls in a row),
+  so that half-copied files are left alone.
+- imports each file. Files that can't be read or parsed (unknown
+  accounts, etc.) are moved to failed/, along with a <file>.error saying
+  why, and the book is not touched.
+- saves the book every so often (save_every seconds), if anything has
+  been imported, and on the way out. Imported files are moved to done/
+  once the book they were imported into has been saved.
+- makes each file a batch of its own, written out once the book is
+  saved, so that any one file can be rolled back. (See: batch.py)
+
+If writing a file to the book fails halfway, the book (in memory) can no
+longer be trusted, so the daemon stops without saving.
+
+Usage:
+    python3 -m ekaterina.daemon GNUCASH_FILE INBOX [--done DIR] \\
+        [--failed DIR] [--save-every SECONDS] [--poll-every SECONDS] \\
+        [--sheet NAME ...] [--sheet-index N ...] [--all-sheets]
+"""
+import os
+import time
+import signal
+import logging
+import argparse
+import traceback
+
+import gnucash
+
+from ekaterina import batch
+from ekaterina import mazurka
+from ekaterina import progress
+from ekaterina.readers import registry
+from ekaterina.parsers import rules
+from ekaterina.parsers import csv_parser
+from ekaterina.utils import fsutils
+from ekaterina.utils import gnucash_laska
+
+logger = logging.getLogger("ekaterina.daemon")
+
+class DaemonError(Exception):
+    pass
+
+def move_to(directory, path):
+    """
+    Move the file at path into directory (made, if need be), without
+    overwriting what's already there. Return the new path.
+    """
+    os.makedirs(directory, exist_ok=True)
+    destination = fsutils.destination_path(directory, path)
+    (name, extension) = os.path.splitext(destination)
+    count = 1
+    while os.path.exists(destination):
+        destination = "{}.{}{}".format(name, count, extension)
+        count += 1
+    os.replace(path, destination)
+    return destination
+
+class Daemon:
+
+    """
+    Imports the spreadsheets dropped into inbox into gnucashfile, keeping
+    a single gnucash.Session open all along. (See the module docstring.)
+    """
+    def __init__(self, gnucashfile, inbox, done=None, failed=None,
+                 save_every=300, poll_every=5, sheets=None,
+                 merge_payments_on_the_same_day=False,
+                 deferred_autopay=False, max_entries_per_invoice=None,
+                 split_period=None, rules=None):
+        self.gnucashfile = gnucashfile
+        self.inbox = fsutils.standardize_path(inbox)
+        self.done = fsutils.standardize_path(
+            done or os.path.join(self.inbox, "done"))
+        self.failed = fsutils.standardize_path(
+            failed or os.path.join(self.inbox, "failed"))
+        self.save_every = save_every
+        self.poll_every = poll_every
+        self.sheets = sheets
+        self.merge_payments_on_the_same_day = merge_payments_on_the_same_day
+        self.deferred_autopay = deferred_autopay
+        self.max_entries_per_invoice = max_entries_per_invoice
+        self.split_period = split_period
+        # rules.Rules: compiled once. (Their memos are let go of after
+        # each spreadsheet, like csv_parser's caches.)
+        self.rules = rules
+
+        self.session = None
+        self.OpenLots = None
+        self.Accounts = None
+        # {path: (size, mtime)} as of the last poll
+        self.sizes = {}
+        # Imported, but not saved yet, with their batch.Batches.
+        self.unsaved = []
+        self.batches = []
+        self.last_save = time.monotonic()
+        self.stopped = False
+
+    def open(self):
+        self.session = gnucash.Session(self.gnucashfile)
+        self.OpenLots = mazurka.OpenLotIndex()
+        self.Accounts = gnucash_laska.AccountTree(self.session.book)
+        self.last_save = time.monotonic()
+        logger.info("Opened %s", self.gnucashfile)
+
+    def close(self, save=True):
+        """Save (unless told not to), and end the session"""
+        try:
+            if save:
+                self.save()
+        finally:
+            self.session.end()
+            self.session = None
+            logger.info("Closed %s", self.gnucashfile)
+
+    def stop(self, *args):
+        """Stop after the file at hand. (Doubles as a signal handler.)"""
+        self.stopped = True
+
+    def poll(self):
+        """
+        Return the spreadsheets in the inbox that are ready to be
+        imported (the ones that haven't changed since the last poll),
+        oldest first.
+        """
+        sizes = {}
+        for entry in os.scandir(self.inbox):
+            if entry.is_file() and \
+               entry.name.lower().endswith(registry.extensions()):
+                stat = entry.stat()
+                sizes[entry.path] = (stat.st_size, stat.st_mtime)
+        ready = [path for (path, size) in sizes.items()
+                 if self.sizes.get(path) == size]
+        self.sizes = sizes
+        return sorted(ready, key=lambda path: sizes[path][1])
+
+    def import_file(self, spreadsheet):
+        """
+        Import the spreadsheet into the open book. Return True if it was
+        imported, False if it could not be read or parsed (and was moved
+        to failed/).
+
+        Raises DaemonError if the book was left half-written.
+        """
+        logger.info("Importing %s", spreadsheet)
+        try:
+            parsed = csv_parser.Parse(
+                registry.Read(spreadsheet, self.sheets,
+                              **csv_parser.reader_options(self.rules)),
+                merge_payments_on_the_same_day=(
+                    self.merge_payments_on_the_same_day),
+                max_entries_per_invoice=self.max_entries_per_invoice,
+                split_period=self.split_period,
+                rules=self.rules,
+                known_accounts=self.Accounts)
+        except Exception:
+            self.fail(spreadsheet, traceback.format_exc())
+            return False
+        finally:
+            # What's parsed keeps its own; the next file starts afresh.
+            csv_parser.clear_caches()
+            if self.rules is not None:
+                self.rules.clear_memos()
+
+        Batch = batch.Batch()
+        try:
+            mazurka.danse_mazurka(self.session.book, parsed, self.OpenLots,
+                                  deferred_autopay=self.deferred_autopay,
+                                  Accounts=self.Accounts, Batch=Batch,
+                                  progress=progress.logging_progress(logger))
+        except Exception as error:
+            self.fail(spreadsheet, traceback.format_exc())
+            raise DaemonError(
+                "Writing '{}' failed halfway: {!r}".format(spreadsheet, error)
+            ) from error
+        self.unsaved.append(spreadsheet)
+        self.batches.append(Batch)
+        return True
+
+    def fail(self, spreadsheet, reason):
+        logger.error("Failed to import %s:\n%s", spreadsheet, reason)
+        failed = move_to(self.failed, spreadsheet)
+        with open(failed + ".error", "w") as error_file:
+            error_file.write(reason)
+        self.sizes.pop(spreadsheet, None)
+
+    def save(self):
+        """Save the book, and move the files imported into it to done/"""
+        if not self.unsaved:
+            return
+        self.session.save()
+        self.last_save = time.monotonic()
+        for (spreadsheet, Batch) in zip(self.unsaved, self.batches):
+            Batch.write(self.gnucashfile)
+            move_to(self.done, spreadsheet)
+            self.sizes.pop(spreadsheet, None)
+            logger.info("%s is batch %s", spreadsheet, Batch.ID)
+        logger.info("Saved %s (%d files)", self.gnucashfile, len(self.unsaved))
+        self.unsaved = []
+        self.batches = []
+
+    def save_if_due(self):
+        if time.monotonic() - self.last_save >= self.save_every:
+            self.save()
+
+    def run_once(self):
+        """Import whatever is ready in the inbox, and save if it's time"""
+        for spreadsheet in self.poll():
+            if self.stopped:
+                break
+            if spreadsheet in self.unsaved:
+                continue
+            self.import_file(spreadsheet)
+        self.save_if_due()
+
+    def run(self):
+        """Keep importing until stopped (SIGINT, SIGTERM)"""
+        self.open()
+        save = True
+        try:
+            while not self.stopped:
+                self.run_once()
+                time.sleep(self.poll_every)
+        except DaemonError:
+            save = False
+            raise
+        finally:
+            self.close(save=save)
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(prog="python3 -m ekaterina.daemon")
+    argparser.add_argument("gnucashfile", metavar="GNUCASH_FILE")
+    argparser.add_argument("inbox", metavar="INBOX",
+                           help="the directory to watch for spreadsheets")
+    argparser.add_argument("--sheet", action="append", dest="sheets",
+                           metavar="NAME",
+                           help="read the sheet with this name")
+    argparser.add_argument("--sheet-index", action="append", dest="sheets",
+                           type=int, metavar="N",
+                           help="read the N-th sheet (counting from 0)")
+    argparser.add_argument("--all-sheets", action="store_true",
+                           help="read every sheet")
+    argparser.add_argument("--done", metavar="DIR",
+                           help="where imported files go (INBOX/done)")
+    argparser.add_argument("--failed", metavar="DIR",
+                           help="where failed files go (INBOX/failed)")
+    argparser.add_argument("--save-every", type=float, default=300,
+                           metavar="SECONDS",
+                           help="how often to save the book (300)")
+    argparser.add_argument("--poll-every", type=float, default=5,
+                           metavar="SECONDS",
+                           help="how often to look in the inbox (5)")
+    argparser.add_argument("--merge-payments", action="store_true")
+    argparser.add_argument("--deferred-autopay", action="store_true")
+    argparser.add_argument("--max-entries-per-invoice",
+                           type=csv_parser.positive_int, metavar="N")
+    argparser.add_argument("--split-invoices-by", dest="split_period",
+                           choices=sorted(csv_parser.SPLIT_PERIODS))
+    argparser.add_argument("--rules", metavar="RULES_FILE")
+    args = argparser.parse_args(argv)
+    if args.all_sheets:
+        if args.sheets:
+            argparser.error("--all-sheets does not go with --sheet or "
+                            "--sheet-index")
+        args.sheets = registry.ALL_SHEETS
+    compiled_rules = None
+    if args.rules:
+        try:
+            compiled_rules = rules.load_rules(args.rules)
+        except rules.RulesError as error:
+            argparser.error(str(error))
+
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    daemon = Daemon(args.gnucashfile, args.inbox, args.done, args.failed,
+                    save_every=args.save_every, poll_every=args.poll_every,
+                    sheets=args.sheets,
+                    merge_payments_on_the_same_day=args.merge_payments,
+                    deferred_autopay=args.deferred_autopay,
+                    max_entries_per_invoice=args.max_entries_per_invoice,
+                    split_period=args.split_period,
+                    rules=compiled_rules)
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    daemon.run()
+
+if __name__ == "__main__":
+    main()
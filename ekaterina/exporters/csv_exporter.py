@@ -0,0 +1,263 @@
+"""
+Writes a book's invoices and payments back out to CSV.
+
+Ekaterina only ever writes into GnuCash. To see what actually went in
+(and to reconcile it with the spreadsheets it came from), this goes the
+other way round: every entry of every posted customer invoice, and every
+customer payment, becomes a row in the very columns that csv_parser reads
+(the first name of each field in csv_parser.CSVFieldMappings). Feed the
+output back to csv_parser, or diff it against the original.
+
+The book is walked through once, and each row is written as soon as it
+is made, so the rows never pile up in memory:
+- invoices come out of a query on the book, one at a time.
+- payments come out of the receivable accounts, split by split.
+
+Usage:
+    python3 -m ekaterina.exporters.csv_exporter GNUCASH_FILE CSV_FILE \\
+        [--from YYYY-MM-DD] [--to YYYY-MM-DD] [--customer ID ...]
+"""
+import csv
+import datetime
+import argparse
+
+import gnucash
+from gnucash import gnucash_core_c
+
+from ekaterina.parsers import csv_parser
+from ekaterina.utils import gnucash_laska
+
+# The first name of every field is the one written out.
+FIELDS = [
+    "customer_name",
+    "customer_id",
+    "description",
+    "quantity",
+    "unit_price",
+    "note",
+    "income_account",
+    "sale_date",
+    "currency",
+    "post_date",
+    "due_date",
+    "receivable_account",
+    "invoice_description",
+    "payment_amount",
+    "refund",
+    "memo",
+    "payment_date",
+    "posted_account",
+    "payment_transfer_account",
+]
+COLUMNS = {field: csv_parser.CSVFieldMappings[field][0] for field in FIELDS}
+
+def format_date(date):
+    """datetime.date(time) -> YYYY-MM-DD (the way csv_parser wants it)"""
+    return date.strftime(csv_parser.REQUIRED_DATE_FORMAT)
+
+def format_amount(numeric_value):
+    """gnucash.GncNumeric -> '12.5' (no E notation, no trailing zeroes)"""
+    amount = gnucash_laska.decimal_from_gnc_numeric(numeric_value)
+    return format(amount.normalize(), "f")
+
+def to_row(**fields):
+    """{field: text} -> {column name: text}"""
+    return {COLUMNS[field]: text for (field, text) in fields.items()}
+
+def in_date_range(date, start=None, end=None):
+    """Whether the date (or datetime) falls within [start, end]"""
+    if isinstance(date, datetime.datetime):
+        date = date.date()
+    return ((start is None or start <= date)
+            and (end is None or date <= end))
+
+def get_invoice_customer(GNCInvoice):
+    """Return the gnucash.Customer that the invoice is made out to"""
+    owner = GNCInvoice.GetOwner()
+    # A job's invoice belongs to the job's customer.
+    if isinstance(owner, gnucash.gnucash_business.Job):
+        owner = owner.GetOwner()
+    return owner
+
+def is_customer_invoice(GNCInvoice):
+    """Whether it is a customer's (posted) invoice, not a bill or a credit note"""
+    return (GNCInvoice.GetType() == gnucash_core_c.GNC_INVOICE_CUST_INVOICE
+            and GNCInvoice.IsPosted()
+            and not GNCInvoice.GetIsCreditNote())
+
+def iter_invoices(GNCBook):
+    """Yield every gnucash.Invoice in the book, one at a time"""
+    query = gnucash.Query()
+    query.search_for("gncInvoice")
+    query.set_book(GNCBook)
+    try:
+        for result in query.run():
+            yield gnucash.gnucash_business.Invoice(instance=result)
+    finally:
+        query.destroy()
+
+def invoice_rows(GNCInvoice):
+    """Yield a row for every entry in the (posted) gnucash.Invoice"""
+    Customer = get_invoice_customer(GNCInvoice)
+    Entries = GNCInvoice.GetEntries()
+    Description = GNCInvoice.GetPostedTxn().GetDescription()
+    # When an invoice has no description of its own, the descriptions of
+    # its sales are posted instead (See: mazurka.post_gncInvoice). Those
+    # don't belong in INVOICE_DESCRIPTION.
+    if Description == "; ".join(entry.GetDescription() for entry in Entries):
+        Description = ""
+    invoice = dict(
+        customer_name=Customer.GetName(),
+        customer_id=Customer.GetID(),
+        currency=GNCInvoice.GetCurrency().get_mnemonic(),
+        post_date=format_date(GNCInvoice.GetDatePosted()),
+        due_date=format_date(GNCInvoice.GetDateDue()),
+        receivable_account=gnucash_laska.get_account_full_name(
+            GNCInvoice.GetPostedAcc()),
+        invoice_description=Description)
+    for entry in Entries:
+        yield to_row(
+            description=entry.GetDescription(),
+            quantity=format_amount(entry.GetQuantity()),
+            unit_price=format_amount(entry.GetInvPrice()),
+            note=entry.GetNotes(),
+            income_account=gnucash_laska.get_account_full_name(
+                entry.GetInvAccount()),
+            sale_date=format_date(entry.GetDateEntered()),
+            **invoice)
+
+def iter_receivable_accounts(GNCBook):
+    """Yield every Accounts Receivable account of the book"""
+    for accounts in gnucash_laska.AccountTree(GNCBook).accounts.values():
+        for account in accounts:
+            if account.GetType() == gnucash_core_c.ACCT_TYPE_RECEIVABLE:
+                yield account
+
+def get_payment_customer(GNCBook, ReceivableSplits, Transaction):
+    """
+    Return (name, ID) of the customer who made the payment: the owner of
+    the invoice it paid for, or, for a credit (a payment that paid for
+    nothing, or not all of it), the owner of its own lot. (See:
+    gnucash_laska.get_lot_owner_ID)
+
+    For a payment with no owner to be found at all, there's just the
+    name, which GnuCash gives to the payment transaction; the ID is left
+    empty.
+    """
+    for split in ReceivableSplits:
+        lot = split.GetLot()
+        if lot is None:
+            continue
+        lot = gnucash_laska.as_GncLot(lot)
+        invoice = lot.GetInvoiceFromLot()
+        if invoice is not None:
+            Customer = get_invoice_customer(invoice)
+            return (Customer.GetName(), Customer.GetID())
+        ID = gnucash_laska.get_lot_owner_ID(lot)
+        Customer = GNCBook.CustomerLookupByID(ID) if ID is not None else None
+        if Customer is not None:
+            return (Customer.GetName(), Customer.GetID())
+    return (Transaction.GetDescription(), "")
+
+def payment_row(GNCBook, GNCAccount, GNCSplit):
+    """
+    Return the row of the payment that the split (in the receivable
+    account) is a part of, or None if it isn't a payment, or if the row
+    comes from another of the payment's splits.
+
+    A payment applied to more than one invoice has a split in the
+    receivable account for each invoice, but is a single row.
+    """
+    Transaction = GNCSplit.GetParent()
+    if Transaction.GetTxnType() != gnucash_core_c.TXN_TYPE_PAYMENT:
+        return None
+    ReceivableSplits = []
+    TransferSplit = None
+    for split in Transaction.GetSplitList():
+        if gnucash_laska.is_same(split.GetAccount(), GNCAccount):
+            ReceivableSplits.append(split)
+        elif TransferSplit is None:
+            TransferSplit = split
+    # Only the first of the receivable splits makes the row.
+    if not gnucash_laska.is_same(ReceivableSplits[0], GNCSplit):
+        return None
+
+    (name, ID) = get_payment_customer(GNCBook, ReceivableSplits, Transaction)
+    # Payments are credited to the receivable account.
+    amount = -sum(gnucash_laska.decimal_from_gnc_numeric(split.GetAmount())
+                  for split in ReceivableSplits)
+    return to_row(
+        customer_name=name,
+        customer_id=ID,
+        payment_amount=format(amount.normalize(), "f"),
+        memo=GNCSplit.GetMemo(),
+        payment_date=format_date(Transaction.GetDate()),
+        posted_account=gnucash_laska.get_account_full_name(GNCAccount),
+        payment_transfer_account=(
+            gnucash_laska.get_account_full_name(TransferSplit.GetAccount())
+            if TransferSplit is not None else ""))
+
+def Export(GNCBook, csvfile, start=None, end=None, customers=None):
+    """
+    Write the invoices and payments of GNCBook to csvfile, and return the
+    number of rows written.
+
+    start and end (datetime.date, both included) limit the invoices by
+    their post dates and the payments by theirs. customers (a collection
+    of customer IDs) limits them to those customers.
+    """
+    if customers is not None:
+        customers = set(customers)
+
+    def is_wanted(date, customer_ID):
+        return (in_date_range(date, start, end)
+                and (customers is None or customer_ID in customers))
+
+    rows_written = 0
+    with open(csvfile, "w", newline="") as output:
+        writer = csv.DictWriter(output, fieldnames=list(COLUMNS.values()))
+        writer.writeheader()
+        for GNCInvoice in iter_invoices(GNCBook):
+            if not is_customer_invoice(GNCInvoice):
+                continue
+            if not is_wanted(GNCInvoice.GetDatePosted(),
+                             get_invoice_customer(GNCInvoice).GetID()):
+                continue
+            for row in invoice_rows(GNCInvoice):
+                writer.writerow(row)
+                rows_written += 1
+        for GNCAccount in iter_receivable_accounts(GNCBook):
+            for GNCSplit in GNCAccount.GetSplitList():
+                row = payment_row(GNCBook, GNCAccount, GNCSplit)
+                if row is not None and is_wanted(
+                        GNCSplit.GetParent().GetDate(),
+                        row[COLUMNS["customer_id"]]):
+                    writer.writerow(row)
+                    rows_written += 1
+    return rows_written
+
+def main():
+    argparser = argparse.ArgumentParser(
+        prog="python3 -m ekaterina.exporters.csv_exporter")
+    argparser.add_argument("gnucashfile", metavar="GNUCASH_FILE")
+    argparser.add_argument("csvfile", metavar="CSV_FILE")
+    to_date = (lambda text: datetime.datetime.strptime(
+        text, csv_parser.REQUIRED_DATE_FORMAT).date())
+    argparser.add_argument("--from", dest="start", type=to_date,
+                           metavar="YYYY-MM-DD")
+    argparser.add_argument("--to", dest="end", type=to_date,
+                           metavar="YYYY-MM-DD")
+    argparser.add_argument("--customer", action="append", dest="customers",
+                           metavar="ID", help="only this customer's")
+    args = argparser.parse_args()
+
+    session = gnucash_laska.open_session_read_only(args.gnucashfile)
+    try:
+        rows_written = Export(session.book, args.csvfile, args.start,
+                              args.end, args.customers)
+    finally:
+        session.end()
+    print("Rows written:", rows_written)
+
+if __name__ == "__main__":
+    main()
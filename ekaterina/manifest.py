@@ -0,0 +1,295 @@
+"""
+Imports into many books at once, one process per book.
+
+Each legal entity keeps a book of its own, and every month each of
+them gets its spreadsheets imported. One `python3 -m ekaterina` after
+the other, that is a lot of loading, writing and saving on a single
+core. Here, a manifest lists every book with its spreadsheets, and the
+books are imported side by side in a pool of processes. Each book is
+handled by a single worker, start to finish: it opens (and locks) the
+book, parses and writes all of its spreadsheets, and saves it.
+
+The manifest is JSON:
+
+    {"books": [
+        {"book": "moscow.gnucash",
+         "inputs": ["moscow-sales.ods", "moscow-payments.xlsx"],
+         "sheets": ["Sales", "Payments"],
+         "merge_payments": false,
+         "deferred_autopay": false,
+         "max_entries_per_invoice": 500,
+         "split_period": "month",
+         "rules": "moscow-rules.json",
+         "incremental": true,
+         "reimport": false,
+         "rejects": "moscow-rejects.csv"},
+        {"book": "petersburg.gnucash",
+         "inputs": ["petersburg.csv"]}
+    ]}
+
+(Relative paths are relative to the manifest.) "sheets" picks the
+sheets to read of every workbook (.ods, .xlsx) among the inputs: a
+sheet name, an index (from 0), a list of them, or "*" for all of them
+(See: ods_reader.select_sheets). Without it, only the first sheet is
+read. With "rejects", the rows that can't be parsed are set aside there
+(See: csv_parser.Parse), each with the input it came from under
+SOURCE_FILE, and the rest are imported. Without it, a bad row fails the
+book. With "rules", the rows are filled in by the rules first (See:
+rules.py). With "incremental", only the rows added to the inputs since the last
+import are imported (See: watermark.py); an input changed otherwise
+fails the book, unless "reimport" says to import all of it again.
+
+Each book's import is a batch of its own (See: batch.py), and the report
+says which. A book that fails is not saved; the others carry on. Once they are all
+done, a report of every book is printed (and written out as JSON, with
+--report).
+
+Usage:
+    python3 -m ekaterina.manifest MANIFEST [--workers N] [--report FILE]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import gnucash
+
+from ekaterina import batch
+from ekaterina import mazurka
+from ekaterina import watermark
+from ekaterina import classes as Ekat
+from ekaterina.readers import registry
+from ekaterina.parsers import rules
+from ekaterina.parsers import csv_parser
+from ekaterina.utils import fsutils
+from ekaterina.utils import gnucash_laska
+
+class ManifestError(Exception):
+    pass
+
+def is_sheet_selection(sheets):
+    """Whether sheets is one a workbook reader takes (See: load_manifest)"""
+    def is_sheet(sheet):
+        return isinstance(sheet, str) or (isinstance(sheet, int)
+                                          and not isinstance(sheet, bool))
+    if isinstance(sheets, list):
+        return bool(sheets) and all(map(is_sheet, sheets))
+    return is_sheet(sheets)
+
+def load_manifest(manifest):
+    """
+    Read the manifest, and return its books (a list of dicts, as in the
+    manifest, with the paths made absolute).
+
+    Raises ManifestError if it isn't a proper manifest, or if a book is
+    listed more than once (a book can only be imported by one worker).
+    """
+    try:
+        with open(manifest) as manifest_file:
+            books = json.load(manifest_file)
+    except (OSError, ValueError) as error:
+        raise ManifestError("Could not read '{}': {}".format(manifest, error))
+    if isinstance(books, dict):
+        books = books.get("books")
+    if not isinstance(books, list) or not books:
+        raise ManifestError("'{}' lists no books".format(manifest))
+
+    base = os.path.dirname(fsutils.standardize_path(manifest))
+    def absolute(path):
+        return os.path.normpath(os.path.join(base, os.path.expanduser(path)))
+
+    jobs = []
+    seen = set()
+    for (index, book) in enumerate(books):
+        if not (isinstance(book, dict) and isinstance(book.get("book"), str)
+                and isinstance(book.get("inputs"), list)
+                and book["inputs"]):
+            raise ManifestError(
+                "Book #{} needs a \"book\" and a list of \"inputs\"".format(
+                    index + 1))
+        entries = book.get("max_entries_per_invoice")
+        if entries is not None and (type(entries) is not int or entries < 1):
+            raise ManifestError(
+                "Book #{}: \"max_entries_per_invoice\" should be a whole "
+                "number, 1 or more".format(index + 1))
+        if "sheets" in book and not is_sheet_selection(book["sheets"]):
+            raise ManifestError(
+                "Book #{}: \"sheets\" should be a sheet name, an index, a "
+                "list of them, or \"{}\"".format(index + 1,
+                                                 registry.ALL_SHEETS))
+        job = dict(book)
+        job["book"] = absolute(book["book"])
+        job["inputs"] = [absolute(path) for path in book["inputs"]]
+        for option in ("rejects", "rules"):
+            if job.get(option):
+                job[option] = absolute(job[option])
+        if job["book"] in seen:
+            raise ManifestError(
+                "'{}' is listed more than once".format(book["book"]))
+        seen.add(job["book"])
+        jobs.append(job)
+    return jobs
+
+def new_report(job):
+    """A job's report, before anything has been done"""
+    return {"book": job["book"], "inputs": job["inputs"], "ok": False,
+            "invoices": 0, "payments": 0, "rejects": 0, "skipped": 0,
+            "seconds": {}}
+
+def import_book(job):
+    """
+    Import all the inputs of a job (a book of the manifest) into its
+    book, in a session of its own. Return the job's report: a dict with
+    how it went. Never raises: a failure is in the report.
+    """
+    report = new_report(job)
+    started = time.perf_counter()
+    def lap(step):
+        nonlocal started
+        now = time.perf_counter()
+        report["seconds"][step] = round(now - started, 3)
+        started = now
+
+    session = None
+    try:
+        session = gnucash.Session(job["book"])
+        Accounts = gnucash_laska.AccountTree(session.book)
+        lap("load")
+
+        rejects = [] if job.get("rejects") else None
+        compiled_rules = (rules.load_rules(job["rules"])
+                          if job.get("rules") else None)
+        marks = (watermark.Watermarks(job["book"])
+                 if job.get("incremental") else None)
+        new_marks = []
+        parsed = []
+        reader_options = (watermark.reader_options() if marks is not None
+                          else csv_parser.reader_options(
+                              compiled_rules, quarantine=rejects is not None))
+        for spreadsheet in job["inputs"]:
+            read = registry.Read(spreadsheet, job.get("sheets"),
+                                 **reader_options)
+            if marks is not None:
+                (read, mark, incremental) = watermark.new_rows(
+                    read, marks.get(spreadsheet, job.get("sheets")),
+                    reimport=job.get("reimport", False))
+                report["skipped"] += mark.rows - len(read)
+                new_marks.append((spreadsheet, mark))
+            input_rejects = [] if rejects is not None else None
+            parsed.extend(csv_parser.Parse(
+                read,
+                merge_payments_on_the_same_day=job.get("merge_payments",
+                                                       False),
+                known_accounts=Accounts, rejects=input_rejects,
+                max_entries_per_invoice=job.get("max_entries_per_invoice"),
+                split_period=job.get("split_period"),
+                rules=compiled_rules))
+            if rejects is not None:
+                # They all go to the one file: say which input they're from.
+                rejects.extend(
+                    reject._replace(record=dict(reject.record, **{
+                        csv_parser.SOURCE_FILE_FIELD: spreadsheet}))
+                    for reject in input_rejects)
+        if rejects is not None:
+            # (Even an empty one: not last time's.)
+            report["rejects"] = csv_parser.write_rejects(rejects,
+                                                         job["rejects"])
+        report["invoices"] = sum(isinstance(transaction, Ekat.Invoice)
+                                 for transaction in parsed)
+        report["payments"] = sum(isinstance(transaction, Ekat.Payment)
+                                 for transaction in parsed)
+        lap("parse")
+
+        Batch = batch.Batch()
+        mazurka.danse_mazurka(session.book, parsed,
+                              deferred_autopay=job.get("deferred_autopay",
+                                                       False),
+                              Accounts=Accounts, Batch=Batch)
+        lap("write")
+        session.save()
+        Batch.write(job["book"])
+        report["batch"] = Batch.ID
+        if marks is not None:
+            for (spreadsheet, mark) in new_marks:
+                marks.set(spreadsheet, mark, Batch.ID,
+                          sheets=job.get("sheets"))
+            marks.save()
+        lap("save")
+        report["ok"] = True
+    except Exception as error:
+        report["error"] = "{!r}".format(error)
+        report["traceback"] = traceback.format_exc()
+    finally:
+        if session is not None:
+            session.end()
+    return report
+
+def Run(jobs, workers=None):
+    """
+    Import the jobs (See: load_manifest), up to `workers` books at a
+    time (as many as there are CPUs, by default). Return their reports,
+    in the order of the jobs.
+
+    import_book() doesn't raise, but its worker can still die under it
+    (a crash in the bindings, the OOM killer, ...), and take the pool
+    with it. The books it was working on, or that were still waiting,
+    are then reported as failed; the reports of the rest are kept.
+    """
+    reports = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(import_book, job): index
+                   for (index, job) in enumerate(jobs)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                reports[index] = future.result()
+            except Exception as error:
+                reports[index] = new_report(jobs[index])
+                reports[index]["error"] = "{!r}".format(error)
+    return reports
+
+def format_report(reports):
+    """The reports, as a table"""
+    lines = ["{:<30} {:>6} {:>9} {:>9} {:>8} {:>9}".format(
+        "book", "status", "invoices", "payments", "rejects", "seconds")]
+    for report in reports:
+        lines.append("{:<30} {:>6} {:>9} {:>9} {:>8} {:>9.2f}".format(
+            fsutils.get_file_name(report["book"], with_extension=True),
+            "ok" if report["ok"] else "FAILED",
+            report["invoices"], report["payments"], report["rejects"],
+            sum(report["seconds"].values())))
+    for report in reports:
+        if not report["ok"]:
+            lines.append("")
+            lines.append("{}: {}".format(report["book"], report["error"]))
+    return "\n".join(lines)
+
+def main():
+    argparser = argparse.ArgumentParser(prog="python3 -m ekaterina.manifest")
+    argparser.add_argument("manifest", metavar="MANIFEST")
+    argparser.add_argument("--workers", type=int, metavar="N",
+                           help="books to import at a time (one per CPU)")
+    argparser.add_argument("--report", metavar="FILE",
+                           help="write the report out as JSON, too")
+    args = argparser.parse_args()
+
+    try:
+        jobs = load_manifest(args.manifest)
+    except ManifestError as error:
+        argparser.error(str(error))
+    started = time.perf_counter()
+    reports = Run(jobs, args.workers)
+    print(format_report(reports))
+    print("\nBooks: {}, failed: {}, in {:.2f}s".format(
+        len(reports), sum(not report["ok"] for report in reports),
+        time.perf_counter() - started))
+    if args.report:
+        with open(args.report, "w") as report_file:
+            json.dump(reports, report_file, indent=2)
+    sys.exit(0 if all(report["ok"] for report in reports) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -13,14 +13,73 @@ For ekat.X -> gnucash.Y: ekatX_to_gncY()
 import gnucash
 
 from ekaterina import classes
+from ekaterina.utils import gnucash_laska
+from ekaterina.progress import ProgressTracker
 
-def ekat_to_gnc_Account(GNCBook, EkatAccount):
+class OpenLotIndex:
+
+    """
+    The open lots of each customer, account by account: their invoices',
+    and their credits' (overpayments, credit notes).
+
+    When a payment is applied with AutoPay (and no lots), GnuCash walks
+    through every lot of the posted account to find the ones that belong
+    to the customer. That is a full scan of the account per payment. We
+    scan each account only once instead (the first time a payment is
+    posted to it), and then keep the index up to date as invoices are
+    posted, payments leave credits behind, and lots are closed.
+    """
+    def __init__(self):
+        # {account full name: {customer ID: [GncLot, ...]}}
+        self.accounts = {}
+
+    def index_account(self, GNCAccount):
+        """Return {customer ID: [open lots]} for GNCAccount, scanning it
+           if it hasn't been scanned yet."""
+        name = GNCAccount.get_full_name()
+        if name not in self.accounts:
+            customer_lots = {}
+            for lot in GNCAccount.GetLotList():
+                lot = gnucash_laska.as_GncLot(lot)
+                if lot.is_closed():
+                    continue
+                CustomerID = gnucash_laska.get_lot_owner_ID(lot)
+                if CustomerID is not None:
+                    customer_lots.setdefault(CustomerID, []).append(lot)
+            self.accounts[name] = customer_lots
+        return self.accounts[name]
+
+    def get_lots(self, GNCAccount, CustomerID):
+        """Return the open lots of the customer in GNCAccount"""
+        customer_lots = self.index_account(GNCAccount)
+        lots = [lot for lot in customer_lots.get(CustomerID, [])
+                if not lot.is_closed()]
+        customer_lots[CustomerID] = lots
+        return list(lots)
+
+    def add_lot(self, GNCAccount, CustomerID, lot):
+        """Add a freshly made lot (an invoice's, a credit's) to the index"""
+        name = GNCAccount.get_full_name()
+        # If the account hasn't been scanned yet, the scan will find it.
+        if name not in self.accounts or lot.is_closed():
+            return
+        lots = self.accounts[name].setdefault(CustomerID, [])
+        if not any(gnucash_laska.is_same(lot, known) for known in lots):
+            lots.append(lot)
+
+def ekat_to_gnc_Account(GNCBook, EkatAccount, Accounts=None):
     """
     Turn ekaterina.Account into gnucash.Account.
 
     More specifically, turn ekaterina.classes.Account into
     gnucash.gnucash_core.Account.
+
+    If a gnucash_laska.AccountTree of GNCBook is given, the account is
+    looked up in it, and an AccountLookupError (with suggestions) is
+    raised if it isn't there.
     """
+    if Accounts is not None:
+        return Accounts.lookup(EkatAccount.get_account_identifier())
     RootAccount = GNCBook.get_root_account()
     return RootAccount.lookup_by_full_name(
         EkatAccount.get_account_identifier().replace(":", "."))
@@ -44,29 +103,56 @@ def ekat_to_gnc_Customer(GNCBook, EkatCustomer):
     """
     return GNCBook.CustomerLookupByID(EkatCustomer.get_ID())
 
-def ekat_to_gnc_Invoice(GNCBook, EkatInvoice):
+def next_invoice_ID(GNCBook):
+    """
+    Return the next invoice ID, off the book's invoice counter (the same
+    one that GNCBook.InvoiceNextID() uses for customers), so nobody else
+    is going to hand it out again.
+
+    Take it just as the invoice is made: an ID that's taken is gone, and
+    leaves a gap in the numbering if its invoice never gets made.
+    """
+    # Same as InvoiceNextID(), without its owner conversions, which it
+    # goes through for every invoice.
+    return GNCBook.increment_and_format_counter("gncInvoice")
+
+def ekat_to_gnc_Invoice(GNCBook, EkatInvoice, InvoiceID=None, Accounts=None,
+                        Notes=None):
     """
     Turn ekaterina.Invoice into gnucash.Invoice.
 
     More specifically, turn ekaterina.classes.Invoice into
     gnucash.gnucash_business.Invoice.
+
+    The invoice gets the given InvoiceID, or the next one if none is given,
+    and the given Notes, if any.
     """
     # Consult: gnucash_api_docs/html/group__Invoice.html
     # `make gnucash_api_docs` in the project root first.
     Customer   = ekat_to_gnc_Customer(GNCBook, EkatInvoice.get_customer())
     Currency   = ekat_to_gnc_Currency(GNCBook, EkatInvoice.get_currency())
+    if InvoiceID is None:
+        InvoiceID = GNCBook.InvoiceNextID(Customer)
     GNCInvoice = gnucash.gnucash_business.Invoice(
         GNCBook,
-        GNCBook.InvoiceNextID(Customer),
+        InvoiceID,
         Currency,
         Customer)
 
+    # Every change made to an object is committed (i.e. handed over to
+    # the backend) as soon as it is made, unless the object is being
+    # edited. So, hold the invoice open while its entries go in, and
+    # commit it all at the end.
+    GNCInvoice.BeginEdit()
+    if Notes is not None:
+        GNCInvoice.SetNotes(Notes)
     for sale_entry in EkatInvoice.get_entries():
-        ekatSale_to_gncInvoiceEntry(GNCBook, GNCInvoice, sale_entry)
+        ekatSale_to_gncInvoiceEntry(GNCBook, GNCInvoice, sale_entry, Accounts)
+    GNCInvoice.CommitEdit()
 
     return GNCInvoice
 
-def ekatSale_to_gncInvoiceEntry(GNCBook, GNCInvoice, EkatSale):
+def ekatSale_to_gncInvoiceEntry(GNCBook, GNCInvoice, EkatSale, Accounts=None):
     """
     Turn ekaterina.Sale into gnucash.InvoiceEntry.
 
@@ -78,53 +164,178 @@ def ekatSale_to_gncInvoiceEntry(GNCBook, GNCInvoice, EkatSale):
     Description = EkatSale.get_description()
     Quantity = EkatSale.get_quantity()
     UnitPrice = EkatSale.get_unitprice()
-    IncomeAccount = ekat_to_gnc_Account(GNCBook, EkatSale.get_incomeaccount())
+    IncomeAccount = ekat_to_gnc_Account(GNCBook, EkatSale.get_incomeaccount(),
+                                        Accounts)
     InvoiceEntry = gnucash.gnucash_business.Entry(GNCBook, GNCInvoice)
+    # All of it in one edit: one commit instead of one per Set*()
+    InvoiceEntry.BeginEdit()
     InvoiceEntry.SetDateEntered(Date)
     InvoiceEntry.SetDescription(Description)
     InvoiceEntry.SetNotes(Notes)
     InvoiceEntry.SetQuantity(Quantity)
     InvoiceEntry.SetInvPrice(UnitPrice)
     InvoiceEntry.SetInvAccount(IncomeAccount)
+    InvoiceEntry.CommitEdit()
     return InvoiceEntry
 
-def add_ekatInvoice_to_GNCBook(GNCBook, EkatInvoice):
+def post_gncInvoice(GNCBook, GNCInvoice, EkatInvoice, OpenLots=None,
+                    Autopay=True, Accounts=None):
     """
-    Add ekaterina.Invoice to GNCBook.
+    Post the gnucash.Invoice made out of the ekaterina.Invoice.
+
+    If an OpenLotIndex is given, the posted invoice's lot is added to it.
+    With Autopay, any credits (prepayments) the customer has are applied
+    to the invoice as it is posted. (See: apply_credits_to_invoices)
     """
     # Consult: gnucash_api_docs/html/group__Invoice.html
     # gncInvoicePostToAccount()
     # `make gnucash_api_docs` in the project root first.
     # These seem like sane defaults:
     AccumulateSplits = True
-    Autopay = True
     DueDate  = EkatInvoice.get_duedate()
     PostDate = EkatInvoice.get_postdate()
-    ReceivableAC = ekat_to_gnc_Account(GNCBook, EkatInvoice.get_ReceivableAC())
+    ReceivableAC = ekat_to_gnc_Account(GNCBook, EkatInvoice.get_ReceivableAC(),
+                                       Accounts)
     Description = EkatInvoice.get_description()
     if not Description:
         Description = "; ".join(
             [sale.get_description() for sale in EkatInvoice.get_sales().sales])
 
-    Invoice = ekat_to_gnc_Invoice(GNCBook, EkatInvoice)
-    Invoice.PostToAccount(ReceivableAC, PostDate, DueDate, Description,
-                          AccumulateSplits, Autopay)
+    GNCInvoice.PostToAccount(ReceivableAC, PostDate, DueDate, Description,
+                             AccumulateSplits, Autopay)
+    if OpenLots is not None:
+        OpenLots.add_lot(ReceivableAC,
+                         EkatInvoice.get_customer().get_ID(),
+                         GNCInvoice.GetPostedLot())
+
+def add_ekatInvoice_to_GNCBook(GNCBook, EkatInvoice, OpenLots=None,
+                               Autopay=True, Accounts=None, Batch=None):
+    """
+    Add ekaterina.Invoice to GNCBook, and return the posted gnucash.Invoice.
+
+    If a batch.Batch is given, the invoice is tagged with it, and added
+    to it. (See: post_gncInvoice)
+    """
+    Notes = Batch.tag if Batch is not None else None
+    Invoice = ekat_to_gnc_Invoice(GNCBook, EkatInvoice, Accounts=Accounts,
+                                  Notes=Notes)
+    post_gncInvoice(GNCBook, Invoice, EkatInvoice, OpenLots, Autopay, Accounts)
+    if Batch is not None:
+        Batch.add_invoice(Invoice)
+    return Invoice
+
+def add_ekatInvoices_to_GNCBook(GNCBook, EkatInvoices, OpenLots=None,
+                                Autopay=True, Accounts=None, Batch=None,
+                                made=None, posted=None):
+    """
+    Add a bunch of ekaterina.Invoices to GNCBook in one go, and return
+    the posted gnucash.Invoices.
+
+    Each invoice is made (with the next invoice ID, taken just then) and
+    posted in turn. If a batch.Batch is given, the invoices are tagged
+    with it, and each is added to it as soon as it's made: should posting
+    it, or making the next one, fail, what's in the book can still be
+    rolled back. made and posted, if given, are called with each
+    gnucash.Invoice once it has been made, and once it has been posted.
+    (See: next_invoice_ID, post_gncInvoice)
+    """
+    Notes = Batch.tag if Batch is not None else None
+    Invoices = []
+    for EkatInvoice in EkatInvoices:
+        Invoice = ekat_to_gnc_Invoice(GNCBook, EkatInvoice,
+                                      next_invoice_ID(GNCBook), Accounts,
+                                      Notes)
+        if Batch is not None:
+            Batch.add_invoice(Invoice)
+        if made is not None:
+            made(Invoice)
+        post_gncInvoice(GNCBook, Invoice, EkatInvoice, OpenLots, Autopay,
+                        Accounts)
+        if posted is not None:
+            posted(Invoice)
+        Invoices.append(Invoice)
+    return Invoices
+
+def apply_credits_to_invoices(GNCBook, EkatCustomer, EkatReceivableAC, Date,
+                              Accounts=None, OpenLots=None):
+    """
+    Apply whatever credits the customer has in the receivable account to
+    their open invoices there, in a single pass.
+
+    This is what Autopay does for each invoice as it is posted. Doing it
+    once per customer, after all of their invoices have been posted,
+    saves GnuCash from looking for credits all over again for every
+    single invoice.
+
+    If an OpenLotIndex is given, the customer's open lots (invoices and
+    credits) come from the index, instead of GnuCash scanning the whole
+    receivable account for them. Without any, there's nothing to apply.
+    """
+    Customer = ekat_to_gnc_Customer(GNCBook, EkatCustomer)
+    ReceivableAC = ekat_to_gnc_Account(GNCBook, EkatReceivableAC, Accounts)
+    GList = None
+    if OpenLots is not None:
+        lots = OpenLots.get_lots(ReceivableAC, EkatCustomer.get_ID())
+        if not lots:
+            return
+        GList = gnucash_laska.to_GList(lots)
+    # A payment of nothing makes no payment; it only links the customer's
+    # open lots (credits and invoices) with each other.
+    # See: gnucash_api_docs/html/group__Owner.html (gncOwnerApplyPaymentSecs)
+    Nothing = gnucash.GncNumeric(0)
+    Customer.ApplyPaymentSecs(None, GList, ReceivableAC, ReceivableAC,
+                              Nothing, gnucash.GncNumeric(1), Date,
+                              "", "", True)
 
-def add_ekatPayment_to_GNCBook(GNCBook, EkatPayment):
+def add_ekatPayment_to_GNCBook(GNCBook, EkatPayment, OpenLots=None,
+                               Accounts=None, Batch=None):
     """
     Add ekaterina.Payment to GNCBook.
+
+    If an OpenLotIndex is given, the payment is applied to the customer's
+    open lots (invoices and credits) from the index, instead of having
+    GnuCash scan the posted account for them. If the customer has none,
+    it's AutoPay, as without the index.
+
+    If a batch.Batch is given, the payment's transaction is tagged with
+    it, and added to it. (A payment of nothing has no transaction to add.)
     """
     Customer = ekat_to_gnc_Customer(GNCBook, EkatPayment.Customer)
     PaymentAmount = EkatPayment.get_payment_amount()
     RefundAmount = EkatPayment.get_refund_amount()
-    PostedAccount = ekat_to_gnc_Account(GNCBook, EkatPayment.PostedAccount)
-    TransferAccount = ekat_to_gnc_Account(GNCBook, EkatPayment.TransferAccount)
+    PostedAccount = ekat_to_gnc_Account(GNCBook, EkatPayment.PostedAccount,
+                                        Accounts)
+    TransferAccount = ekat_to_gnc_Account(GNCBook, EkatPayment.TransferAccount,
+                                          Accounts)
+
+    GList = EkatPayment.GList
+    AutoPay = EkatPayment.AutoPay
+    indexed = OpenLots is not None and GList is None and AutoPay
+    if indexed:
+        lots = OpenLots.get_lots(PostedAccount, EkatPayment.Customer.get_ID())
+        # With no lots (an empty GList is NULL), it's AutoPay as usual.
+        if lots:
+            GList = gnucash_laska.to_GList(lots)
+
+    # A payment of nothing makes no payment (See: apply_credits_to_invoices):
+    # there's no transaction to get a hold of, tag or index.
+    pays_something = bool(EkatPayment.PaymentAmount or EkatPayment.Refund)
+    Transaction = EkatPayment.Transaction
+    if (Batch is not None or indexed) and Transaction is None \
+            and pays_something:
+        # GnuCash makes the payment in the transaction it's given, so
+        # that's how we get a hold of it.
+        Transaction = gnucash.Transaction(GNCBook)
+        Transaction.BeginEdit()
+        Transaction.SetCurrency(Customer.GetCurrency())
+        if Batch is not None:
+            Transaction.SetNotes(Batch.tag)
 
     # Consult gnucash api docs:
     # gnucash_api_docs/html/group__Owner.html#ga66a4b67de8ecc7798bd62e34370698fc
     # Run `make gnucash_api_docs` in project root.
-    Customer.ApplyPaymentSecs(EkatPayment.Transaction,
-                              EkatPayment.GList,
+    Customer.ApplyPaymentSecs(Transaction,
+                              GList,
                               PostedAccount,
                               TransferAccount,
                               EkatPayment.get_payment_amount(),
@@ -132,24 +343,122 @@ def add_ekatPayment_to_GNCBook(GNCBook, EkatPayment):
                               EkatPayment.PaymentDate,
                               EkatPayment.Memo,
                               EkatPayment.Num,
-                              EkatPayment.AutoPay)
+                              AutoPay)
+    if Transaction is not None and Transaction is not EkatPayment.Transaction:
+        if not Transaction.GetSplitList():
+            # GnuCash made nothing in it: it's not a payment to keep.
+            Transaction.Destroy()
+            return
+        if Transaction.IsOpen():
+            Transaction.CommitEdit()
+        if indexed:
+            # What's left of the payment, if anything, is a credit: it
+            # has a lot of its own, for the next payments and invoices.
+            index_payment_lot(OpenLots, Transaction, PostedAccount,
+                              EkatPayment.Customer.get_ID())
+        if Batch is not None:
+            Batch.add_transaction(Transaction)
+
+def index_payment_lot(OpenLots, Transaction, PostedAccount, CustomerID):
+    """Add the lot of the payment's split in PostedAccount, if it's still
+       open (the payment wasn't used up), to the OpenLotIndex"""
+    for Split in Transaction.GetSplitList():
+        if not gnucash_laska.is_same(Split.GetAccount(), PostedAccount):
+            continue
+        lot = Split.GetLot()
+        if lot is not None:
+            OpenLots.add_lot(PostedAccount, CustomerID,
+                             gnucash_laska.as_GncLot(lot))
 
-def danse_mazurka(GNCBook, TransactionList):
+def danse_mazurka(GNCBook, TransactionList, OpenLots=None,
+                  deferred_autopay=False, Accounts=None, Batch=None,
+                  progress=None):
     """
     (Dance Mazurka): The final call
 
     Add all the Payments and Invoices in the TransactionList to GNCBook.
+
+    OpenLots is the OpenLotIndex of GNCBook to use, and Accounts the
+    gnucash_laska.AccountTree. Fresh ones are made if none are given.
+    (Pass them in to keep using them across calls.)
+
+    With deferred_autopay, invoices are posted without Autopay, and the
+    customers' credits are applied to them afterwards, one customer at a
+    time. (See: apply_credits_to_invoices)
+
+    With a batch.Batch, everything made is tagged with it, and added to
+    it, so that it can be rolled back. (See: batch.Rollback)
+
+    progress, if given, is called with a progress.Progress every so
+    often, as the transactions are written: as each invoice is made, and
+    posted, as each payment is added, and as each customer's credits are
+    applied. (See: progress.py)
     """
+    if OpenLots is None:
+        OpenLots = OpenLotIndex()
+    if Accounts is None:
+        Accounts = gnucash_laska.AccountTree(GNCBook)
+
     for Transaction in TransactionList:
         assert (isinstance(Transaction, classes.Invoice)
                 or isinstance(Transaction, classes.Payment))
 
+    # {(customer ID, receivable account): (customer, account, post date)}
+    invoiced_customers = {}
+    Invoices = 0
     for Transaction in TransactionList:
         if isinstance(Transaction, classes.Invoice):
-            add_ekatInvoice_to_GNCBook(GNCBook,
-                                       Transaction)
+            Invoices += 1
+            invoiced_customers[(Transaction.get_customer().get_ID(),
+                                str(Transaction.get_ReceivableAC()))] = (
+                Transaction.get_customer(),
+                Transaction.get_ReceivableAC(),
+                Transaction.get_postdate())
+
+    # Progress is made a step at a time: an invoice is two (it's made,
+    # then posted), a payment one, and, with deferred_autopay, applying
+    # a customer's credits one more.
+    Tracker = None
+    made = posted = None
+    if progress is not None:
+        Steps = len(TransactionList) + Invoices
+        if deferred_autopay:
+            Steps += len(invoiced_customers)
+        Tracker = ProgressTracker(Steps, progress)
+        Tracker.start()
+        made = posted = lambda Invoice: Tracker.advance()
+
+    # Invoices that come one after the other are added together, as a
+    # batch. (See: add_ekatInvoices_to_GNCBook)
+    pending_invoices = []
+    def add_pending_invoices():
+        add_ekatInvoices_to_GNCBook(GNCBook, pending_invoices, OpenLots,
+                                    Autopay=not deferred_autopay,
+                                    Accounts=Accounts, Batch=Batch,
+                                    made=made, posted=posted)
+        pending_invoices.clear()
+
+    for Transaction in TransactionList:
+        if isinstance(Transaction, classes.Invoice):
+            pending_invoices.append(Transaction)
         elif isinstance(Transaction, classes.Payment):
+            if pending_invoices:
+                add_pending_invoices()
             add_ekatPayment_to_GNCBook(GNCBook,
-                                       Transaction)
+                                       Transaction,
+                                       OpenLots,
+                                       Accounts,
+                                       Batch)
+            if Tracker is not None:
+                Tracker.advance()
         else:
             pass # Won't execute
+    if pending_invoices:
+        add_pending_invoices()
+
+    if deferred_autopay:
+        for (Customer, ReceivableAC, Date) in invoiced_customers.values():
+            apply_credits_to_invoices(GNCBook, Customer, ReceivableAC, Date,
+                                      Accounts, OpenLots)
+            if Tracker is not None:
+                Tracker.advance()
@@ -0,0 +1,217 @@
+"""
+Decodes whole columns of numbers and dates at once, with NumPy.
+
+csv_parser turns every QUANTITY, UNIT_PRICE, PAYMENT_AMOUNT, REFUND and
+date of every row from text, one cell at a time: float(), Decimal() and
+datetime.strptime() over and over. For a big spreadsheet, that adds up.
+Here, a column is handed over as a list of texts, and comes back as
+arrays:
+- numbers as fixed-point integers: DecimalColumn(units, places), so that
+  a cell is worth units * 10**-places (exactly what Decimal(text) is
+  worth, down to the number of decimal places).
+- dates as datetime64[D].
+
+Cells in the usual shapes ("-12.50", "2021-01-05") are decoded by NumPy
+in bulk. The few that aren't ("1E+3", "2021-1-5") are handed over to
+Decimal()/strptime(), one by one, so they decode just as they would in
+csv_parser. Empty cells are left out (see `missing`). Cells that can't be
+decoded at all are collected, and reported together, by their row index,
+in a ColumnDecodeError (a ValueError, like those of float() and
+strptime()).
+
+NumPy is optional. Without it, HAVE_NUMPY is False, and csv_parser
+sticks to decoding cell by cell. With it, it's still only imported once
+a column is decoded: an import that doesn't vectorize doesn't pay for
+loading it.
+"""
+import datetime
+import importlib.util
+from decimal import Decimal, InvalidOperation
+
+HAVE_NUMPY = importlib.util.find_spec("numpy") is not None
+
+# An int64 holds 18 digits, whatever they are.
+MAX_DIGITS = 18
+
+class ColumnDecodeError(ValueError):
+
+    """
+    Some cells could not be decoded. bad_cells is a list of
+    (row index, column name, text, kind) for every one of them, where
+    kind is what the cell should have been ("number" or "date").
+    """
+    def __init__(self, bad_cells):
+        self.bad_cells = bad_cells
+        super().__init__("\n".join(
+            "Row {}: {} {!r} is not a valid {}".format(
+                row, column, text, kind)
+            for (row, column, text, kind) in bad_cells))
+
+class DecimalColumn:
+
+    """
+    A column of decimal numbers: cell i is units[i] * 10**-places[i].
+    Where missing[i], there was nothing in the cell.
+    """
+    __slots__ = ("units", "places", "missing")
+
+    def __init__(self, units, places, missing):
+        self.units = units
+        self.places = places
+        self.missing = missing
+
+    def fixed_point(self, places):
+        """Return the column as integers in units of 10**-places (rounded down)"""
+        import numpy
+        shift = places - self.places.astype(numpy.int64)
+        up = numpy.where(shift > 0, shift, 0)
+        down = numpy.where(shift < 0, -shift, 0)
+        return self.units * 10 ** up // 10 ** down
+
+    def to_floats(self):
+        """Return a list of floats (None where missing)"""
+        # Both are exact, so the division rounds just as float(text) does.
+        floats = self.units / (10.0 ** self.places)
+        return [None if missing else value
+                for (value, missing) in zip(floats.tolist(),
+                                            self.missing.tolist())]
+
+    def to_decimals(self):
+        """Return a list of decimal.Decimals (None where missing)"""
+        return [None if missing else Decimal(units).scaleb(-places)
+                for (units, places, missing) in zip(self.units.tolist(),
+                                                    self.places.tolist(),
+                                                    self.missing.tolist())]
+
+def ascii_digits(texts):
+    """
+    Whether each of the texts is ASCII digits only (or empty). Not
+    numpy.char.isdigit: that takes "²" and "١" for digits too, and int64
+    doesn't.
+    """
+    import numpy
+    return numpy.char.strip(texts, "0123456789") == ""
+
+def cell_row(index, first_row, rows):
+    """The row index to report the index-th cell by"""
+    return rows[index] if rows is not None else first_row + index
+
+def decimal_to_fixed_point(value):
+    """Decimal -> (units, places), or None if it doesn't fit in an int64"""
+    if not value.is_finite():
+        return None
+    (sign, digits, exponent) = value.as_tuple()
+    units = int("".join(map(str, digits)) or "0") * (-1 if sign else 1)
+    places = -exponent
+    if places < 0:
+        units *= 10 ** -places
+        places = 0
+    if abs(units) >= 10 ** MAX_DIGITS:
+        return None
+    return (units, places)
+
+def decode_decimals(texts, column="", first_row=0, rows=None):
+    """
+    Decode a column of numbers (a list of texts) into a DecimalColumn.
+
+    Cells are reported by their row index: rows[i] for the i-th text if
+    rows (a list of indices) is given, first_row + i otherwise.
+
+    Raises ColumnDecodeError if any of the cells is not a number.
+    """
+    import numpy
+    cells = numpy.char.strip(numpy.asarray(texts, dtype=str))
+    missing = cells == ""
+    negative = numpy.char.startswith(cells, "-")
+    body = numpy.char.lstrip(cells, "+-")
+    signs = numpy.char.str_len(cells) - numpy.char.str_len(body)
+    parts = numpy.char.partition(body, ".")
+    (integer, fraction) = (parts[..., 0], parts[..., 2])
+    digits = numpy.char.add(integer, fraction)
+    lengths = numpy.char.str_len(digits)
+    # The usual shape: an optional sign, digits, and an optional point
+    # followed by more digits.
+    simple = (~missing
+              & (signs <= 1)
+              & ascii_digits(integer)
+              & ascii_digits(fraction)
+              & (lengths > 0) & (lengths <= MAX_DIGITS))
+
+    units = numpy.where(simple, digits, "0").astype(numpy.int64)
+    units = numpy.where(negative, -units, units)
+    places = numpy.where(simple, numpy.char.str_len(fraction), 0)
+    places = places.astype(numpy.int16)
+
+    bad_cells = []
+    for index in numpy.flatnonzero(~simple & ~missing).tolist():
+        try:
+            decoded = decimal_to_fixed_point(Decimal(texts[index].strip()))
+        except InvalidOperation:
+            decoded = None
+        if decoded is None:
+            bad_cells.append((cell_row(index, first_row, rows), column,
+                              texts[index], "number"))
+            continue
+        (units[index], places[index]) = decoded
+    if bad_cells:
+        raise ColumnDecodeError(bad_cells)
+    return DecimalColumn(units, places, missing)
+
+def decode_dates(texts, date_format, column="", first_row=0, rows=None):
+    """
+    Decode a column of dates (a list of texts in date_format) into a
+    datetime64[D] array, with NaT where the cells are empty.
+
+    Raises ColumnDecodeError if any of the cells is not a date.
+    """
+    import numpy
+    cells = numpy.char.strip(numpy.asarray(texts, dtype=str))
+    dates = numpy.full(len(cells), numpy.datetime64("NaT"), "datetime64[D]")
+    pending = cells != ""
+    # NumPy reads YYYY-MM-DD (and only that) by itself. It reads years
+    # datetime can't hold, too ("0000-01-01"): those are left to
+    # strptime(), which won't have them either.
+    if date_format == "%Y-%m-%d":
+        iso = pending & (numpy.char.str_len(cells) == 10)
+        try:
+            dates[iso] = cells[iso].astype("datetime64[D]")
+            pending &= ~(iso & in_datetime_range(dates))
+        except ValueError:
+            pass # Something in there isn't a date. Go one by one.
+
+    bad_cells = []
+    for index in numpy.flatnonzero(pending).tolist():
+        try:
+            date = datetime.datetime.strptime(texts[index].strip(), date_format)
+        except ValueError:
+            bad_cells.append((cell_row(index, first_row, rows), column,
+                              texts[index], "date"))
+            continue
+        dates[index] = numpy.datetime64(date.date(), "D")
+    if bad_cells:
+        raise ColumnDecodeError(bad_cells)
+    return dates
+
+def in_datetime_range(dates):
+    """Whether each of the datetime64[D] dates is one datetime can hold"""
+    import numpy
+    years = dates.astype("datetime64[Y]").astype(numpy.int64) + 1970
+    return ~numpy.isnat(dates) & (years >= datetime.MINYEAR) \
+        & (years <= datetime.MAXYEAR)
+
+def dates_to_datetimes(dates, column="", first_row=0, rows=None):
+    """
+    datetime64[D] array -> list of datetime.datetimes (None for NaT).
+
+    Raises ColumnDecodeError if any of the dates isn't one datetime can
+    hold (NumPy turns those into ints).
+    """
+    values = dates.astype("datetime64[us]").tolist()
+    bad_cells = [(cell_row(index, first_row, rows), column, str(value),
+                  "date")
+                 for (index, value) in enumerate(values)
+                 if value is not None
+                 and not isinstance(value, datetime.datetime)]
+    if bad_cells:
+        raise ColumnDecodeError(bad_cells)
+    return values
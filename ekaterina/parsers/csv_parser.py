@@ -27,10 +27,15 @@ PAYMENT_DATE (DATE)         -> Payment Date
 POSTED_ACCOUNT              -> Where invoice is posted (RECEIVABLE_ACCOUNT)
 PAYMENT_TRANSFER_ACCOUNT    -> Payment Transfer "Assets:Current Assets:Petty Cash", etc.
 """
+import csv
 import datetime
+import functools
+import collections
 from decimal import Decimal
 
 from ekaterina import classes as Ekat
+from ekaterina.parsers import columnar
+from ekaterina.utils import gnucash_laska
 
 class CustomerTransactionMap:
     """
@@ -142,100 +147,466 @@ def is_valid_Payment_record(record):
 def is_valid_record(record):
     return is_valid_Sale_record(record) or is_valid_Payment_record(record)
 
+def record_kind(record):
+    """
+    Return (is_sale, is_payment): whether the record is a valid Sale
+    record, and whether it is a valid Payment record. A record is checked
+    once, here, and its kind is handed to parse_record() along with it.
+    """
+    return (is_valid_Sale_record(record), is_valid_Payment_record(record))
+
+# Customers, Currencies and Accounts are immutable, and any given
+# spreadsheet has only so many of them. So each distinct one is checked
+# (constructed) only once, and then shared by all the rows it is in.
+# The caches are bounded all the same: a process that keeps importing
+# (See: daemon.py) would otherwise keep every one it has ever seen.
+CACHE_SIZE = 4096
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def to_Customer(CustomerName, CustomerID):
+    return Ekat.Customer(CustomerName, CustomerID)
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def to_Currency(Currency):
+    return Ekat.Currency(Currency)
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def to_Account(Account):
+    return Ekat.Account(Account)
+
+def clear_caches():
+    """Forget the Customers, Currencies and Accounts made so far"""
+    for cached in (to_Customer, to_Currency, to_Account):
+        cached.cache_clear()
+
 def parse_Customer(record):
     CustomerName = get('customer_name', record)
     CustomerID   = int(get('customer_id', record))
-    return Ekat.Customer(CustomerName, CustomerID)
+    return to_Customer(CustomerName, CustomerID)
 
 def parse_Currency(record):
     Currency = get('currency', record)
-    return Ekat.Currency(Currency)
+    return to_Currency(Currency)
 
-def parse_Sale(record):
+def decoded_or(decoded, get_what, decode):
+    """
+    Return the value of get_what that decode_columns() has already
+    decoded, if any; decode() it from the record otherwise.
+    """
+    if decoded is not None and decoded.get(get_what) is not None:
+        return decoded[get_what]
+    return decode()
+
+def parse_Sale(record, decoded=None):
     assert is_valid_Sale_record(record), "Invalid Sale Record"
+    return _parse_Sale(record, decoded)
+
+def _parse_Sale(record, decoded=None):
     customer = parse_Customer(record)
     description = get('description', record)
-    quantity = float(get('quantity', record))
-    unit_price = Decimal(get('unit_price', record))
+    quantity = decoded_or(decoded, 'quantity',
+                          lambda: float(get('quantity', record)))
+    unit_price = decoded_or(decoded, 'unit_price',
+                            lambda: Decimal(get('unit_price', record)))
     notes = get('note', record) or "" # If None, ""
-    income_account = Ekat.Account(get('income_account', record))
-    date = datetime.datetime.strptime(get('sale_date', record), REQUIRED_DATE_FORMAT)
+    income_account = to_Account(get('income_account', record))
+    date = decoded_or(decoded, 'sale_date', lambda: datetime.datetime.strptime(
+        get('sale_date', record), REQUIRED_DATE_FORMAT))
     currency = parse_Currency(record)
-    return Ekat.Sale(customer, description, quantity,
-                     unit_price, notes, income_account,
-                     date, currency)
+    # Everything above is already of the type Ekat.Sale wants (that's
+    # what turning the strings into them checks). No need to check again.
+    return Ekat.Sale.from_validated(
+        customer=customer, description=description, quantity=quantity,
+        unitprice=unit_price, notes=notes, income_account=income_account,
+        date=date, currency=currency)
 
-def parse_Payment(record):
+def parse_Payment(record, decoded=None):
     assert is_valid_Payment_record(record), "Invalid Payment Record"
+    return _parse_Payment(record, decoded)
+
+def _parse_Payment(record, decoded=None):
     customer = parse_Customer(record)
-    payment_amount = Decimal(get('payment_amount', record))
-    refund = get('refund', record) or 0
-    refund = Decimal(refund)
+    payment_amount = decoded_or(decoded, 'payment_amount',
+                                lambda: Decimal(get('payment_amount', record)))
+    refund = decoded_or(decoded, 'refund',
+                        lambda: Decimal(get('refund', record) or 0))
     memo = get('memo', record) or "Payment Received"
-    payment_date = datetime.datetime.strptime(get('payment_date', record), REQUIRED_DATE_FORMAT)
+    payment_date = decoded_or(
+        decoded, 'payment_date', lambda: datetime.datetime.strptime(
+            get('payment_date', record), REQUIRED_DATE_FORMAT))
     posted_account = get('posted_account', record) or "Assets:Accounts Receivable"
-    posted_account = Ekat.Account(posted_account)
+    posted_account = to_Account(posted_account)
     payment_transfer_account = (
         get('payment_transfer_account', record)
         or "Assets:Current Assets:Petty Cash")
-    payment_transfer_account = Ekat.Account(
-        payment_transfer_account)
+    payment_transfer_account = to_Account(payment_transfer_account)
     return Ekat.Payment(customer, payment_amount,
                         refund, memo, payment_date,
                         posted_account, payment_transfer_account)
 
-def parse_Invoice(record):
+def parse_Invoice(record, decoded=None):
     assert is_valid_Sale_record(record), "Invalid Sale Record"
-    customer = parse_Customer(record)
-    sales = Ekat.SalesList(parse_Sale(record))
-    postdate = get('post_date', record) or datetime.date.today()
+    return _parse_Invoice(record, decoded)
+
+def _parse_Invoice(record, decoded=None):
+    sale = _parse_Sale(record, decoded)
+    customer = sale.get_customer()
+    sales = Ekat.SalesList.from_validated(
+        sales=(sale,), customer=customer, currency=sale.get_currency())
+    postdate = decoded_or(
+        decoded, 'post_date',
+        lambda: get('post_date', record) or datetime.date.today())
     if not isinstance(postdate, datetime.date):
         postdate = datetime.datetime.strptime(postdate, REQUIRED_DATE_FORMAT)
     # We are not quite sure when the duedate is. Postdate is today, for sure.
     # Edit: We need a duedate. So set it to today() if it doesn't exist.
     # Edit2: On second thought, set it to postdate. Because whatever.
-    duedate = get('due_date', record) or postdate
+    duedate = decoded_or(decoded, 'due_date',
+                         lambda: get('due_date', record) or postdate)
     if isinstance(duedate, str):
         duedate = datetime.datetime.strptime(duedate, REQUIRED_DATE_FORMAT)
     receivable_account = (
         get('receivable_account', record)
         or "Assets:Accounts Receivable")
-    receivable_account = Ekat.Account(receivable_account)
+    receivable_account = to_Account(receivable_account)
     description = get('invoice_description', record)
-    return Ekat.Invoice(customer, sales, postdate, duedate,
-                        receivable_account, description)
-
-def parse_record(record):
-    invoice = None
-    payment = None
-    if is_valid_record(record):
-        if is_valid_Sale_record(record):
-            invoice = parse_Invoice(record)
-        if is_valid_Payment_record(record):
-            payment = parse_Payment(record)
+    return Ekat.Invoice.from_validated(
+        customer=customer, sales=sales, postdate=postdate, duedate=duedate,
+        ReceivableAC=receivable_account, description=description)
+
+def parse_record(record, decoded=None, kind=None):
+    """
+    Parse a record into an (Invoice, Payment) tuple; either can be None.
+
+    decoded is the record's row of decode_columns(), if the numbers and
+    dates have been decoded already. kind is its record_kind(), if it
+    has been checked already: it isn't checked again.
+    """
+    (is_sale, is_payment) = record_kind(record) if kind is None else kind
+    invoice = _parse_Invoice(record, decoded) if is_sale else None
+    payment = _parse_Payment(record, decoded) if is_payment else None
     return (invoice, payment)
 
-def Parse(reader_output_list, merge_invoices_to_the_same_customer=True):
-    from itertools import chain
+# The fields that decode_columns() decodes, and how.
+DECIMAL_FIELDS = ['unit_price', 'payment_amount', 'refund']
+FLOAT_FIELDS = ['quantity']
+DATE_FIELDS = ['sale_date', 'payment_date', 'post_date', 'due_date']
 
-    # Step 1: Filter out all invalid records
-    valid_records = filter(is_valid_record, reader_output_list)
-    parsed_transactions = list(
-        # Step 3: Flatten the tuples
-        chain.from_iterable(
-            # Step 2: Parse records into (Invoice, payment) tuples.
-            # These can be (Invoice, None), (None, Payment) or
-            # (Invoice, Payment).
-            map(parse_record, valid_records)))
+# Which of them a sale uses, and which a payment does. (What else is in
+# a row is none of the parser's business: it's not decoded.)
+SALE_DECODED_FIELDS = frozenset(['quantity', 'unit_price', 'sale_date',
+                                 'post_date', 'due_date'])
+PAYMENT_DECODED_FIELDS = frozenset(['payment_amount', 'refund',
+                                    'payment_date'])
 
-    if not merge_invoices_to_the_same_customer:
-        return parsed_transactions
+def column_names(records):
+    """Every column name any of the records has"""
+    names = set()
+    for record in records:
+        names.update(record)
+    return names
 
-    # following merges invoices to the same customer.
-    invoices = filter(lambda transaction: isinstance(transaction, Ekat.Invoice),
-                      parsed_transactions)
-    payments = filter(lambda transaction: isinstance(transaction, Ekat.Payment),
-                      parsed_transactions)
+def get_column(get_what, records, names):
+    """
+    get() of every one of the records, unstripped ('' where there's
+    nothing). Which of get_what's columns (See: CSVFieldMappings) the
+    records have at all is looked up once, in names (See: column_names),
+    rather than cell by cell: a column of them is just record.get(name).
+    """
+    column = [None] * len(records)
+    pending = range(len(records))
+    for name in CSVFieldMappings[get_what]:
+        if name not in names:
+            continue
+        for index in pending:
+            column[index] = records[index].get(name)
+        pending = [index for index in pending if column[index] is None]
+        if not pending:
+            break
+    return [text or "" for text in column]
+
+def decode_cell(field, text):
+    """Decode a field's text the way parse_record() does, cell by cell"""
+    if field in DATE_FIELDS:
+        return datetime.datetime.strptime(text, REQUIRED_DATE_FORMAT)
+    if field in FLOAT_FIELDS:
+        return float(text)
+    return Decimal(text)
+
+def decode_column(field, texts, rows=None):
+    """Decode a field's column of texts (See: columnar)"""
+    column = CSVFieldMappings[field][0]
+    if field in DATE_FIELDS:
+        values = columnar.dates_to_datetimes(
+            columnar.decode_dates(texts, REQUIRED_DATE_FORMAT, column,
+                                  rows=rows), column, rows=rows)
+    else:
+        decimals = columnar.decode_decimals(texts, column, rows=rows)
+        if field in FLOAT_FIELDS:
+            values = decimals.to_floats()
+        else:
+            values = decimals.to_decimals()
+    check_decoded_column(field, values, rows)
+    return values
+
+# What each decoded field's values are, once decoded. The Ekat objects
+# are made straight out of them (from_validated, skipping their checks),
+# so a column is checked against this as a whole, before they are.
+DECODED_TYPES = dict([(field, Decimal) for field in DECIMAL_FIELDS]
+                     + [(field, float) for field in FLOAT_FIELDS]
+                     + [(field, datetime.datetime) for field in DATE_FIELDS])
+
+def check_decoded_column(field, values, rows=None):
+    """
+    Make sure every one of a decoded column's values is what
+    DECODED_TYPES says it is (or None, for an empty cell). Raises
+    columnar.ColumnDecodeError, with the ones that aren't, if not.
+    """
+    expected = DECODED_TYPES[field]
+    if all(value is None or type(value) is expected for value in values):
+        return
+    if rows is None:
+        rows = list(range(len(values)))
+    kind = "date" if field in DATE_FIELDS else "number"
+    raise columnar.ColumnDecodeError([
+        (row, CSVFieldMappings[field][0], str(value), kind)
+        for (row, value) in zip(rows, values)
+        if value is not None and type(value) is not expected])
+
+def decode_columns(records, rows=None, kinds=None):
+    """
+    Decode the numbers and dates of all the records at once, a column at
+    a time (See: columnar). Return a list with a {field: value} dict
+    for each record (of the values it has), to be handed to
+    parse_record() along with it.
+
+    kinds are the record_kind() of each record, if they have been
+    checked already.
+
+    Only the fields a record's type uses are decoded (a stray cell in a
+    column a payment doesn't use is none of its business, as in
+    parse_record()). The numbers NumPy can't hold, but Decimal() or
+    float() can (NaN, Infinity, too many digits), are left out, and are
+    decoded cell by cell by parse_record(), just as without this.
+
+    rows are the row indices of the records, for the errors.
+
+    Raises columnar.ColumnDecodeError, with every cell that isn't a
+    number or a date (as it should be), by row. A cell that decodes to
+    something other than its DECODED_TYPES is left to parse_record()
+    too, if Decimal(), float() or strptime() make something of it, and
+    is reported with the bad ones otherwise. (See: check_decoded_column)
+    """
+    if rows is None:
+        rows = list(range(len(records)))
+    if kinds is None:
+        kinds = [record_kind(record) for record in records]
+    names = column_names(records)
+    # The records that use each field, by index: a sale's or a payment's.
+    sales = [index for (index, (is_sale, _)) in enumerate(kinds) if is_sale]
+    payments = [index for (index, (_, is_payment)) in enumerate(kinds)
+                if is_payment]
+    decoded = [{} for record in records]
+    bad_cells = []
+    for field in DECIMAL_FIELDS + FLOAT_FIELDS + DATE_FIELDS:
+        used = sales if field in SALE_DECODED_FIELDS else payments
+        if not used:
+            continue
+        used_rows = [rows[index] for index in used]
+        texts = get_column(field, [records[index] for index in used], names)
+        try:
+            values = decode_column(field, texts, used_rows)
+        except columnar.ColumnDecodeError as error:
+            positions = {row: index for (index, row) in enumerate(used_rows)}
+            field_bad_cells = []
+            for bad_cell in error.bad_cells:
+                index = positions[bad_cell[0]]
+                try:
+                    decode_cell(field, texts[index].strip())
+                except (ValueError, ArithmeticError):
+                    field_bad_cells.append(bad_cell)
+                    continue
+                texts[index] = "" # Left to parse_record()
+            if field_bad_cells:
+                bad_cells.extend(field_bad_cells)
+                continue
+            values = decode_column(field, texts, used_rows)
+        for (index, value) in zip(used, values):
+            if value is not None:
+                decoded[index][field] = value
+    if bad_cells:
+        bad_cells.sort(key=lambda bad_cell: bad_cell[0])
+        raise columnar.ColumnDecodeError(bad_cells)
+    return decoded
+
+def get_accounts(transaction):
+    """Return all the Ekat.Accounts an Invoice or a Payment refers to"""
+    if isinstance(transaction, Ekat.Invoice):
+        return ([transaction.get_ReceivableAC()]
+                + [sale.get_incomeaccount()
+                   for sale in transaction.get_entries()])
+    if isinstance(transaction, Ekat.Payment):
+        return [transaction.PostedAccount, transaction.TransferAccount]
+    return []
+
+def check_accounts(parsed_transactions, known_accounts):
+    """
+    Make sure all the accounts the parsed transactions refer to are known.
+
+    known_accounts is a gnucash_laska.AccountTree (or anything else that
+    can tell whether it has an account `in` it, and suggest() the ones
+    that an unknown account name might have meant).
+
+    Raises gnucash_laska.AccountLookupError naming every unknown account,
+    along with suggestions.
+    """
+    unknown_accounts = []
+    for transaction in parsed_transactions:
+        for account in get_accounts(transaction):
+            name = account.get_account_identifier()
+            if name not in known_accounts and name not in unknown_accounts:
+                unknown_accounts.append(name)
+    if unknown_accounts:
+        raise gnucash_laska.AccountLookupError("\n".join(
+            gnucash_laska.describe_unknown_account(
+                name, known_accounts.suggest(name))
+            for name in unknown_accounts))
+
+def payment_merge_key(payment):
+    """The Payments with the same key are merged (See: merge_payments)"""
+    return (payment.Customer.get_name(),
+            payment.Customer.get_ID(),
+            payment.PaymentDate,
+            str(payment.PostedAccount),
+            str(payment.TransferAccount))
+
+def merge_payments(parsed_transactions):
+    """
+    Merge the Payments of a customer made on the same day, posted to the
+    same account and transferred to the same account, into a single
+    Payment. Each of them would otherwise make its own transaction.
+
+    The amounts and refunds are added up and the (distinct) memos are
+    joined together. The merged payment takes the place of the first
+    of the payments it is made of. Everything else is left as it is.
+    """
+    merged_transactions = []
+    same_day_payments = {}
+    for transaction in parsed_transactions:
+        if not isinstance(transaction, Ekat.Payment):
+            merged_transactions.append(transaction)
+            continue
+        key = payment_merge_key(transaction)
+        if key not in same_day_payments:
+            same_day_payments[key] = []
+            # Hold its place. It is filled in once all are merged.
+            merged_transactions.append(key)
+        same_day_payments[key].append(transaction)
+
+    for (index, transaction) in enumerate(merged_transactions):
+        if not isinstance(transaction, tuple):
+            continue
+        payments = same_day_payments[transaction]
+        if len(payments) == 1:
+            merged_transactions[index] = payments[0]
+            continue
+        memos = []
+        for payment in payments:
+            if payment.Memo not in memos:
+                memos.append(payment.Memo)
+        first = payments[0]
+        merged_transactions[index] = Ekat.Payment(
+            first.Customer,
+            sum(payment.PaymentAmount for payment in payments),
+            sum(payment.Refund for payment in payments),
+            "; ".join(memos),
+            first.PaymentDate,
+            first.PostedAccount,
+            first.TransferAccount)
+    return merged_transactions
+
+# How the sales of a customer can be split up into invoices, by the
+# date of the sale: {period: sale date -> what the period's invoice is for}
+SPLIT_PERIODS = {
+    "day": lambda date: date,
+    "week": lambda date: tuple(date.isocalendar())[:2],
+    "month": lambda date: (date.year, date.month),
+    "year": lambda date: date.year,
+}
+
+def split_sales(sales, max_entries_per_invoice=None, split_period=None):
+    """
+    Split a customer's sales up into lists of sales, one per invoice: one
+    per split_period (See: SPLIT_PERIODS) of sale dates, earliest first,
+    and then into lists of at most max_entries_per_invoice sales. Within
+    a list, the sales stay in the order they came in.
+    """
+    if split_period is None:
+        periods = [list(sales)]
+    else:
+        if split_period not in SPLIT_PERIODS:
+            raise ValueError("Unknown split period: {!r} (expected one of: "
+                             "{})".format(split_period,
+                                          ", ".join(SPLIT_PERIODS)))
+        period_of = SPLIT_PERIODS[split_period]
+        by_period = {}
+        for sale in sales:
+            by_period.setdefault(period_of(sale.get_date()), []).append(sale)
+        periods = [by_period[period] for period in sorted(by_period)]
+    if not max_entries_per_invoice:
+        return periods
+    if max_entries_per_invoice < 0:
+        raise ValueError("max_entries_per_invoice must be positive")
+    return [period[start:start + max_entries_per_invoice]
+            for period in periods
+            for start in range(0, len(period), max_entries_per_invoice)]
+
+def positive_int(text):
+    """argparse type for --max-entries-per-invoice: a whole number, 1 or more"""
+    number = int(text)
+    if number < 1:
+        raise ValueError("{} is not 1 or more".format(number))
+    return number
+
+def as_datetime(date):
+    """A datetime.date (or datetime) as a datetime.datetime"""
+    if isinstance(date, datetime.datetime):
+        return date
+    return datetime.datetime.combine(date, datetime.time())
+
+def part_dates(first, sales, split_period):
+    """
+    Return the (post date, due date) of an invoice of the customer's
+    sales, made out of the customer's first invoice.
+
+    Split by period, the invoice is posted on the last of its sales
+    (not on the first invoice's post date, which can be in another
+    period altogether), and is due as long after it as the first
+    invoice was.
+    """
+    (postdate, duedate) = (first.get_postdate(), first.get_duedate())
+    if split_period is None:
+        return (postdate, duedate)
+    part_postdate = max(sale.get_date() for sale in sales)
+    if not duedate:
+        return (part_postdate, duedate)
+    term = datetime.timedelta(0)
+    if postdate:
+        term = as_datetime(duedate) - as_datetime(postdate)
+    return (part_postdate, as_datetime(part_postdate) + term)
+
+def merge_invoices(invoices, max_entries_per_invoice=None, split_period=None):
+    """
+    Merge all the Invoices to the same customer into a single Invoice.
+
+    Unless it's too big: with max_entries_per_invoice, or split_period,
+    the customer's sales are split up into several invoices instead
+    (See: split_sales), whose descriptions end in "(part i/n)". Posting
+    an invoice with thousands of entries takes a long while, and nobody
+    wants to scroll through it in GnuCash. Split by period, each is
+    posted within its period. (See: part_dates)
+    """
+    from itertools import chain
 
     # Create a dictionary: {Customer: [Invoice1, Invoice2]}
     customer_invoice_dictionary = {}
@@ -245,22 +616,352 @@ def Parse(reader_output_list, merge_invoices_to_the_same_customer=True):
             customer_invoice_dictionary[customer_name].append(invoice)
         else:
             customer_invoice_dictionary[customer_name] = [invoice]
-    # Now, extract all the Ekat.Sale objects in each Invoice and
-    # merge them into the same Ekat.SalesList and create a single
-    # Invoice off of them.
+    # Now, extract all the Ekat.Sale objects in each Invoice, and make
+    # the customer's invoices anew out of them (one, or one per part).
+    # Invoices are immutable: the rest is taken from the first one.
+    splitting = max_entries_per_invoice or split_period
     for customer, invoice_list in customer_invoice_dictionary.items():
+        if len(invoice_list) == 1 and not splitting:
+            continue
         sales = []
         for invoice in invoice_list:
             sales.extend(invoice.get_sales().sales)
-            new_sales_list = Ekat.SalesList(*sales)
-            invoice_list[0].sales = new_sales_list
-            # Drop all but the first invoice from the list
-        customer_invoice_dictionary[customer] = [invoice_list[0]]
+        first = invoice_list[0]
+        parts = split_sales(sales, max_entries_per_invoice, split_period)
+        if len(parts) == 1 and len(invoice_list) == 1:
+            continue
+        # The sales have been checked one by one, but not against each
+        # other: that happens here, once for the customer's whole batch.
+        customer_invoice_dictionary[customer] = [
+            Ekat.Invoice(first.get_customer(), Ekat.SalesList(*part),
+                         *part_dates(first, part, split_period),
+                         first.get_ReceivableAC(),
+                         part_description(first.get_description(), part,
+                                          number, len(parts)))
+            for (number, part) in enumerate(parts, 1)]
 
     new_invoices = [ customer_invoice_dictionary[customer] for
                      customer in customer_invoice_dictionary ]
     # flatten the [ [list], [of], [invoices], [in], [nested], [lists] ]
-    new_invoices = list(chain.from_iterable(new_invoices))
+    return list(chain.from_iterable(new_invoices))
+
+def part_description(description, sales, number, count):
+    """The description of the number-th of count invoices a customer's
+       sales were split into"""
+    if count == 1:
+        return description
+    if not description:
+        # What mazurka.post_gncInvoice would have made of it
+        description = "; ".join(sale.get_description() for sale in sales)
+    return "{} (part {}/{})".format(description, number, count)
+
+# Quarantine: rows that can't be parsed are set aside as Rejects, with
+# why, instead of failing the whole import. (See: Parse, write_rejects)
+Reject = collections.namedtuple("Reject", ["row", "record", "reason"])
+
+# The columns write_rejects() adds to the rejected rows. SOURCE_FILE
+# only if the rows were tagged with the file they came from (as a
+# manifest's are: See manifest.import_book).
+SOURCE_FILE_FIELD = "SOURCE_FILE"
+SOURCE_ROW_FIELD = "SOURCE_ROW"
+REJECT_REASON_FIELD = "REJECT_REASON"
+
+# Why a row with something in it, that is_valid_record() won't have, is
+# rejected
+NOT_A_RECORD_REASON = "Neither a sale nor a payment"
+
+def is_blank_record(record):
+    """Whether there's nothing in the record (but its SOURCE_ROW)"""
+    return not any(value is not None and str(value).strip()
+                   for (field, value) in record.items()
+                   if field != SOURCE_ROW_FIELD)
+
+# What the parser needs of a spreadsheet: the columns it knows, and
+# only the rows with a customer ID (no row without one is valid). The
+# readers can leave out everything else as they read. (See:
+# csv_reader.Projection) The rows are numbered under SOURCE_ROW, for
+# write_rejects().
+READER_FIELDS = frozenset(
+    [name for names in CSVFieldMappings.values() for name in names]
+    + [SOURCE_ROW_FIELD])
+READER_REQUIRED_FIELDS = CSVFieldMappings["customer_id"]
+
+def reader_options(rules=None, quarantine=False):
+    """The keyword arguments to pass a reader, for it to read only what
+       the parser needs (and what the rules.Rules, if any, look at).
+       In quarantine, the rows without a customer ID are read too: they
+       are to be rejected, not left out."""
+    fields = READER_FIELDS if rules is None else READER_FIELDS | rules.columns
+    return {"fields": fields,
+            "require": None if quarantine else READER_REQUIRED_FIELDS,
+            "row_field": SOURCE_ROW_FIELD}
+
+# What a bad row can raise on its way to becoming Ekat objects:
+# AssertionError (from ekaterina.classes), ValueError (int(), strptime()),
+# ArithmeticError (decimal.InvalidOperation), and AccountLookupError.
+REJECTABLE_ERRORS = (AssertionError, ValueError, ArithmeticError,
+                     gnucash_laska.AccountLookupError)
+
+def describe_error(error):
+    if str(error):
+        return "{}: {}".format(type(error).__name__, error)
+    return type(error).__name__
+
+def decode_columns_or_reject(records, rows, kinds, rejects):
+    """
+    decode_columns(), except that the records with cells that won't
+    decode are added to rejects. Return the (records, rows, kinds,
+    decoded) that are left.
+    """
+    try:
+        return (records, rows, kinds, decode_columns(records, rows, kinds))
+    except columnar.ColumnDecodeError as error:
+        reasons = {}
+        for (row, column, text, kind) in error.bad_cells:
+            reasons.setdefault(row, []).append(
+                "{} {!r} is not a valid {}".format(column, text, kind))
+    kept_records = []
+    kept_rows = []
+    kept_kinds = []
+    for (row, record, kind) in zip(rows, records, kinds):
+        if row in reasons:
+            rejects.append(Reject(row, record, "; ".join(reasons[row])))
+        else:
+            kept_records.append(record)
+            kept_rows.append(row)
+            kept_kinds.append(kind)
+    return (kept_records, kept_rows, kept_kinds,
+            decode_columns(kept_records, kept_rows, kept_kinds))
+
+def parse_records_or_reject(records, rows, kinds, decoded, rejects,
+                            known_accounts=None, sources=None):
+    """
+    Yield parse_record() of each record, adding the ones that fail (or
+    that refer to accounts not in known_accounts) to rejects instead.
+
+    If a dict is passed as sources, each Invoice and Payment is mapped
+    in it to the (row index, record) it was parsed from.
+    """
+    for (record, row, kind, record_decoded) in zip(records, rows, kinds,
+                                                   decoded):
+        try:
+            parsed = parse_record(record, record_decoded, kind)
+            if known_accounts is not None:
+                check_accounts(parsed, known_accounts)
+        except REJECTABLE_ERRORS as error:
+            rejects.append(Reject(row, record, describe_error(error)))
+            continue
+        if sources is not None:
+            for transaction in parsed:
+                if transaction is not None:
+                    sources[id(transaction)] = (row, record)
+        yield parsed
+
+def reject_unmergeable(parsed_transactions, sources, rejects,
+                       merge_payments_on_the_same_day,
+                       merge_invoices_to_the_same_customer,
+                       max_entries_per_invoice=None, split_period=None):
+    """
+    Find the groups of transactions that won't merge (a customer's sales
+    in two currencies, say), and add every row they were parsed from to
+    rejects (See: parse_records_or_reject for sources). Return the
+    parsed transactions of the other rows: those merge.
+
+    A group is what merge_payments() or merge_invoices() would merge
+    into one: a row that made an Invoice and a Payment is rejected, both
+    of them, if either group fails.
+    """
+    groups = {}
+    for transaction in parsed_transactions:
+        if isinstance(transaction, Ekat.Payment):
+            if merge_payments_on_the_same_day:
+                groups.setdefault(("payment",) + payment_merge_key(
+                    transaction), []).append(transaction)
+        elif isinstance(transaction, Ekat.Invoice) and \
+                merge_invoices_to_the_same_customer:
+            groups.setdefault(("invoice", transaction.get_customer()
+                               .get_name()), []).append(transaction)
+    rejected_rows = set()
+    for (key, group) in groups.items():
+        try:
+            if key[0] == "payment":
+                merge_payments(group)
+            else:
+                merge_invoices(group, max_entries_per_invoice, split_period)
+        except REJECTABLE_ERRORS as error:
+            reason = describe_error(error)
+            for transaction in group:
+                (row, record) = sources[id(transaction)]
+                if row not in rejected_rows:
+                    rejected_rows.add(row)
+                    rejects.append(Reject(row, record, reason))
+    return [transaction for transaction in parsed_transactions
+            if transaction is None
+            or sources[id(transaction)][0] not in rejected_rows]
+
+def write_rejects(rejects, csvfile):
+    """
+    Write the rejected rows to csvfile, as they were read, along with
+    SOURCE_ROW (where they were in the spreadsheet, the header being row
+    1) and REJECT_REASON. Return the number of rows written. Rows tagged
+    with SOURCE_FILE keep it, next to SOURCE_ROW.
+
+    The file can be fixed and fed back to ekaterina as it is: the extra
+    columns are ignored (and SOURCE_ROW is kept as it was). With no
+    rejects, it's just the header.
+    """
+    extra_fields = (SOURCE_FILE_FIELD, SOURCE_ROW_FIELD, REJECT_REASON_FIELD)
+    fieldnames = []
+    for reject in rejects:
+        for field in reject.record:
+            if field not in fieldnames and field not in extra_fields:
+                fieldnames.append(field)
+    if any(SOURCE_FILE_FIELD in reject.record for reject in rejects):
+        fieldnames.append(SOURCE_FILE_FIELD)
+    fieldnames += [SOURCE_ROW_FIELD, REJECT_REASON_FIELD]
+    with open(csvfile, "w", newline="") as output:
+        writer = csv.DictWriter(output, fieldnames=fieldnames)
+        writer.writeheader()
+        for reject in rejects:
+            row = dict(reject.record)
+            row[SOURCE_ROW_FIELD] = (reject.record.get(SOURCE_ROW_FIELD)
+                                     or reject.row + 2)
+            row[REJECT_REASON_FIELD] = reject.reason
+            writer.writerow(row)
+    return len(rejects)
+
+def Parse(reader_output_list, merge_invoices_to_the_same_customer=True,
+          merge_payments_on_the_same_day=False, known_accounts=None,
+          vectorized=False, rejects=None, max_entries_per_invoice=None,
+          split_period=None, rules=None):
+    """
+    Parse a reader's output into a list of Ekat.Payments and Ekat.Invoices.
+
+    With rules (a rules.Rules), the columns a row leaves empty are filled
+    in by the rules first. (See: rules.py)
+
+    If known_accounts (See: check_accounts) is given, transactions that
+    refer to any other accounts are rejected right here, rather than
+    halfway through the Mazurka.
+
+    With vectorized (and NumPy installed), the numbers and dates are
+    decoded a whole column at a time (See: decode_columns), and all the
+    bad ones are reported at once, by row, in a ColumnDecodeError.
+
+    If a list is passed as rejects, it's quarantine: the rows that fail
+    (bad numbers, dates, accounts, ...) don't fail the whole thing. They
+    are added to rejects, as Rejects (row index, record, reason), and
+    the rest are parsed. So are all the rows of a customer's invoices (or
+    payments) that fail to merge (See: write_rejects, reject_unmergeable),
+    and the rows that are neither a sale nor a payment: only the blank
+    ones are skipped. The rejects come out in the order of their rows.
+
+    max_entries_per_invoice and split_period keep the merged invoices
+    down to size. (See: merge_invoices)
+    """
+    from itertools import chain
+
+    if rules is not None:
+        reader_output_list = rules.apply_all(reader_output_list)
+
+    first_reject = None if rejects is None else len(rejects)
+
+    # Step 1: Filter out all invalid records (and, in quarantine, reject
+    # them: all but the blank ones)
+    # {id(transaction): (row index, record)}, in quarantine
+    sources = {}
+    # (Each record is checked once, here: what it is goes along with it.)
+    if (vectorized and columnar.HAVE_NUMPY) or rejects is not None:
+        rows = []
+        valid_records = []
+        kinds = []
+        for (row, record) in enumerate(reader_output_list):
+            kind = record_kind(record)
+            if any(kind):
+                rows.append(row)
+                valid_records.append(record)
+                kinds.append(kind)
+            elif rejects is not None and not is_blank_record(record):
+                rejects.append(Reject(row, record, NOT_A_RECORD_REASON))
+        decoded = [None] * len(valid_records)
+        if vectorized and columnar.HAVE_NUMPY:
+            if rejects is None:
+                decoded = decode_columns(valid_records, rows, kinds)
+            else:
+                (valid_records, rows, kinds, decoded) = \
+                    decode_columns_or_reject(valid_records, rows, kinds,
+                                             rejects)
+        if rejects is None:
+            parsed_records = map(parse_record, valid_records, decoded, kinds)
+        else:
+            parsed_records = parse_records_or_reject(
+                valid_records, rows, kinds, decoded, rejects, known_accounts,
+                sources)
+    else:
+        parsed_records = (
+            parse_record(record, kind=kind)
+            for (record, kind) in ((record, record_kind(record))
+                                   for record in reader_output_list)
+            if any(kind))
+    parsed_transactions = list(
+        # Step 3: Flatten the tuples
+        chain.from_iterable(
+            # Step 2: Parse records into (Invoice, payment) tuples.
+            # These can be (Invoice, None), (None, Payment) or
+            # (Invoice, Payment).
+            parsed_records))
+
+    # (In quarantine, they have been checked row by row.)
+    if known_accounts is not None and rejects is None:
+        check_accounts(parsed_transactions, known_accounts)
+
+    merge = functools.partial(
+        merge_transactions,
+        merge_invoices_to_the_same_customer=merge_invoices_to_the_same_customer,
+        merge_payments_on_the_same_day=merge_payments_on_the_same_day,
+        max_entries_per_invoice=max_entries_per_invoice,
+        split_period=split_period)
+    try:
+        merged = merge(parsed_transactions)
+    except REJECTABLE_ERRORS:
+        if rejects is None:
+            raise
+        # In quarantine, the groups that won't merge are rejected too,
+        # with all of their rows. (Only looked for once something has
+        # failed.)
+        merged = merge(reject_unmergeable(
+            parsed_transactions, sources, rejects,
+            merge_payments_on_the_same_day,
+            merge_invoices_to_the_same_customer, max_entries_per_invoice,
+            split_period))
+    if rejects is not None:
+        # This spreadsheet's rejects, in the order of its rows
+        rejects[first_reject:] = sorted(rejects[first_reject:],
+                                        key=lambda reject: reject.row)
+    return merged
+
+def merge_transactions(parsed_transactions,
+                       merge_invoices_to_the_same_customer=True,
+                       merge_payments_on_the_same_day=False,
+                       max_entries_per_invoice=None, split_period=None):
+    """
+    What Parse does with the parsed transactions, once they're parsed:
+    merge them as asked, and put the payments before the invoices.
+    """
+    if merge_payments_on_the_same_day:
+        parsed_transactions = merge_payments(parsed_transactions)
+
+    if not merge_invoices_to_the_same_customer:
+        return parsed_transactions
+
+    # following merges invoices to the same customer.
+    invoices = filter(lambda transaction: isinstance(transaction, Ekat.Invoice),
+                      parsed_transactions)
+    payments = filter(lambda transaction: isinstance(transaction, Ekat.Payment),
+                      parsed_transactions)
+
+    new_invoices = merge_invoices(invoices, max_entries_per_invoice,
+                                  split_period)
 
     new_parsed_transactions = []
     # I would have liked to add invoices first and payments seconds
@@ -0,0 +1,171 @@
+"""
+Rules: fills in a row's accounts (descriptions, ...) from what else is
+in the row, instead of every row having to spell them out.
+
+A rules file is JSON:
+
+    {"rules": [
+        {"when": {"SALE_DESCRIPTION": "(?i).*samovar.*", "BRANCH": "Moscow"},
+         "set": {"INCOME_ACCOUNT": "Income:Sales:Samovars:Moscow"}},
+        {"when": {"SALE_DESCRIPTION": "(?i).*samovar.*"},
+         "set": {"INCOME_ACCOUNT": "Income:Sales:Samovars"}},
+        {"when": {"CURRENCY": "RUB"},
+         "set": {"PAYMENT_TRANSFER_ACCOUNT": "Assets:Bank:Moscow",
+                 "RECEIVABLE_ACCOUNT": "Assets:Accounts Receivable:RUB"}}
+    ]}
+
+A rule applies to a row if every one of its "when" columns matches (a
+regular expression, matched against the whole of the cell: use ".*" to
+match part of it). Each of the rule's "set" columns is then filled in,
+if the row left it empty: what the row says always wins. Rules are
+tried in order, and the first rule to set a column is the one that
+sets it.
+
+The rules are compiled once (See: Rules). Each column's regular
+expressions are run once per distinct value in that column, and what
+that value matches is remembered. Each combination of matching rules
+is worked out once, too. After that, a row costs a dict lookup per
+column the rules look at, however many rules there are.
+
+The memos are capped (MEMO_SIZE): a column with a different value in
+every row (a description, say) would otherwise keep every one of them,
+for as long as the Rules are kept. A memo that's full is started over.
+(See also: clear_memos)
+"""
+import re
+import json
+
+class RulesError(Exception):
+    pass
+
+# How many values (or combinations of matching rules) a memo holds
+MEMO_SIZE = 4096
+
+class Rules:
+
+    """
+    Compiled rules. rules is a list of {"when": {column: pattern},
+    "set": {column: value}}. (See the module docstring.)
+    """
+    def __init__(self, rules):
+        self.conditions = {}
+        self.assignments = []
+        for (index, rule) in enumerate(rules):
+            (when, assign) = check_rule(index, rule)
+            for (column, pattern) in when.items():
+                try:
+                    compiled = re.compile(pattern)
+                except re.error as error:
+                    raise RulesError("Rule #{}: bad pattern for {}: {}".format(
+                        index + 1, column, error))
+                self.conditions.setdefault(column, []).append(
+                    (index, compiled))
+            self.assignments.append(assign)
+        self.all_rules = (1 << len(self.assignments)) - 1
+        # The rules that don't look at a column match whatever is in it.
+        self.unconditional = {
+            column: self.all_rules & ~sum(1 << index for (index, pattern)
+                                          in conditions)
+            for (column, conditions) in self.conditions.items()}
+        # {column: {value: bitmask of the rules it matches}}
+        self.matches = {column: {} for column in self.conditions}
+        # {bitmask of matching rules: {column: value}}
+        self.fills = {}
+        # The columns the rules read or write (a reader must not leave
+        # them out. See: csv_parser.reader_options)
+        self.columns = frozenset(self.conditions).union(
+            *(assign.keys() for assign in self.assignments))
+
+    def __len__(self):
+        return len(self.assignments)
+
+    def match_value(self, column, value):
+        """Return the bitmask of the rules value matches, for column"""
+        matches = self.unconditional[column]
+        for (index, pattern) in self.conditions[column]:
+            if pattern.fullmatch(value):
+                matches |= 1 << index
+        memo = self.matches[column]
+        if len(memo) >= MEMO_SIZE:
+            memo.clear()
+        memo[value] = matches
+        return matches
+
+    def fill_for(self, matching):
+        """Return what the rules in the bitmask set, first rule first"""
+        fill = {}
+        for (index, assign) in enumerate(self.assignments):
+            if matching >> index & 1:
+                for (column, value) in assign.items():
+                    fill.setdefault(column, value)
+        if len(self.fills) >= MEMO_SIZE:
+            self.fills.clear()
+        self.fills[matching] = fill
+        return fill
+
+    def clear_memos(self):
+        """Forget what the values seen so far matched"""
+        for memo in self.matches.values():
+            memo.clear()
+        self.fills.clear()
+
+    def derive(self, record):
+        """
+        Return {column: value} for what the rules set, for the record.
+        (It's shared with every record like it: don't change it.)
+        """
+        matching = self.all_rules
+        for (column, matches) in self.matches.items():
+            value = (record.get(column) or "").strip()
+            matched = matches.get(value)
+            if matched is None:
+                matched = self.match_value(column, value)
+            matching &= matched
+            if not matching:
+                return {}
+        fill = self.fills.get(matching)
+        return fill if fill is not None else self.fill_for(matching)
+
+    def apply(self, record):
+        """
+        Return the record with the empty columns the rules set filled in
+        (a copy, if anything was filled in; the record itself if not).
+        """
+        filled = None
+        for (column, value) in self.derive(record).items():
+            current = record.get(column)
+            if current is None or not current.strip():
+                if filled is None:
+                    filled = dict(record)
+                filled[column] = value
+        return record if filled is None else filled
+
+    def apply_all(self, records):
+        """apply() to each of the records, as they come"""
+        return map(self.apply, records)
+
+def check_rule(index, rule):
+    """Return the rule's (when, set), or raise RulesError"""
+    if not isinstance(rule, dict) or not isinstance(rule.get("set"), dict) \
+       or not rule["set"] or not isinstance(rule.get("when", {}), dict):
+        raise RulesError("Rule #{} needs a \"set\" (and maybe a \"when\"), "
+                         "both {{column: text}}".format(index + 1))
+    (when, assign) = (rule.get("when", {}), rule["set"])
+    for (column, text) in list(when.items()) + list(assign.items()):
+        if not isinstance(text, str):
+            raise RulesError("Rule #{}: {} should be text, not {!r}".format(
+                index + 1, column, text))
+    return (when, assign)
+
+def load_rules(rulesfile):
+    """Read and compile the rules in the rulesfile. Return Rules."""
+    try:
+        with open(rulesfile) as rules_file:
+            rules = json.load(rules_file)
+    except (OSError, ValueError) as error:
+        raise RulesError("Could not read '{}': {}".format(rulesfile, error))
+    if isinstance(rules, dict):
+        rules = rules.get("rules")
+    if not isinstance(rules, list):
+        raise RulesError("'{}' has no list of rules".format(rulesfile))
+    return Rules(rules)
@@ -0,0 +1,257 @@
+"""
+Pipelined import: reading, parsing and writing, all at the same time.
+
+Normally, ekaterina goes one step after the other: the whole file is
+read, then all of it is parsed, and only then does the Mazurka begin.
+The .gnucash writer just sits there for most of the run.
+
+Here, each step runs on its own, and they pass work along through
+bounded queues:
+
+    reader --(rows)--> parser --(transactions)--> writer
+
+Parsing is pure Python, and the writer spends its time in the engine
+(which doesn't let go of the GIL), so the two couldn't make headway at
+the same time as threads of one process. The parser gets a process of
+its own, instead: rows go to it, and transactions come back, pickled.
+The reader and the writer are threads of the main process, as is
+anything that reads the input (the reader's output can be a generator,
+such as xlsx_reader.Read's or csv_reader.Stream's) or owns the session.
+
+The writer is the only one that touches GnuCash: it opens the session,
+writes transactions as they come in, and saves at the very end. (The
+engine is not thread-safe. The parser checks currency codes against
+gnucash_laska.currency_codes(), which Run() reads off the engine once,
+before the parser's process is forked, so that the process has them.)
+So the whole thing takes about as long as the slowest of the steps,
+rather than all of them put together. That is, from the first row on: a
+.ods file is converted (by LibreOffice) as a whole before its first row
+can be read, and that is not overlapped with anything. (See:
+benchmarks/pipeline_overlap.py)
+
+Invoices to a customer are merged into one (See: csv_parser.Parse), so
+they can only be written once all of the customer's rows have been
+read. If the rows are grouped by customer, say so (grouped_by_customer)
+and each customer is written as soon as the next one begins. Otherwise,
+the invoices wait for the end of the input. Either way, a customer's
+payments are written before their invoices, as in csv_parser.Parse.
+"""
+import queue
+import threading
+import traceback
+import multiprocessing
+
+import gnucash
+
+from ekaterina import mazurka
+from ekaterina.parsers import csv_parser
+from ekaterina.utils import gnucash_laska
+
+class PipelineError(Exception):
+    pass
+
+# Marks the end of whatever is coming down a Pipe.
+END_OF_INPUT = None
+
+class Pipe:
+
+    """
+    A bounded queue between two steps of the pipeline (that can be in
+    processes of their own: it's made in the multiprocessing context).
+
+    Once the pipeline is stopped (something went wrong somewhere), put()
+    and get() stop waiting on each other, so that every step can wind up.
+    """
+    def __init__(self, size, stopped, context):
+        self.queue = context.Queue(size)
+        self.stopped = stopped
+
+    def put(self, item):
+        """Put item in the pipe. Return False if the pipeline is stopped."""
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self):
+        """Take the next item out, or END_OF_INPUT if the pipeline is stopped"""
+        while not self.stopped.is_set():
+            try:
+                return self.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return END_OF_INPUT
+
+def read_rows(records, rows, chunk_size):
+    """The reader: pass the records along, chunk_size at a time"""
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == chunk_size:
+            if not rows.put(chunk):
+                return
+            chunk = []
+    if chunk:
+        rows.put(chunk)
+    rows.put(END_OF_INPUT)
+
+def parse_rows(rows, transactions, grouped_by_customer,
+               merge_payments_on_the_same_day, max_entries_per_invoice=None,
+               split_period=None, rules=None):
+    """The parser: turn rows into lists of Payments and Invoices"""
+    invoices = []
+    payments = []
+    customer = None
+
+    def flush_customers():
+        batch = payments[:]
+        if merge_payments_on_the_same_day:
+            batch = csv_parser.merge_payments(batch)
+        batch.extend(csv_parser.merge_invoices(
+            invoices, max_entries_per_invoice, split_period))
+        payments.clear()
+        invoices.clear()
+        return (not batch) or transactions.put(batch)
+
+    while True:
+        chunk = rows.get()
+        if chunk is END_OF_INPUT:
+            break
+        for record in chunk:
+            if rules is not None:
+                record = rules.apply(record)
+            kind = csv_parser.record_kind(record)
+            if not any(kind):
+                continue
+            if grouped_by_customer:
+                record_customer = csv_parser.get('customer_name', record)
+                if record_customer != customer:
+                    if not flush_customers():
+                        return
+                    customer = record_customer
+            (invoice, payment) = csv_parser.parse_record(record, kind=kind)
+            if invoice:
+                invoices.append(invoice)
+            if payment:
+                payments.append(payment)
+        # Payments needn't wait, unless they are to be merged.
+        if payments and not merge_payments_on_the_same_day:
+            if not transactions.put(payments[:]):
+                return
+            payments.clear()
+
+    if rows.stopped.is_set() or not flush_customers():
+        return
+    transactions.put(END_OF_INPUT)
+
+def write_transactions(gnucashfile, transactions, deferred_autopay, written,
+                       Batch=None):
+    """
+    The writer: own the gnucash.Session, dance the Mazurka with whatever
+    comes in, and save once everything is in.
+    """
+    session = gnucash.Session(gnucashfile)
+    try:
+        OpenLots = mazurka.OpenLotIndex()
+        Accounts = gnucash_laska.AccountTree(session.book)
+        while True:
+            batch = transactions.get()
+            if batch is END_OF_INPUT:
+                break
+            mazurka.danse_mazurka(session.book, batch, OpenLots,
+                                  deferred_autopay=deferred_autopay,
+                                  Accounts=Accounts, Batch=Batch)
+            written.extend(batch)
+        # Don't save half an import.
+        if not transactions.stopped.is_set():
+            session.save()
+    finally:
+        session.end()
+
+def parse_in_process(rows, transactions, errors, *args):
+    """
+    parse_rows(), in the parser's process. What goes wrong is sent back
+    through errors, as text: the exception itself may not pickle.
+    """
+    try:
+        parse_rows(rows, transactions, *args)
+    except BaseException as error:
+        errors.put("{!r}\n{}".format(error, traceback.format_exc()))
+        rows.stopped.set()
+    if rows.stopped.is_set():
+        # Nobody is going to take what's left in the pipe: don't wait
+        # for it to be taken before leaving.
+        transactions.queue.cancel_join_thread()
+
+def Run(records, gnucashfile, grouped_by_customer=False,
+        merge_payments_on_the_same_day=False, deferred_autopay=False,
+        queue_size=64, chunk_size=256, Batch=None,
+        max_entries_per_invoice=None, split_period=None, rules=None):
+    """
+    Read, parse and write the records (a reader's output) to gnucashfile,
+    all at once. Return the list of transactions written.
+
+    queue_size is how many chunks of work can wait between two steps,
+    and chunk_size is how many rows make up a chunk. With a batch.Batch,
+    what is written is tagged with it. (See: mazurka.danse_mazurka)
+    max_entries_per_invoice, split_period and rules are as in
+    csv_parser.Parse.
+
+    Raises PipelineError if any of the steps fails, in which case nothing
+    is saved.
+    """
+    # Here, while nothing else is using the engine. (See above.)
+    gnucash_laska.currency_codes()
+    # Forked, the parser has everything the main process has set up for
+    # it (the currency codes, the rules), without any of it pickled.
+    context = multiprocessing.get_context("fork")
+    stopped = context.Event()
+    rows = Pipe(queue_size, stopped, context)
+    transactions = Pipe(queue_size, stopped, context)
+    parser_errors = context.Queue()
+    written = []
+    errors = []
+
+    def step(target, *args):
+        def run():
+            try:
+                target(*args)
+            except BaseException as error:
+                errors.append(error)
+                stopped.set()
+        return threading.Thread(target=run, name=target.__name__)
+
+    # The process first, while the main process has no threads to fork.
+    parser = context.Process(
+        target=parse_in_process, name="parse_rows",
+        args=(rows, transactions, parser_errors, grouped_by_customer,
+              merge_payments_on_the_same_day, max_entries_per_invoice,
+              split_period, rules))
+    parser.start()
+    threads = [
+        step(read_rows, records, rows, chunk_size),
+        step(write_transactions, gnucashfile, transactions,
+             deferred_autopay, written, Batch)]
+    for thread in threads:
+        thread.start()
+    parser.join()
+    if parser.exitcode != 0:
+        stopped.set()
+    for thread in threads:
+        thread.join()
+
+    try:
+        parser_error = parser_errors.get(timeout=0.1)
+    except queue.Empty:
+        parser_error = None
+    if parser_error is not None:
+        errors.insert(0, PipelineError(parser_error))
+    elif parser.exitcode != 0:
+        errors.insert(0, PipelineError("The parser exited with {}".format(
+            parser.exitcode)))
+    if errors:
+        raise PipelineError("Import failed: {!r}".format(errors[0])) from errors[0]
+    return written
@@ -0,0 +1,105 @@
+"""
+How far along a long import is.
+
+mazurka.danse_mazurka takes a progress callback, and calls it with a
+Progress every so often as it writes to the book: how many steps are
+done, out of how many, how fast they are going (per second) and how
+long the rest should take (ETA, in seconds). A slow import can then be
+told apart from a hung one. An invoice is two steps (it's made, then
+posted), a payment one, and, with deferred autopay, applying each
+customer's credits one more.
+
+Two callbacks come with it:
+- terminal_progress(): a progress bar, redrawn in place, for the CLI.
+- logging_progress(): a log line per event, for headless runs (the
+  daemon).
+
+Any other callable that takes a Progress will do.
+"""
+import sys
+import time
+import logging
+import datetime
+import collections
+
+Progress = collections.namedtuple(
+    "Progress", ["done", "total", "seconds", "rate", "eta"])
+Progress.__doc__ = """\
+done out of total, after seconds; rate is per second, and eta is the
+seconds left (None until there is a rate to go by)."""
+
+class ProgressTracker:
+
+    """
+    Counts what's done, and hands a Progress to the callback: at most
+    once every `every` seconds, and always once everything is done.
+    """
+    def __init__(self, total, callback, every=0.5):
+        self.total = total
+        self.callback = callback
+        self.every = every
+        self.done = 0
+        self.started = time.monotonic()
+        self.last_report = None
+
+    def progress(self):
+        seconds = time.monotonic() - self.started
+        rate = self.done / seconds if seconds > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate else None
+        return Progress(self.done, self.total, seconds, rate, eta)
+
+    def start(self):
+        self.report()
+
+    def advance(self, count=1):
+        self.done += count
+        if self.done >= self.total or self.last_report is None or \
+           time.monotonic() - self.last_report >= self.every:
+            self.report()
+
+    def report(self):
+        self.last_report = time.monotonic()
+        self.callback(self.progress())
+
+def format_eta(eta):
+    if eta is None:
+        return "--:--:--"
+    return str(datetime.timedelta(seconds=round(eta)))
+
+def format_progress(progress, what="steps"):
+    """The Progress, in a line"""
+    percent = 100 * progress.done / progress.total if progress.total else 100
+    return "{}/{} {} ({:.0f}%), {:.1f}/s, ETA {}".format(
+        progress.done, progress.total, what, percent, progress.rate,
+        format_eta(progress.eta))
+
+def terminal_progress(stream=sys.stderr, width=30):
+    """
+    Return a callback that draws a progress bar on stream, over and
+    over on the same line, and moves on to the next line once done.
+    """
+    def draw(progress):
+        filled = (width * progress.done // progress.total
+                  if progress.total else width)
+        stream.write("\r[{}{}] {}".format("#" * filled, " " * (width - filled),
+                                          format_progress(progress)))
+        if progress.done >= progress.total:
+            stream.write("\n")
+        stream.flush()
+    return draw
+
+def logging_progress(logger=None, level=logging.INFO, every=10):
+    """
+    Return a callback that logs the Progress it is given: at most once
+    every `every` seconds (so as not to flood the log), and once done.
+    """
+    logger = logger or logging.getLogger("ekaterina.progress")
+    last_logged = None
+    def log(progress):
+        nonlocal last_logged
+        if progress.done < progress.total and last_logged is not None \
+           and progress.seconds - last_logged < every:
+            return
+        last_logged = progress.seconds
+        logger.log(level, "Written %s", format_progress(progress))
+    return log
@@ -1,13 +1,105 @@
+import bz2
 import csv
+import gzip
+import lzma
 
 from ekaterina.utils.fsutils import standardize_path
 
-def Read(csvfile):
+# Readers that can read more than one sheet of a workbook tag each row
+# with the name of the sheet it came from, under this field name.
+# (See: ods_reader.Read)
+SHEET_FIELD = "SHEET"
+
+class Projection:
+
+    """
+    Which of a sheet's columns to keep (fields), and which of its rows:
+    the ones with something in all of the columns in `require`. Rows are
+    made into dicts with only the fields in them, and only if they are to
+    be kept. The other cells are never looked at.
+
+    With a row_field, every row also gets its row number (the header
+    being row 1) under that name, unless the sheet has a column of its
+    own by that name.
+
+    Readers take fields, require and row_field as keyword arguments, and
+    hand them over to this. By default (None), everything is kept.
+    """
+    def __init__(self, header, fields=None, require=None, row_field=None,
+                 restval=None):
+        # The last of any columns with the same name wins, as with
+        # csv.DictReader.
+        index = {name: column for (column, name) in enumerate(header)}
+        self.columns = [(column, name) for (name, column) in index.items()
+                        if fields is None or name in fields]
+        self.wanted = {column for (column, name) in self.columns}
+        self.required = [index.get(name) for name in (require or [])]
+        self.row_field = row_field if row_field not in index else None
+        self.restval = restval
+
+    def record(self, cells, row_number=None):
+        """Return the row (a list of cell texts) as a dict, or None"""
+        for column in self.required:
+            if column is None or column >= len(cells) \
+               or not cells[column].strip():
+                return None
+        length = len(cells)
+        record = {name: cells[column] if column < length else self.restval
+                  for (column, name) in self.columns}
+        if self.row_field is not None:
+            record[self.row_field] = str(row_number)
+        return record
+
+# Compressed csv files are read as they are decompressed, by the module
+# their magic bytes call for: {magic bytes: module}
+DECOMPRESSORS = {
+    b"\x1f\x8b": gzip,
+    b"BZh": bz2,
+    b"\xfd7zXZ\x00": lzma,
+}
+
+def open_csv(path):
+    """
+    Open the csv file at path as text, decompressing it on the fly if
+    it's compressed (gzip, bzip2 or xz). Either way, it can be seek()ed
+    back to the start.
+    """
+    with open(path, "rb") as csvfile:
+        magic = csvfile.read(6)
+    for (prefix, decompressor) in DECOMPRESSORS.items():
+        if magic.startswith(prefix):
+            return decompressor.open(path, "rt", newline='')
+    return open(path, newline='')
+
+def Stream(csvfile, fields=None, require=None, row_field=None):
+    """
+    Read in a csv file and yield things one at a time, as they are read.
+    The file may be compressed (See: open_csv).
+
+    fields, require and row_field pick the columns and rows (See:
+    Projection).
+    """
+    with open_csv(standardize_path(csvfile)) as csvfile:
+        csvdialect = csv.Sniffer().sniff(csvfile.read(1024))
+        csvfile.seek(0)
+        if fields is None and require is None and row_field is None:
+            yield from csv.DictReader(csvfile, dialect=csvdialect)
+            return
+        reader = csv.reader(csvfile, dialect=csvdialect)
+        header = next(reader, None)
+        if header is None:
+            return
+        projection = Projection(header, fields, require, row_field)
+        for cells in reader:
+            # Blank lines are skipped, as csv.DictReader does.
+            if not cells:
+                continue
+            record = projection.record(cells, reader.line_num)
+            if record is not None:
+                yield record
+
+def Read(csvfile, **projection):
     """
     Read in a csv file and return a list of all things read.
     """
-    csvfile = open(standardize_path(csvfile), newline='')
-    csvdialect = csv.Sniffer().sniff(csvfile.read(1024))
-    csvfile.seek(0)
-    CSVDictReader = csv.DictReader(csvfile, dialect=csvdialect)
-    return list(CSVDictReader)
+    return list(Stream(csvfile, **projection))
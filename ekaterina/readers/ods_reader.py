@@ -3,44 +3,51 @@
 # Wait... ODSReader is just CSVReader Wrapper?
 # ............................always has been.
 
+import zipfile
 from subprocess import run
 from tempfile import TemporaryDirectory
+from xml.etree import ElementTree
 
 from ekaterina.utils.fsutils import *
 from ekaterina.readers import csv_reader
+from ekaterina.readers.registry import ReaderError
 
-class CSVConversionError(Exception):
+class CSVConversionError(ReaderError):
     pass
 
-def generate_csv_from_ods_using_libreoffice(odsfile, outdir=os.getcwd()):
-    """
-    Given an Open Document Spreadsheet (.ods) file, generates
-    a Comma Separated Value (.csv) file by calling LibreOffice.
-    $ libreoffice --convert-to csv --outdir outdir odsfile
+class SheetSelectionError(ReaderError):
+    pass
 
-    Returns the absolute path of the generated csv file.
-    """
-    assert isinstance(odsfile, str), "can not accept non-string arguments"
+# Select every sheet in the workbook. LibreOffice does not allow '*' in
+# sheet names, so this can never clash with the name of a real sheet.
+ALL_SHEETS = "*"
 
-    outdir = standardize_path(outdir)
-    odsfile = standardize_path(odsfile)
-    assert isdirectory(outdir), ("Invalid Output Directory: '{}'"
-                                 .format(outdir))
-    if not isfile(odsfile):
-        raise CSVConversionError(("Specified .ods file '{}' not found"
-                                  .format(odsfile)))
+ODS_TABLE_NAMESPACE = "urn:oasis:names:tc:opendocument:xmlns:table:1.0"
+ODS_OFFICE_NAMESPACE = "urn:oasis:names:tc:opendocument:xmlns:office:1.0"
 
+# LibreOffice's CSV export filter options. The tokens are, in order:
+# field separator (,), text delimiter ("), character set (UTF-8), first
+# line to process, cell format, language, quote all text cells, detect
+# special numbers, save cell contents as shown, export formulas, remove
+# space, and finally the sheet to export. -1 exports every sheet, each
+# into its own <name>-<sheet name>.csv file. (Needs LibreOffice >= 7.2)
+CSV_EXPORT_ALL_SHEETS_FILTER = (
+    "csv:Text - txt - csv (StarCalc):"
+    "44,34,76,1,,0,false,true,false,false,false,-1")
+
+def run_libreoffice(arguments):
+    """
+    Run LibreOffice with the given arguments.
+
+    Raises CSVConversionError if LibreOffice is missing or if it
+    complains about anything.
+    """
     try:
         run(["libreoffice", "--version"], capture_output=True)
     except FileNotFoundError:
         raise CSVConversionError("LibreOffice not found.")
 
-    conversion = run(["libreoffice",
-                      "--convert-to", "csv",
-                      "--infilter=CSV:44,34,76,1", # Use UTF-8 encoding
-                      "--outdir", outdir,
-                      odsfile],
-                     capture_output=True)
+    conversion = run(["libreoffice"] + arguments, capture_output=True)
 
     # Add check here to assert that no error occured.
     # Turns out, LibreOffice isn't guarenteed to return a non-zero
@@ -50,11 +57,159 @@ def generate_csv_from_ods_using_libreoffice(odsfile, outdir=os.getcwd()):
         err_msg = conversion.stderr.decode("utf-8").strip()
         raise CSVConversionError(err_msg)
 
+def check_conversion_paths(odsfile, outdir):
+    """
+    Return the standardized (odsfile, outdir) after making sure that
+    they exist.
+    """
+    assert isinstance(odsfile, str), "can not accept non-string arguments"
+
+    outdir = standardize_path(outdir)
+    odsfile = standardize_path(odsfile)
+    assert isdirectory(outdir), ("Invalid Output Directory: '{}'"
+                                 .format(outdir))
+    if not isfile(odsfile):
+        raise CSVConversionError(("Specified .ods file '{}' not found"
+                                  .format(odsfile)))
+    return odsfile, outdir
+
+def generate_csv_from_ods_using_libreoffice(odsfile, outdir=os.getcwd()):
+    """
+    Given an Open Document Spreadsheet (.ods) file, generates
+    a Comma Separated Value (.csv) file by calling LibreOffice.
+    $ libreoffice --convert-to csv --outdir outdir odsfile
+
+    Only the first sheet of the spreadsheet is converted.
+
+    Returns the absolute path of the generated csv file.
+    """
+    odsfile, outdir = check_conversion_paths(odsfile, outdir)
+
+    run_libreoffice(["--convert-to", "csv",
+                     "--infilter=CSV:44,34,76,1", # Use UTF-8 encoding
+                     "--outdir", outdir,
+                     odsfile])
+
     return destination_path(outdir, odsfile, new_extension=".csv")
 
-def Read(odsfile):
+def generate_csvs_from_ods_using_libreoffice(odsfile, outdir=os.getcwd(),
+                                             sheet_names=None):
+    """
+    Given an Open Document Spreadsheet (.ods) file, generates one
+    Comma Separated Value (.csv) file per sheet with a single call
+    to LibreOffice.
+
+    Returns a dictionary: {sheet name: absolute path of its csv file},
+    in the order in which the sheets appear in the spreadsheet. Pass
+    sheet_names (See: get_sheet_names) if they have been read already.
+    """
+    odsfile, outdir = check_conversion_paths(odsfile, outdir)
+    if sheet_names is None:
+        sheet_names = get_sheet_names(odsfile)
+
+    run_libreoffice(["--convert-to", CSV_EXPORT_ALL_SHEETS_FILTER,
+                     "--outdir", outdir,
+                     odsfile])
+
+    return {
+        sheet_name: destination_path(
+            outdir,
+            "{}-{}".format(get_file_name(odsfile), sheet_name),
+            new_extension=".csv")
+        for sheet_name in sheet_names
+    }
+
+def get_sheet_names(odsfile):
+    """
+    Return the names of all the sheets in the given .ods file, in order.
+
+    The names are read straight out of the spreadsheet's content.xml,
+    element by element, without having to ask LibreOffice. Every element
+    is cleared once it has been read (the cells of a big spreadsheet
+    needn't all be held on to, for their sheets' names), and the reading
+    stops where the spreadsheet does.
+    """
+    table = "{{{}}}table".format(ODS_TABLE_NAMESPACE)
+    table_name = "{{{}}}name".format(ODS_TABLE_NAMESPACE)
+    spreadsheet = "{{{}}}spreadsheet".format(ODS_OFFICE_NAMESPACE)
+    sheet_names = []
+    with zipfile.ZipFile(standardize_path(odsfile)) as ods:
+        with ods.open("content.xml") as content:
+            for event, element in ElementTree.iterparse(
+                    content, events=("start", "end")):
+                if event == "start":
+                    if element.tag == table:
+                        sheet_names.append(element.get(table_name))
+                    continue
+                if element.tag == spreadsheet:
+                    break
+                element.clear()
+    return sheet_names
+
+def select_sheets(sheet_names, sheets):
+    """
+    Return the list of sheet names picked out by `sheets` from the
+    available sheet_names.
+
+    `sheets` may be ALL_SHEETS, a sheet name (str), a sheet index (int,
+    counting from 0, like a python list), or a list of names/indices. A
+    sheet picked more than once (by name and by index, say) is only
+    returned the first time: its rows are only to be read once.
+    """
+    if sheets == ALL_SHEETS:
+        return list(sheet_names)
+    if not isinstance(sheets, (list, tuple)):
+        sheets = [sheets]
+
+    selected = []
+    for sheet in sheets:
+        if isinstance(sheet, bool):
+            raise SheetSelectionError("Invalid sheet: {!r}".format(sheet))
+        elif isinstance(sheet, int):
+            try:
+                selected.append(sheet_names[sheet])
+            except IndexError:
+                raise SheetSelectionError(
+                    "No sheet at index {} (the spreadsheet has {} sheets)"
+                    .format(sheet, len(sheet_names)))
+        elif isinstance(sheet, str):
+            if sheet not in sheet_names:
+                raise SheetSelectionError(
+                    "No sheet named '{}'. Available sheets: {}"
+                    .format(sheet, ", ".join(sheet_names)))
+            selected.append(sheet)
+        else:
+            raise SheetSelectionError("Invalid sheet: {!r}".format(sheet))
+    return list(dict.fromkeys(selected))
+
+def Read(odsfile, sheets=None, **projection):
+    """
+    Read in an .ods file and return a list of all things read.
+
+    By default, only the first sheet is read. Pass `sheets` (see
+    select_sheets) to read others. In that case, the whole workbook is
+    converted in one go, the rows of all the selected sheets are
+    returned as one list and each row is tagged with the name of its
+    sheet under csv_reader.SHEET_FIELD.
+
+    fields, require and row_field pick the columns and rows to read
+    (See: csv_reader.Projection).
+    """
     tempdir = TemporaryDirectory()
-    csvfile = generate_csv_from_ods_using_libreoffice(
+    if sheets is None:
+        csvfile = generate_csv_from_ods_using_libreoffice(
+            standardize_path(odsfile),
+            outdir=tempdir.name)
+        return csv_reader.Read(csvfile, **projection)
+
+    sheet_names = get_sheet_names(odsfile)
+    selected_sheets = select_sheets(sheet_names, sheets)
+    csvfiles = generate_csvs_from_ods_using_libreoffice(
         standardize_path(odsfile),
-        outdir=tempdir.name)
-    return csv_reader.Read(csvfile)
+        outdir=tempdir.name, sheet_names=sheet_names)
+    records = []
+    for sheet_name in selected_sheets:
+        for record in csv_reader.Stream(csvfiles[sheet_name], **projection):
+            record[csv_reader.SHEET_FIELD] = sheet_name
+            records.append(record)
+    return records
@@ -0,0 +1,135 @@
+"""
+Picks the reader for a spreadsheet, and imports it only then.
+
+Which reader a file gets is worked out from its first bytes, where they
+say (a zip archive is an .ods or an .xlsx, by what's inside it; gzip,
+bzip2 and xz are compressed CSV), and from its extension otherwise:
+
+csv             csv_reader             .csv, .tsv
+compressed csv  csv_reader             .csv.gz, .csv.bz2, .csv.xz, ...
+ods             ods_reader             .ods (LibreOffice converts it)
+xlsx            xlsx_reader            .xlsx
+
+So a CSV is read as a CSV, whatever it's called, and never goes through
+LibreOffice. The reader modules are imported the first time a file of
+theirs comes along: reading a CSV doesn't import the others.
+
+Other readers can be added with register(): a module with a
+Read(file, [sheets=None,] **projection), that raises ReaderErrors (See:
+Read).
+"""
+import zipfile
+import importlib
+import collections
+
+class ReaderError(Exception):
+    pass
+
+# Same as ods_reader.ALL_SHEETS, without importing ods_reader for it.
+ALL_SHEETS = "*"
+
+# archive: the format is a zip archive (so a file that isn't one can't
+# be of that format, whatever it's called).
+Reader = collections.namedtuple("Reader", ["module", "extensions",
+                                           "takes_sheets", "archive"])
+
+# {format: Reader}, in the order their extensions are tried.
+READERS = collections.OrderedDict()
+
+# (magic bytes, format), for the formats that have any.
+MAGIC = [
+    (b"\x1f\x8b", "compressed csv"),
+    (b"BZh", "compressed csv"),
+    (b"\xfd7zXZ\x00", "compressed csv"),
+]
+ZIP_MAGIC = b"PK\x03\x04"
+
+def register(format, module, extensions=(), takes_sheets=False,
+             archive=False):
+    """
+    Add (or replace) the reader for a format: module is the name of the
+    module with its Read(), to import when it's first needed.
+    """
+    READERS[format] = Reader(module, tuple(extensions), takes_sheets, archive)
+
+# (csv_reader decompresses them as it reads.)
+register("compressed csv", "ekaterina.readers.csv_reader",
+         [csv + compression for csv in (".csv", ".tsv")
+          for compression in (".gz", ".bz2", ".xz")])
+register("csv", "ekaterina.readers.csv_reader", [".csv", ".tsv"])
+register("ods", "ekaterina.readers.ods_reader", [".ods"], takes_sheets=True,
+         archive=True)
+register("xlsx", "ekaterina.readers.xlsx_reader", [".xlsx"],
+         takes_sheets=True, archive=True)
+
+def extensions():
+    """Every extension a reader is registered for"""
+    return tuple(extension for reader in READERS.values()
+                 for extension in reader.extensions)
+
+def sniff_zip(path):
+    """Return the format of the zip archive at path: ods, xlsx or None"""
+    try:
+        with zipfile.ZipFile(path) as archive:
+            names = set(archive.namelist())
+            if "mimetype" in names and archive.read("mimetype").startswith(
+                    b"application/vnd.oasis.opendocument.spreadsheet"):
+                return "ods"
+            if "xl/workbook.xml" in names:
+                return "xlsx"
+    except zipfile.BadZipFile:
+        pass
+    return None
+
+def sniff_format(path):
+    """
+    Return the format of the file at path (a key of READERS): by its
+    first bytes, or its extension, or csv if nothing else fits.
+    """
+    try:
+        with open(path, "rb") as spreadsheet:
+            magic = spreadsheet.read(8)
+    except OSError as error:
+        raise ReaderError("Could not read '{}': {}".format(path, error))
+    zipped = magic.startswith(ZIP_MAGIC)
+    if zipped:
+        format = sniff_zip(path)
+        if format is not None:
+            return format
+    for (prefix, format) in MAGIC:
+        if magic.startswith(prefix) and format in READERS:
+            return format
+    name = path.lower()
+    for (format, reader) in READERS.items():
+        if name.endswith(reader.extensions) and (zipped or not reader.archive):
+            return format
+    if zipped:
+        raise ReaderError("'{}' is a zip archive, but not an .ods or an "
+                          ".xlsx".format(path))
+    return "csv"
+
+def get_reader(format):
+    """Return the format's Read function, importing its module if need be"""
+    try:
+        reader = READERS[format]
+    except KeyError:
+        raise ReaderError("No reader for {!r}".format(format))
+    return importlib.import_module(reader.module).Read
+
+def Read(spreadsheet, sheets=None, format=None, **projection):
+    """
+    Read the spreadsheet with the reader its format calls for (sniffed,
+    unless given). sheets is for the readers of workbooks; the others
+    have only the one sheet. (projection: See csv_reader.Projection)
+
+    Raises ReaderError (the readers' errors are ReaderErrors too) if the
+    spreadsheet can't be read, or has no such sheets. That is, here and
+    now: the readers open the spreadsheet and pick the sheets before
+    they return, even those that return the rows as they read them.
+    """
+    if format is None:
+        format = sniff_format(spreadsheet)
+    read = get_reader(format)
+    if READERS[format].takes_sheets:
+        return read(spreadsheet, sheets=sheets, **projection)
+    return read(spreadsheet, **projection)
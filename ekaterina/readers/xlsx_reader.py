@@ -0,0 +1,352 @@
+"""
+Reads Office Open XML Workbooks (.xlsx) without LibreOffice.
+
+An .xlsx file is a zip archive of XML files. The ones we care about:
+xl/workbook.xml            -> names of the sheets (and the date system)
+xl/_rels/workbook.xml.rels -> which xl/worksheets/sheetN.xml is which sheet
+xl/sharedStrings.xml       -> (most of) the text in the cells, de-duplicated
+xl/styles.xml              -> which cells are dates (dates are just numbers)
+
+The worksheets are parsed element by element, straight out of the zip,
+and every row is thrown away as soon as it has been turned into a dict.
+Only the shared strings table is kept around, as the cells refer to it.
+
+The rows come out the same as csv_reader.Read's: {COLUMN NAME: 'text'}.
+"""
+import re
+import zipfile
+import datetime
+import posixpath
+from decimal import Decimal
+from xml.etree import ElementTree
+
+from ekaterina.utils.fsutils import standardize_path
+from ekaterina.readers import csv_reader
+from ekaterina.readers.registry import ReaderError
+from ekaterina.readers.ods_reader import select_sheets
+
+class XLSXReadError(ReaderError):
+    pass
+
+WORKBOOK = "xl/workbook.xml"
+WORKBOOK_RELATIONSHIPS = "xl/_rels/workbook.xml.rels"
+SHARED_STRINGS = "xl/sharedStrings.xml"
+STYLES = "xl/styles.xml"
+
+RELATIONSHIP_ID = (
+    "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id")
+STRICT_RELATIONSHIP_ID = (
+    "{http://purl.oclc.org/ooxml/officeDocument/relationships}id")
+
+# Number formats that Excel has built in (i.e. that are not spelled out
+# in styles.xml) which show a number as a date and/or time.
+BUILTIN_DATE_FORMATS = set(range(14, 23)) | set(range(27, 37)) \
+    | set(range(45, 48)) | set(range(50, 59))
+
+# What is left of a number format once "quoted text", \escaped characters
+# and [colors]/[conditions] are taken out. If it has any of these, the
+# format shows a date/time.
+DATE_FORMAT_CODE = re.compile(r"[dmyhs]", re.IGNORECASE)
+FORMAT_CODE_NOISE = re.compile(r'"[^"]*"|\\.|\[[^\]]*\]')
+
+EPOCH_1900 = datetime.datetime(1899, 12, 30)
+EPOCH_1904 = datetime.datetime(1904, 1, 1)
+
+def localname(tag):
+    """'{namespace}name' -> 'name'"""
+    return tag.rsplit("}", 1)[-1]
+
+def column_index(cell_reference):
+    """
+    Return the (0-based) column index of a cell reference.
+
+    >>> column_index("A1")
+    0
+    >>> column_index("AB12")
+    27
+    """
+    index = 0
+    for character in cell_reference:
+        if not character.isalpha():
+            break
+        index = index * 26 + (ord(character.upper()) - ord("A") + 1)
+    return index - 1
+
+def iter_elements(xmlfile, tags):
+    """
+    Yield every element (with one of the given local names) of the xmlfile
+    once it has been parsed completely.
+    """
+    for event, element in ElementTree.iterparse(xmlfile, events=("end",)):
+        if localname(element.tag) in tags:
+            yield element
+
+def read_workbook(xlsx):
+    """
+    Return ([(sheet name, path of sheet xml in the zip)], is_1904_date_system)
+    for the given (open) zipfile.ZipFile.
+    """
+    targets = {}
+    with xlsx.open(WORKBOOK_RELATIONSHIPS) as relationships:
+        for relationship in iter_elements(relationships, {"Relationship"}):
+            target = relationship.get("Target")
+            if target.startswith("/"):
+                target = target.lstrip("/")
+            else:
+                target = posixpath.normpath(posixpath.join("xl", target))
+            targets[relationship.get("Id")] = target
+
+    sheets = []
+    date1904 = False
+    with xlsx.open(WORKBOOK) as workbook:
+        for element in iter_elements(workbook, {"sheet", "workbookPr"}):
+            if localname(element.tag) == "workbookPr":
+                date1904 = element.get("date1904") in ("1", "true")
+                continue
+            relationship_id = (element.get(RELATIONSHIP_ID)
+                               or element.get(STRICT_RELATIONSHIP_ID))
+            sheets.append((element.get("name"), targets[relationship_id]))
+    return sheets, date1904
+
+def read_shared_strings(xlsx):
+    """Return the shared strings table of the given zipfile.ZipFile"""
+    if SHARED_STRINGS not in xlsx.namelist():
+        return []
+    shared_strings = []
+    with xlsx.open(SHARED_STRINGS) as strings:
+        for si in iter_elements(strings, {"si"}):
+            shared_strings.append(string_item_text(si))
+            si.clear()
+    return shared_strings
+
+def string_item_text(element):
+    """
+    Return the text of a string item (<si> or <is>): either a single <t>,
+    or a bunch of rich text runs <r><t>. Phonetic hints (<rPh>) are not
+    part of the text.
+    """
+    text = []
+    for child in element:
+        name = localname(child.tag)
+        if name == "t":
+            text.append(child.text or "")
+        elif name == "r":
+            text.extend(t.text or "" for t in child
+                        if localname(t.tag) == "t")
+    return "".join(text)
+
+def read_date_styles(xlsx):
+    """
+    Return the set of style indices (the s="" of a cell) of the given
+    zipfile.ZipFile that show numbers as dates.
+    """
+    if STYLES not in xlsx.namelist():
+        return set()
+    custom_date_formats = set()
+    cell_formats = []
+    with xlsx.open(STYLES) as styles:
+        in_cell_formats = False
+        for event, element in ElementTree.iterparse(styles,
+                                                    events=("start", "end")):
+            name = localname(element.tag)
+            if name == "cellXfs":
+                in_cell_formats = (event == "start")
+            elif event == "end" and name == "numFmt":
+                format_code = FORMAT_CODE_NOISE.sub(
+                    "", element.get("formatCode", ""))
+                if DATE_FORMAT_CODE.search(format_code):
+                    custom_date_formats.add(int(element.get("numFmtId")))
+            elif event == "end" and name == "xf" and in_cell_formats:
+                cell_formats.append(int(element.get("numFmtId", 0)))
+
+    date_formats = BUILTIN_DATE_FORMATS | custom_date_formats
+    return {style for (style, number_format) in enumerate(cell_formats)
+            if number_format in date_formats}
+
+# Excel keeps a number to 15 significant digits, and shows it so. What
+# it writes down is the float, to 17 ("2.2000000000000002"), and a sum
+# can be off in the last of those (0.1 + 0.2 -> "0.30000000000000004").
+EXCEL_DIGITS = 15
+
+def format_number(value):
+    """Spell out numbers the way they are seen (to Excel's 15 significant
+       digits), not in the E notation"""
+    try:
+        number = format(float(value), ".{}g".format(EXCEL_DIGITS))
+    except ValueError:
+        return value
+    return format(Decimal(number).normalize(), "f")
+
+def format_date(value, date1904):
+    """
+    Turn a spreadsheet serial date number into YYYY-MM-DD. The time of
+    day, if any, is dropped: csv_parser takes dates only, and that's
+    what the .ods path (LibreOffice) gives for the same cell.
+    """
+    serial = float(value)
+    if date1904:
+        epoch = EPOCH_1904
+    elif serial < 61:
+        # Excel counts 1900 as a leap year (as Lotus 1-2-3 did): day 60
+        # is 1900-02-29, which never was (so it's no date csv_parser
+        # will take), and the days before it are one off from the epoch
+        # that's right for the rest.
+        if int(serial) == 60:
+            return "1900-02-29"
+        epoch = EPOCH_1900 + datetime.timedelta(days=1)
+    else:
+        epoch = EPOCH_1900
+    date = epoch + datetime.timedelta(days=serial)
+    # Spreadsheets store times as fractions of a day. Round off the
+    # floating point fuzz (a date that comes out as 23:59:59.9999 of the
+    # day before) before dropping the time.
+    date = date + datetime.timedelta(microseconds=500000)
+    return date.strftime("%Y-%m-%d")
+
+def cell_text(cell, shared_strings, date_styles, date1904):
+    """Return the text of a <c> cell element"""
+    cell_type = cell.get("t", "n")
+    value = None
+    for child in cell:
+        name = localname(child.tag)
+        if name == "v":
+            value = child.text or ""
+        elif name == "is":
+            return string_item_text(child)
+    if value is None:
+        return ""
+    if cell_type == "s":
+        return shared_strings[int(value)]
+    if cell_type == "b":
+        return "TRUE" if value == "1" else "FALSE"
+    if cell_type == "n":
+        if int(cell.get("s", 0)) in date_styles:
+            return format_date(value, date1904)
+        return format_number(value)
+    # "str" (formula results), "e" (errors), "d" (ISO 8601 dates)
+    return value
+
+def iter_sheet_rows(xlsx, sheet_path, shared_strings, date_styles, date1904,
+                    columns=frozenset()):
+    """
+    Yield the rows of the given worksheet as (row number, [cell texts]),
+    skipping rows that are entirely empty.
+
+    If columns (a set of column indices) has anything in it, the other
+    cells are left out (empty). It can be filled in once the header has
+    been read.
+    """
+    row = {}
+    row_number = 0
+    with xlsx.open(sheet_path) as sheet:
+        for event, element in ElementTree.iterparse(sheet,
+                                                    events=("start", "end")):
+            name = localname(element.tag)
+            if event == "start":
+                if name == "sheetData":
+                    sheet_data = element
+                continue
+            if name == "c":
+                reference = element.get("r")
+                index = (column_index(reference) if reference
+                         else (max(row) + 1 if row else 0))
+                if columns and index not in columns:
+                    row[index] = ""
+                else:
+                    row[index] = cell_text(element, shared_strings,
+                                           date_styles, date1904)
+            elif name == "row":
+                row_number = int(element.get("r", 0)) or row_number + 1
+                if any(row.values()):
+                    cells = [""] * (max(row) + 1)
+                    for index, text in row.items():
+                        cells[index] = text
+                    yield (row_number, cells)
+                row = {}
+                # Done with this row. Don't let it pile up in memory.
+                sheet_data.clear()
+
+def iter_sheet_records(xlsx, sheet_path, shared_strings, date_styles, date1904,
+                       **projection):
+    """
+    Yield the rows of the given worksheet as {COLUMN NAME: 'text'} dicts,
+    taking the column names from the first row.
+
+    The projection (fields, require, row_field) picks the columns and
+    rows (See: csv_reader.Projection). Cells of the columns left out are
+    not even decoded.
+    """
+    columns = set()
+    rows = iter_sheet_rows(xlsx, sheet_path, shared_strings,
+                           date_styles, date1904, columns)
+    (header_row_number, header) = next(rows, (None, None))
+    if header is None:
+        return
+    if not projection:
+        for (row_number, cells) in rows:
+            cells = cells + [""] * (len(header) - len(cells))
+            yield dict(zip(header, cells))
+        return
+    projection = csv_reader.Projection(header, restval="", **projection)
+    columns.update(projection.wanted)
+    columns.update(column for column in projection.required
+                   if column is not None)
+    # (Nothing wanted at all: don't let an empty set mean everything.)
+    columns.add(-1)
+    for (row_number, cells) in rows:
+        record = projection.record(cells, row_number)
+        if record is not None:
+            yield record
+
+def iter_records(xlsx, sheet_paths, selected_sheets, tag_sheets,
+                 date1904, **projection):
+    """
+    Yield the records of the selected sheets of the (open) xlsx, one
+    after the other, and close it once they are all read.
+    """
+    with xlsx:
+        shared_strings = read_shared_strings(xlsx)
+        date_styles = read_date_styles(xlsx)
+        for sheet_name in selected_sheets:
+            for record in iter_sheet_records(xlsx, sheet_paths[sheet_name],
+                                             shared_strings, date_styles,
+                                             date1904, **projection):
+                if tag_sheets:
+                    record[csv_reader.SHEET_FIELD] = sheet_name
+                yield record
+
+def Read(xlsxfile, sheets=None, **projection):
+    """
+    Read in an .xlsx file and return an iterator over all things read,
+    row by row.
+
+    By default, only the first sheet is read. Pass `sheets` (see
+    ods_reader.select_sheets) to read others, in which case each row is
+    tagged with the name of its sheet under csv_reader.SHEET_FIELD.
+
+    fields, require and row_field pick the columns and rows to read
+    (See: csv_reader.Projection).
+
+    The workbook is opened, and the sheets picked, right away: raises
+    XLSXReadError (or ods_reader.SheetSelectionError) here, rather than
+    once the rows are asked for.
+    """
+    try:
+        xlsx = zipfile.ZipFile(standardize_path(xlsxfile))
+    except (FileNotFoundError, zipfile.BadZipFile) as error:
+        raise XLSXReadError("Could not open '{}': {}".format(xlsxfile, error))
+
+    try:
+        workbook_sheets, date1904 = read_workbook(xlsx)
+        if not workbook_sheets:
+            raise XLSXReadError("'{}' has no sheets".format(xlsxfile))
+        sheet_names = [name for (name, path) in workbook_sheets]
+        if sheets is None:
+            selected_sheets = sheet_names[:1]
+        else:
+            selected_sheets = select_sheets(sheet_names, sheets)
+    except BaseException:
+        xlsx.close()
+        raise
+    return iter_records(xlsx, dict(workbook_sheets), selected_sheets,
+                        sheets is not None, date1904, **projection)
@@ -0,0 +1,62 @@
+"""
+Undoes an import: deletes what a batch made from the book, and saves it.
+(See: batch.py)
+
+The batch's sidecar file is then renamed to <batch ID>.json.rolledback,
+so that the batch isn't rolled back twice, but can still be looked at.
+The watermarks the batch moved on (See: watermark.py) are moved back.
+A batch whose sources have been imported again since is refused: roll
+the later batches back first.
+
+Usage:
+    python3 -m ekaterina.rollback BATCH GNUCASH_FILE
+"""
+import os
+import sys
+import argparse
+
+import gnucash
+
+from ekaterina import batch
+from ekaterina import watermark
+
+def roll_back(gnucashfile, batch_ID):
+    """
+    Roll the batch back in gnucashfile, save it, and return the counts.
+
+    Raises batch.BatchError or watermark.WatermarkError (before anything
+    is rolled back) if it can't be.
+    """
+    Batch = batch.read_batch(gnucashfile, batch_ID)
+    marks = watermark.Watermarks(gnucashfile)
+    moved_back = marks.roll_back(batch_ID)
+    session = gnucash.Session(gnucashfile)
+    try:
+        counts = batch.Rollback(session.book, Batch)
+        session.save()
+    finally:
+        session.end()
+    path = batch.batch_path(gnucashfile, batch_ID)
+    os.replace(path, path + ".rolledback")
+    if moved_back:
+        marks.save()
+    return counts
+
+def main():
+    argparser = argparse.ArgumentParser(prog="python3 -m ekaterina.rollback")
+    argparser.add_argument("batch", metavar="BATCH",
+                           help="the batch ID the import printed")
+    argparser.add_argument("gnucashfile", metavar="GNUCASH_FILE")
+    args = argparser.parse_args()
+
+    try:
+        counts = roll_back(args.gnucashfile, args.batch)
+    except (batch.BatchError, watermark.WatermarkError) as error:
+        argparser.error(str(error))
+    print("Deleted: {deleted} (and {links} lot links), already gone: "
+          "{missing}, not the batch's (left alone): {untagged}".format(
+              **counts))
+    sys.exit(0 if not counts["untagged"] else 1)
+
+if __name__ == "__main__":
+    main()
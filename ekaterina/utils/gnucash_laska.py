@@ -3,8 +3,99 @@ Laska: Konstantin "Kostya" Dmitrievich Levin's doggo in 'Anna Karenina'.
 
 Utilities, wrappers, helper-functions around gnucash python.
 """
+import difflib
+
 import gnucash
 
+class AccountLookupError(Exception):
+    pass
+
+class AccountTree:
+
+    """
+    A snapshot of the whole account hierarchy of a GNUCash book.
+
+    The accounts are walked through once, and kept in a dictionary keyed
+    by their full names in the format ekaterina uses for them (i.e.
+    "Root Account:Sub Account", whatever the separator of the book is).
+    Looking an account up is then a dictionary lookup, rather than a walk
+    down the tree from the root.
+    """
+    def __init__(self, GNCBook):
+        # {full name: [gnucash.Account, ...]} (GNUCash does allow two
+        # accounts with the same name under the same parent.)
+        self.accounts = {}
+        for child in GNCBook.get_root_account().get_children():
+            self.add_account(child, [])
+
+    def add_account(self, account, parent_names):
+        names = parent_names + [account.GetName()]
+        self.accounts.setdefault(":".join(names), []).append(account)
+        for child in account.get_children():
+            self.add_account(child, names)
+
+    def __contains__(self, full_name):
+        return full_name in self.accounts
+
+    def names(self):
+        return list(self.accounts)
+
+    def suggest(self, full_name):
+        """Return the names of the accounts that full_name might have meant"""
+        return suggest_account_names(full_name, self.accounts)
+
+    def lookup(self, full_name):
+        """
+        Return the gnucash.Account with the given full name.
+
+        Raises AccountLookupError, with suggestions, if there is no such
+        account, or if there are more than one.
+        """
+        accounts = self.accounts.get(full_name)
+        if not accounts:
+            raise AccountLookupError(
+                describe_unknown_account(full_name, self.suggest(full_name)))
+        if len(accounts) > 1:
+            raise AccountLookupError(
+                "Ambiguous account '{}': there are {} accounts with that name"
+                .format(full_name, len(accounts)))
+        return accounts[0]
+
+def suggest_account_names(full_name, known_names):
+    """
+    Return the known account names that full_name might have meant:
+    the ones that differ only in case, the ones with the same name that
+    have moved (or whose parents were renamed) and the ones that look
+    alike, in that order.
+    """
+    suggestions = [name for name in known_names
+                   if name.lower() == full_name.lower()]
+    leaf = full_name.split(":")[-1]
+    suggestions += [name for name in known_names
+                    if name.split(":")[-1] == leaf]
+    suggestions += difflib.get_close_matches(full_name, known_names, n=3)
+    # Drop the duplicates, keeping the order.
+    return list(dict.fromkeys(suggestions))
+
+def describe_unknown_account(full_name, suggestions):
+    """Return a message about an unknown account, with any suggestions"""
+    message = "Unknown account '{}'".format(full_name)
+    if suggestions:
+        message += ". Did you mean: {}?".format(
+            ", ".join("'{}'".format(name) for name in suggestions))
+    return message
+
+def open_session_read_only(gnucashfile):
+    """
+    Open a gnucash.Session on gnucashfile just to read it: without
+    locking it, and without any way to save it.
+    """
+    try:
+        from gnucash import SessionOpenMode
+    except ImportError: # GNUCash < 4
+        return gnucash.Session(gnucashfile, ignore_lock=True)
+    return gnucash.Session(gnucashfile, SessionOpenMode.SESSION_READ_ONLY)
+
 def get_dummy_session():
     """Returns a dummy GNUCash Session"""
     return gnucash.gnucash_core.Session()
@@ -17,14 +108,31 @@ def get_dummy_commodity_table():
     """Return a dummy GNUCash Commodity table"""
     return get_dummy_book().get_table()
 
+# The codes of the currencies GNUCash knows (See: currency_codes)
+_currency_codes = None
+
+def currency_codes():
+    """
+    Return the (frozen) set of the codes of the currencies GNUCash knows.
+
+    They are read off a dummy commodity table the first time, and kept.
+    After that, checking a currency code doesn't need the engine at all,
+    which matters where another thread is using it (See: pipeline.py):
+    the engine is not thread-safe. So call this once, up front, there.
+    """
+    global _currency_codes
+    if _currency_codes is None:
+        _currency_codes = frozenset(
+            commodity.get_mnemonic() for commodity
+            in get_dummy_commodity_table().get_commodities("CURRENCY"))
+    return _currency_codes
+
 def is_valid_currency(currency_code):
     """Return whether or not given currency_code is a valid
        currency or not."""
     if not isinstance(currency_code, str):
         raise ValueError("Expected 3 (uppercase) letter currency code.")
-    return bool(get_dummy_commodity_table()
-                .lookup("CURRENCY",
-                        currency_code))
+    return currency_code in currency_codes()
 
 def is_valid_account_specification(account):
     """
@@ -55,6 +163,108 @@ def is_valid_account_specification(account):
               and ":" not in substr)),
             account.split(":")))
 
+def as_GncLot(lot):
+    """
+    Return the given lot as a gnucash.GncLot.
+
+    Lists of lots handed out by the engine (Account.GetLotList(), etc.)
+    are not always wrapped in the python class.
+    """
+    from gnucash.gnucash_core import GncLot
+    if isinstance(lot, GncLot):
+        return lot
+    return GncLot(instance=lot)
+
+def get_lot_owner_ID(lot):
+    """
+    Return the ID of the owner (Customer, Vendor, ...) of the given
+    gnucash.GncLot: the owner of the invoice posted to it, or, for a
+    payment's lot (a credit: an overpayment, a credit note), the owner
+    it was made out to. None if the lot has no owner.
+
+    That is, the end owner: for an invoice billed to a job, the
+    customer the job is for, not the job.
+    """
+    from gnucash import gnucash_core_c
+    invoice = lot.GetInvoiceFromLot()
+    if invoice is not None:
+        owner = gnucash_core_c.gncInvoiceGetOwner(invoice.instance)
+        return gnucash_core_c.gncOwnerGetID(
+            gnucash_core_c.gncOwnerGetEndOwner(owner))
+    owner = gnucash_core_c.gncOwnerNew()
+    try:
+        if not gnucash_core_c.gncOwnerGetOwnerFromLot(lot.instance, owner):
+            return None
+        return gnucash_core_c.gncOwnerGetID(
+            gnucash_core_c.gncOwnerGetEndOwner(owner))
+    finally:
+        gnucash_core_c.gncOwnerFree(owner)
+
+def get_account_full_name(account):
+    """
+    Return the full name of the gnucash.Account in the format ekaterina
+    uses: "Root Account:Sub Account", whatever the separator of the book.
+    """
+    names = []
+    while account is not None and not account.is_root():
+        names.insert(0, account.GetName())
+        account = account.get_parent()
+    return ":".join(names)
+
+def is_same(gnucash_object, other_gnucash_object):
+    """Whether the two python objects wrap the same engine object"""
+    return gnucash_object.instance == other_gnucash_object.instance
+
+def get_guid_string(gnucash_object):
+    """Return the GUID of the gnucash object (Invoice, Transaction, ...) as a string"""
+    return gnucash_object.GetGUID().to_string()
+
+def guid_from_string(guid_string):
+    """Return a gnucash.GUID when given its string (See: get_guid_string)"""
+    guid = gnucash.GUID()
+    if not gnucash.gnucash_core_c.string_to_guid(guid_string, guid.instance):
+        raise ValueError("Not a GUID: {!r}".format(guid_string))
+    return guid
+
+def lookup_transaction(GNCBook, guid_string):
+    """Return the gnucash.Transaction with the given GUID, or None"""
+    return guid_from_string(guid_string).TransLookup(GNCBook)
+
+def lookup_invoice(GNCBook, guid_string):
+    """Return the gnucash.Invoice with the given GUID, or None"""
+    return GNCBook.InvoiceLookup(guid_from_string(guid_string))
+
+def lookup_entry(GNCBook, guid_string):
+    """Return the gnucash.Entry (of an invoice) with the given GUID, or None"""
+    return GNCBook.EntryLookup(guid_from_string(guid_string))
+
+def get_lot_links(GNCTransaction):
+    """
+    Return the lot-link transactions that tie the lots of the
+    gnucash.Transaction's splits to other lots: a payment's lot to the
+    invoices it paid, for instance. (GnuCash makes them when it applies
+    a payment: See gncOwnerApplyPaymentSecs.)
+    """
+    from gnucash import gnucash_core_c
+    links = {}
+    for split in GNCTransaction.GetSplitList():
+        lot = split.GetLot()
+        if lot is None:
+            continue
+        for lot_split in as_GncLot(lot).get_split_list():
+            transaction = lot_split.GetParent()
+            if transaction.GetTxnType() == gnucash_core_c.TXN_TYPE_LINK:
+                links.setdefault(get_guid_string(transaction), transaction)
+    return list(links.values())
+
+def to_GList(gnucash_objects):
+    """
+    Return a list that the bindings will accept for a GList * argument.
+
+    SWIG wants the bare engine pointers, not the python objects around them.
+    """
+    return [gnucash_object.instance for gnucash_object in gnucash_objects]
+
 # The following is adapted from GNUCash API doxygen Docs
 def gnc_numeric_from_decimal(decimal_value):
     """Return a gnucash.GncNumeric() when given a decimal.Decimal()"""
@@ -88,3 +298,8 @@ def gnc_numeric_from_decimal(decimal_value):
         denominator = 1
 
     return GncNumeric(numerator, denominator)
+
+def decimal_from_gnc_numeric(numeric_value):
+    """Return a decimal.Decimal() when given a gnucash.GncNumeric()"""
+    from decimal import Decimal
+    return Decimal(numeric_value.num()) / Decimal(numeric_value.denom())
@@ -0,0 +1,182 @@
+"""
+Incremental imports of spreadsheets that only ever grow.
+
+Some spreadsheets are kept running: rows are added at the bottom, day
+after day, and the whole thing is imported again every day. Only the
+new rows should go into the book (the rest are in it already), and
+there's no need to parse the old ones all over again either.
+
+For that, the book keeps a watermark for every such spreadsheet (its
+source: the file, and the sheets read of it), in
+<book>.watermarks.json: how many rows had been read from
+it, and a hash of those rows. Next time, the same number of rows is
+read, and hashed; if the hash is still the same, the rows that follow
+are the new ones (See: new_rows).
+
+If it isn't, the spreadsheet has been changed rather than added to.
+Importing all of it again would put what's already in the book in
+there a second time, so that's refused, unless asked for (reimport).
+
+The rows are hashed as they are in the spreadsheet: every column of
+every row (See: reader_options), not just what the parser reads of
+them. So a change in what that is (a rules file, say) doesn't make a
+spreadsheet look changed. A watermark is only ever moved on once the
+book has been saved, and it's moved back if the import (its batch) is
+rolled back. The watermarks before it are kept, so that imports can be
+rolled back one after the other, the latest first.
+"""
+import os
+import json
+import hashlib
+import datetime
+import collections
+
+from ekaterina.parsers import csv_parser
+
+class WatermarkError(Exception):
+    pass
+
+# rows: how many rows the source had; sha256: the hash of those rows.
+Watermark = collections.namedtuple("Watermark", ["rows", "sha256"])
+
+def watermarks_path(gnucashfile):
+    return "{}.watermarks.json".format(gnucashfile)
+
+def source_key(source, sheets=None):
+    """
+    What a source's watermark is kept under: the file, and the sheets
+    read of it (See: registry.Read), if not just the first. Another
+    selection of sheets is another source, with rows of its own.
+    """
+    path = os.path.abspath(os.path.expanduser(source))
+    if sheets is None:
+        return path
+    return "{}#{}".format(path, json.dumps(sheets))
+
+def mark_history(mark):
+    """
+    The watermarks a source had before mark (as kept with it), the
+    latest last.
+    """
+    if mark is None:
+        return []
+    if "history" in mark:
+        return list(mark["history"])
+    # As they were kept before there was a history: the one before only.
+    if mark.get("previous") is not None:
+        return [dict(mark["previous"], batch=None, updated=None)]
+    return []
+
+def reader_options():
+    """
+    The keyword arguments to pass a reader, for new_rows(): the rows
+    whole, as they are in the spreadsheet (numbered, for the rejects).
+    csv_parser.Parse picks what it needs out of them.
+    """
+    return {"row_field": csv_parser.SOURCE_ROW_FIELD}
+
+def row_bytes(record):
+    """A row (a reader's dict), the same way every time"""
+    return json.dumps(record, sort_keys=True, ensure_ascii=False).encode()
+
+def new_rows(records, Mark=None, reimport=False):
+    """
+    Return (the records that are new since the Watermark, the Watermark
+    of all the records, whether only the new ones are returned).
+
+    Without a Watermark, every one of them is new. If the records don't
+    start the way they did (fewer rows, or a different hash), they would
+    all be imported again, on top of those in the book already: that
+    raises WatermarkError, unless reimport.
+    """
+    records = list(records)
+    digest = hashlib.sha256()
+    incremental = False
+    for (index, record) in enumerate(records):
+        if Mark is not None and index == Mark.rows:
+            incremental = digest.hexdigest() == Mark.sha256
+        digest.update(row_bytes(record))
+    if Mark is not None and len(records) == Mark.rows:
+        incremental = digest.hexdigest() == Mark.sha256
+    if Mark is not None and not incremental and not reimport:
+        raise WatermarkError(
+            "The spreadsheet has changed since its last import (not just "
+            "rows added after its first {}): importing every row again "
+            "would duplicate what's already in the book".format(Mark.rows))
+    fresh = records[Mark.rows:] if incremental else records
+    return (fresh, Watermark(len(records), digest.hexdigest()), incremental)
+
+class Watermarks:
+
+    """The watermarks of a book's sources (See: the module docstring)"""
+    def __init__(self, gnucashfile):
+        self.path = watermarks_path(gnucashfile)
+        self.marks = {}
+        try:
+            with open(self.path) as marks_file:
+                self.marks = json.load(marks_file)
+        except FileNotFoundError:
+            pass
+        except ValueError as error:
+            raise WatermarkError("Could not read '{}': {}".format(
+                self.path, error))
+
+    def get(self, source, sheets=None):
+        """Return the Watermark of the sheets of source, or None"""
+        mark = self.marks.get(source_key(source, sheets))
+        if mark is None:
+            return None
+        return Watermark(mark["rows"], mark["sha256"])
+
+    def set(self, source, Mark, batch_ID=None, sheets=None):
+        """
+        Move the watermark of the sheets of source on (save() once the
+        book is saved), for the import of batch batch_ID (See: batch.py).
+        """
+        key = source_key(source, sheets)
+        previous = self.marks.get(key)
+        history = mark_history(previous)
+        if previous is not None:
+            history.append({"rows": previous["rows"],
+                            "sha256": previous["sha256"],
+                            "batch": previous.get("batch"),
+                            "updated": previous.get("updated")})
+        self.marks[key] = dict(Mark._asdict(), batch=batch_ID,
+                               history=history,
+                               updated=datetime.datetime.now().isoformat())
+
+    def roll_back(self, batch_ID):
+        """
+        Move the watermarks the batch moved on back to where they were
+        before it (save() once the book is saved). Return how many there
+        were.
+
+        Raises WatermarkError, and moves nothing, if a source has been
+        imported again since: moved back past that import, its watermark
+        would have the rows still in the book imported a second time.
+        Roll the later batches back first.
+        """
+        for (key, mark) in self.marks.items():
+            if any(earlier.get("batch") == batch_ID
+                   for earlier in mark_history(mark)):
+                raise WatermarkError(
+                    "'{}' has been imported again since batch {} (by batch "
+                    "{}): roll that back first".format(key, batch_ID,
+                                                       mark.get("batch")))
+        count = 0
+        for (key, mark) in list(self.marks.items()):
+            if mark.get("batch") != batch_ID:
+                continue
+            count += 1
+            history = mark_history(mark)
+            if not history:
+                del self.marks[key]
+            else:
+                self.marks[key] = dict(history[-1], history=history[:-1])
+        return count
+
+    def save(self):
+        temporary = self.path + ".new"
+        with open(temporary, "w") as marks_file:
+            json.dump(self.marks, marks_file, indent=1, sort_keys=True)
+        os.replace(temporary, self.path)
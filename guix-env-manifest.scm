@@ -3,4 +3,5 @@
 (specifications->manifest
  (list "python"
        "python-pytest"
+       "python-numpy"
        "gnucash:python"))
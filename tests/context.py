@@ -4,7 +4,23 @@ import sys
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from ekaterina.readers import csv_reader
 from ekaterina.readers import ods_reader
+from ekaterina.readers import xlsx_reader
+from ekaterina.parsers import csv_parser
 from ekaterina.utils import fsutils
 from ekaterina import classes
+from ekaterina import mazurka
+from ekaterina import pipeline
 from ekaterina.utils import gnucash_laska
+from ekaterina.exporters import csv_exporter
+from ekaterina import daemon
+from ekaterina.parsers import columnar
+from ekaterina import manifest
+from ekaterina import batch
+from ekaterina import rollback
+from ekaterina import progress
+from ekaterina.parsers import rules
+from ekaterina.readers import registry
+from ekaterina import catalog
+from ekaterina import watermark
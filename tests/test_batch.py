@@ -0,0 +1,287 @@
+import json
+from unittest import mock
+
+import pytest
+
+from context import batch
+from context import mazurka
+from context import rollback
+
+def mock_object(guid, notes=None):
+    obj = mock.Mock()
+    obj.GetGUID.return_value.to_string.return_value = guid
+    obj.GetNotes.return_value = notes
+    obj.GetEntries.return_value = []
+    obj.GetSplitList.return_value = []
+    return obj
+
+class TestBatch:
+
+    def test_add_invoice_with_entries(self):
+        Batch = batch.Batch("anna")
+        invoice = mock_object("invoice-1")
+        invoice.GetEntries.return_value = [mock_object("entry-1"),
+                                           mock_object("entry-2")]
+        Batch.add_invoice(invoice)
+        Batch.add_transaction(mock_object("txn-1"))
+        assert Batch.tag == "ekaterina-batch: anna"
+        assert Batch.to_dict() == {"batch": "anna", "invoices": ["invoice-1"],
+                                   "entries": ["entry-1", "entry-2"],
+                                   "transactions": ["txn-1"]}
+        assert len(Batch) == 2
+
+    def test_write_and_read(self, tmp_path):
+        book = str(tmp_path / "book.gnucash")
+        Batch = batch.Batch()
+        Batch.invoices = ["invoice-1"]
+        path = Batch.write(book)
+        assert path == str(tmp_path / "book.gnucash.batches" /
+                           "{}.json".format(Batch.ID))
+        assert json.loads(open(path).read())["invoices"] == ["invoice-1"]
+        read = batch.read_batch(book, Batch.ID)
+        assert read.to_dict() == Batch.to_dict()
+
+    def test_read_missing_batch(self, tmp_path):
+        with pytest.raises(batch.BatchError):
+            batch.read_batch(str(tmp_path / "book.gnucash"), "levin")
+
+    def test_new_IDs_differ(self):
+        assert batch.new_batch_ID() != batch.new_batch_ID()
+
+class TestRollback:
+
+    @pytest.fixture
+    def book(self, monkeypatch):
+        objects = {}
+        monkeypatch.setattr(batch.gnucash_laska, "lookup_transaction",
+                            lambda book, guid: objects.get(guid))
+        monkeypatch.setattr(batch.gnucash_laska, "lookup_invoice",
+                            lambda book, guid: objects.get(guid))
+        return objects
+
+    def test_deletes_only_tagged(self, book):
+        Batch = batch.Batch("anna")
+        Batch.invoices = ["invoice-1", "invoice-2", "invoice-gone"]
+        Batch.transactions = ["txn-1"]
+        book["invoice-1"] = mock_object("invoice-1", Batch.tag)
+        book["invoice-2"] = mock_object("invoice-2", "Vronsky's")
+        book["txn-1"] = mock_object("txn-1", Batch.tag)
+        calls = mock.Mock()
+        calls.attach_mock(book["txn-1"].Destroy, "destroy_transaction")
+        calls.attach_mock(book["invoice-1"].Unpost, "unpost_invoice")
+        counts = batch.Rollback(mock.Mock(), Batch)
+        assert counts == {"deleted": 2, "missing": 1, "untagged": 1,
+                          "links": 0}
+        # The invoice is unposted (and unlinked) before the payment goes.
+        assert [name for (name, args, kwargs) in calls.mock_calls] == \
+            ["unpost_invoice", "destroy_transaction"]
+        book["invoice-1"].Destroy.assert_called_once()
+        book["invoice-2"].Destroy.assert_not_called()
+
+    def test_leaves_nothing_of_the_batch_behind(self, monkeypatch):
+        # A little book: the batch's invoice, paid by the batch's
+        # payment, which also paid an invoice from before. GnuCash
+        # linked the payment's lot to both.
+        book = FakeBook(monkeypatch)
+        old_invoice = book.invoice("invoice-0", "from before")
+        invoice = book.invoice("invoice-1", "ekaterina-batch: anna",
+                               entries=["entry-1", "entry-2"])
+        payment = book.transaction("txn-1", "ekaterina-batch: anna")
+        payment_lot = book.lot(payment)
+        book.link(payment_lot, invoice.lot)
+        book.link(payment_lot, old_invoice.lot)
+        Batch = batch.Batch("anna")
+        Batch.invoices = ["invoice-1"]
+        Batch.entries = ["entry-1", "entry-2"]
+        Batch.transactions = ["txn-1"]
+
+        counts = batch.Rollback(book, Batch)
+        assert counts == {"deleted": 2, "missing": 0, "untagged": 0,
+                          "links": 1}
+        batch_lots = {payment_lot, invoice.lot}
+        for transaction in book.transactions.values():
+            if transaction.destroyed:
+                continue
+            assert not any(split.lot in batch_lots
+                           for split in transaction.splits)
+            assert transaction.GetTxnType() != "L"
+        # The invoice from before is as it was: only its own posting.
+        assert [split.parent.guid for split in old_invoice.lot.splits] == [
+            "posted-invoice-0"]
+        assert invoice.destroyed and not invoice.entries
+        assert all(entry.destroyed for entry in book.entries.values())
+
+class FakeGUID:
+    def __init__(self, guid):
+        self.guid = guid
+    def to_string(self):
+        return self.guid
+
+class FakeObject:
+    def __init__(self, guid, notes=None):
+        (self.guid, self.notes, self.destroyed) = (guid, notes, False)
+    def GetGUID(self):
+        return FakeGUID(self.guid)
+    def GetNotes(self):
+        return self.notes
+    def BeginEdit(self):
+        pass
+    def CommitEdit(self):
+        pass
+
+class FakeLot:
+    def __init__(self):
+        self.splits = []
+    def get_split_list(self):
+        return list(self.splits)
+
+class FakeSplit:
+    def __init__(self, parent, lot):
+        (self.parent, self.lot) = (parent, lot)
+        lot.splits.append(self)
+    def GetParent(self):
+        return self.parent
+    def GetLot(self):
+        return self.lot
+
+class FakeTransaction(FakeObject):
+    def __init__(self, guid, notes=None, txn_type="P"):
+        super().__init__(guid, notes)
+        (self.txn_type, self.splits) = (txn_type, [])
+    def GetTxnType(self):
+        return self.txn_type
+    def GetSplitList(self):
+        return list(self.splits)
+    def Destroy(self):
+        self.destroyed = True
+        for split in self.splits:
+            split.lot.splits.remove(split)
+
+class FakeEntry(FakeObject):
+    def __init__(self, guid, invoice):
+        super().__init__(guid)
+        self.invoice = invoice
+    def GetInvoice(self):
+        return self.invoice
+    def Destroy(self):
+        assert self.invoice is None, "Still in its invoice"
+        self.destroyed = True
+
+class FakeInvoice(FakeObject):
+    def __init__(self, book, guid, notes):
+        super().__init__(guid, notes)
+        self.lot = FakeLot()
+        self.posted = book.transaction("posted-" + guid, txn_type="I")
+        FakeSplit(self.posted, self.lot)
+        self.entries = []
+    def IsPosted(self):
+        return self.posted is not None
+    def Unpost(self, reset_tax_tables):
+        # As GnuCash does: the posting goes, and so do the lot links.
+        for split in self.lot.get_split_list():
+            if split.parent.txn_type == "L" or split.parent is self.posted:
+                split.parent.Destroy()
+        self.posted = None
+    def RemoveEntry(self, entry):
+        self.entries.remove(entry)
+        entry.invoice = None
+    def Destroy(self):
+        assert not self.IsPosted(), "Still posted"
+        self.destroyed = True
+
+class FakeBook:
+    def __init__(self, monkeypatch):
+        (self.transactions, self.invoices, self.entries) = ({}, {}, {})
+        monkeypatch.setattr(batch.gnucash_laska, "lookup_transaction",
+                            lambda book, guid: self.transactions.get(guid))
+        monkeypatch.setattr(batch.gnucash_laska, "lookup_invoice",
+                            lambda book, guid: self.invoices.get(guid))
+        monkeypatch.setattr(batch.gnucash_laska, "lookup_entry",
+                            lambda book, guid: self.entries.get(guid))
+        monkeypatch.setattr(batch.gnucash_laska, "as_GncLot", lambda lot: lot)
+        monkeypatch.setattr(batch.gnucash_laska.gnucash.gnucash_core_c,
+                            "TXN_TYPE_LINK", "L", raising=False)
+
+    def transaction(self, guid, notes=None, txn_type="P"):
+        self.transactions[guid] = FakeTransaction(guid, notes, txn_type)
+        return self.transactions[guid]
+
+    def invoice(self, guid, notes, entries=()):
+        invoice = self.invoices[guid] = FakeInvoice(self, guid, notes)
+        for entry in entries:
+            self.entries[entry] = FakeEntry(entry, invoice)
+            invoice.entries.append(self.entries[entry])
+        return invoice
+
+    def lot(self, transaction):
+        lot = FakeLot()
+        transaction.splits.append(FakeSplit(transaction, lot))
+        return lot
+
+    def link(self, lot, other_lot):
+        link = self.transaction("link-{}".format(len(self.transactions)),
+                                txn_type="L")
+        link.splits += [FakeSplit(link, lot), FakeSplit(link, other_lot)]
+
+    def test_roll_back_renames_sidecar(self, tmp_path, book, monkeypatch):
+        gnucashfile = str(tmp_path / "book.gnucash")
+        Batch = batch.Batch("anna")
+        Batch.write(gnucashfile)
+        marks = rollback.watermark.Watermarks(gnucashfile)
+        marks.set("moscow.csv", rollback.watermark.Watermark(3, "kitty"), "anna")
+        marks.save()
+        session = mock.Mock()
+        monkeypatch.setattr(rollback.gnucash, "Session",
+                            mock.Mock(return_value=session), raising=False)
+        counts = rollback.roll_back(gnucashfile, "anna")
+        assert counts["deleted"] == 0
+        session.save.assert_called_once()
+        session.end.assert_called_once()
+        with pytest.raises(batch.BatchError):
+            batch.read_batch(gnucashfile, "anna")
+        # The import that moved the watermark on is undone: so is that.
+        assert rollback.watermark.Watermarks(gnucashfile).get("moscow.csv") is None
+
+    def test_roll_back_refuses_an_earlier_import(self, tmp_path, monkeypatch):
+        gnucashfile = str(tmp_path / "book.gnucash")
+        batch.Batch("anna").write(gnucashfile)
+        marks = rollback.watermark.Watermarks(gnucashfile)
+        marks.set("moscow.csv", rollback.watermark.Watermark(3, "kitty"), "anna")
+        marks.set("moscow.csv", rollback.watermark.Watermark(5, "levin"), "stiva")
+        marks.save()
+        Session = mock.Mock()
+        monkeypatch.setattr(rollback.gnucash, "Session", Session, raising=False)
+        with pytest.raises(rollback.watermark.WatermarkError, match="stiva"):
+            rollback.roll_back(gnucashfile, "anna")
+        Session.assert_not_called()
+        assert batch.read_batch(gnucashfile, "anna").ID == "anna"
+
+def test_invoices_are_tagged_and_added(monkeypatch):
+    monkeypatch.setattr(mazurka, "next_invoice_ID",
+                        mock.Mock(side_effect=range(2)))
+    made = []
+    def ekat_to_gnc_Invoice(book, invoice, ID, Accounts, Notes):
+        made.append(Notes)
+        return mock_object("invoice-{}".format(ID))
+    monkeypatch.setattr(mazurka, "ekat_to_gnc_Invoice", ekat_to_gnc_Invoice)
+    monkeypatch.setattr(mazurka, "post_gncInvoice", mock.Mock())
+    Batch = batch.Batch("anna")
+    mazurka.add_ekatInvoices_to_GNCBook(mock.Mock(), [mock.Mock(), mock.Mock()],
+                                        Batch=Batch)
+    assert made == [Batch.tag, Batch.tag]
+    assert Batch.invoices == ["invoice-0", "invoice-1"]
+
+def test_invoices_are_added_before_they_are_posted(monkeypatch):
+    monkeypatch.setattr(mazurka, "next_invoice_ID",
+                        mock.Mock(side_effect=range(2)))
+    monkeypatch.setattr(mazurka, "ekat_to_gnc_Invoice",
+                        lambda book, invoice, ID, Accounts, Notes:
+                        mock_object("invoice-{}".format(ID)))
+    monkeypatch.setattr(mazurka, "post_gncInvoice",
+                        mock.Mock(side_effect=[None, ValueError("Closed")]))
+    Batch = batch.Batch("anna")
+    with pytest.raises(ValueError):
+        mazurka.add_ekatInvoices_to_GNCBook(
+            mock.Mock(), [mock.Mock(), mock.Mock()], Batch=Batch)
+    # The one that failed to post is in the book all the same.
+    assert Batch.invoices == ["invoice-0", "invoice-1"]
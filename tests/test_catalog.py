@@ -0,0 +1,98 @@
+import os
+import datetime
+from decimal import Decimal
+from unittest import mock
+
+import pytest
+
+from context import catalog
+from context import classes
+
+CUSTOMERS = [("000001", "Anna Karenina", "NPR"), ("000002", "Levin", "USD")]
+ACCOUNTS = [("Assets:Accounts Receivable", "NPR", 11),
+            ("Income:Sales", "NPR", 8)]
+
+@pytest.fixture
+def book(tmp_path):
+    book = tmp_path / "book.gnucash"
+    book.write_text("<gnc-v2/>")
+    return str(book)
+
+@pytest.fixture
+def mock_extract(monkeypatch):
+    extract = mock.Mock(return_value=(CUSTOMERS, ACCOUNTS, 12, "000012"))
+    monkeypatch.setattr(catalog, "extract", extract)
+    monkeypatch.setattr(catalog.gnucash_laska, "open_session_read_only",
+                        mock.Mock())
+    return extract
+
+def test_build_and_read(book, mock_extract):
+    with catalog.Build(book) as built:
+        assert built.path == book + ".catalog.sqlite"
+        assert built.customer("000001") == ("Anna Karenina", "NPR")
+        assert built.customer("000003") is None
+        assert built.customers()["000002"] == ("Levin", "USD")
+        assert "Income:Sales" in built.known_accounts()
+        assert built.known_accounts().suggest("income:sales") == ["Income:Sales"]
+        assert built.currencies() == {"NPR", "USD"}
+        assert (built.invoices, built.last_invoice_ID) == (12, "000012")
+    assert not os.path.exists(book + ".catalog.sqlite.new")
+
+def test_refresh_only_when_the_book_changes(book, mock_extract):
+    catalog.Refresh(book).close()
+    catalog.Refresh(book).close()
+    assert mock_extract.call_count == 1
+    with open(book, "a") as gnucash_file:
+        gnucash_file.write("<!-- Kitty -->")
+    with catalog.Refresh(book) as refreshed:
+        assert refreshed.is_fresh(book)
+    assert mock_extract.call_count == 2
+    catalog.Refresh(book, force=True).close()
+    assert mock_extract.call_count == 3
+
+def test_not_a_catalog(tmp_path):
+    path = tmp_path / "book.gnucash.catalog.sqlite"
+    path.write_text("Happy families are all alike")
+    with pytest.raises(catalog.CatalogError):
+        catalog.Catalog(str(path))
+
+def test_extract(monkeypatch):
+    def customer(ID, name, currency):
+        Customer = mock.Mock()
+        Customer.GetID.return_value = ID
+        Customer.GetName.return_value = name
+        Customer.GetCurrency.return_value.get_mnemonic.return_value = currency
+        return Customer
+    monkeypatch.setattr(catalog, "iter_customers",
+                        lambda book: [customer(*row) for row in CUSTOMERS])
+    account = mock.Mock()
+    account.GetCommodity.return_value.get_mnemonic.return_value = "NPR"
+    account.GetType.return_value = 8
+    monkeypatch.setattr(catalog.gnucash_laska, "AccountTree",
+                        lambda book: mock.Mock(accounts={"Income:Sales": [account]}))
+    invoices = [mock.Mock(**{"GetID.return_value": ID})
+                for ID in ["000009", "000010", "000002"]]
+    monkeypatch.setattr("ekaterina.exporters.csv_exporter.iter_invoices",
+                        lambda book: invoices)
+    assert catalog.extract(mock.Mock()) == (
+        CUSTOMERS, [("Income:Sales", "NPR", 8)], 3, "000010")
+
+def test_preflight(book, mock_extract):
+    anna = classes.Customer("Anna Karenina", 1)
+    levin = classes.Customer("Konstantin Levin", 2)
+    vronsky = classes.Customer("Vronsky", 3)
+    def invoice(customer, currency="NPR", income="Income:Sales"):
+        sale = classes.Sale(customer, "Tea", 1, Decimal("1.5"), "",
+                            classes.Account(income),
+                            datetime.date(2021, 1, 1),
+                            classes.Currency(currency))
+        return classes.Invoice(customer, classes.SalesList(sale))
+    parsed = [invoice(anna), invoice(anna), invoice(levin, "USD"),
+              invoice(vronsky, income="Income:Horses")]
+    with catalog.Build(book) as built:
+        report = catalog.Preflight(parsed, built)
+    assert report.unknown_customers == [("000003", "Vronsky")]
+    assert report.renamed_customers == [("000002", "Levin", "Konstantin Levin")]
+    assert report.other_currencies == []
+    assert len(report.unknown_accounts) == 1
+    assert "Income:Horses" in catalog.format_preflight(report)
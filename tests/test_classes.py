@@ -285,3 +285,41 @@ class TestInvoice:
         Invoice2 = classes.Invoice(mock_customer, sales)
         Invoice3 = classes.Invoice(mock_customer, sales, today)
         Invoice4 = classes.Invoice(mock_customer, sales, today, tomorrow)
+
+class TestRecord:
+
+    @pytest.mark.parametrize("make", [
+        lambda: classes.Account("Assets"),
+        lambda: classes.Currency("NPR"),
+        lambda: classes.Customer("Konstantin Levin", 7),
+        lambda: classes.Payment(classes.Customer("Konstantin Levin", 7),
+                                decimal.Decimal(10))])
+    def test_no_instance_dict(self, make):
+        assert not hasattr(make(), "__dict__")
+
+    def test_immutable(self):
+        customer = classes.Customer("Konstantin Levin", 7)
+        with pytest.raises(AttributeError, match="immutable"):
+            customer.name = "Kostya"
+        with pytest.raises(AttributeError, match="immutable"):
+            del customer.ID
+        assert customer.get_name() == "Konstantin Levin"
+
+    def test_from_validated(self, mock_customer, mock_currency):
+        sale = classes.Sale.from_validated(
+            customer=mock_customer, description="Tea", quantity=2.0,
+            unitprice=decimal.Decimal("25.50"), notes="",
+            income_account=mock.Mock(classes.Account),
+            date=datetime.date.today(), currency=mock_currency)
+        assert isinstance(sale, classes.Sale)
+        assert sale.get_description() == "Tea"
+        with pytest.raises(AttributeError, match="immutable"):
+            sale.description = "Jam"
+
+    def test_from_validated_skips_checks(self):
+        # Which is why it must only ever see checked values
+        sales = classes.SalesList.from_validated(sales=(), customer=None,
+                                                 currency=None)
+        assert sales.sales == ()
+        with pytest.raises(ValueError):
+            classes.SalesList()
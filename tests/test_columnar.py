@@ -0,0 +1,86 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+
+numpy = pytest.importorskip("numpy")
+
+from context import columnar
+
+class TestDecodeDecimals:
+
+    def test_keeps_the_decimal_places(self):
+        column = columnar.decode_decimals(["12.50", "-3", "+0.125", "7."])
+        assert column.to_decimals() == [Decimal("12.50"), Decimal("-3"),
+                                         Decimal("0.125"), Decimal("7")]
+        assert [str(value) for value in column.to_decimals()] == [
+            "12.50", "-3", "0.125", "7"]
+
+    def test_floats_match_float(self):
+        texts = ["0.1", "12.25", "-7.3", "100"]
+        column = columnar.decode_decimals(texts)
+        assert column.to_floats() == [float(text) for text in texts]
+
+    def test_odd_shapes_fall_back_to_decimal(self):
+        column = columnar.decode_decimals(["1E+3", " 2.5 "])
+        assert column.to_decimals() == [Decimal("1E+3"), Decimal("2.5")]
+
+    def test_missing_cells(self):
+        column = columnar.decode_decimals(["1", "", "  "])
+        assert column.to_decimals() == [Decimal(1), None, None]
+
+    def test_fixed_point(self):
+        column = columnar.decode_decimals(["12.5", "0.125", "3"])
+        assert column.fixed_point(2).tolist() == [1250, 12, 300]
+
+    def test_reports_bad_cells_by_row(self):
+        with pytest.raises(columnar.ColumnDecodeError) as error:
+            columnar.decode_decimals(["1", "one", "2", "--3", "NaN"],
+                                     "QUANTITY", rows=[3, 4, 6, 7, 9])
+        assert [row for (row, *rest) in error.value.bad_cells] == [4, 7, 9]
+        assert "Row 4: QUANTITY 'one'" in str(error.value)
+
+    def test_only_ascii_digits_go_to_numpy(self):
+        # "²" is a digit to str.isdigit(), but not to int64 or Decimal.
+        with pytest.raises(columnar.ColumnDecodeError) as error:
+            columnar.decode_decimals(["2", "²", "1.²"], "QUANTITY")
+        assert [row for (row, *rest) in error.value.bad_cells] == [1, 2]
+        # Decimal() does take other scripts' digits, so they're its.
+        column = columnar.decode_decimals(["\u0661\u0662"])
+        assert column.to_decimals() == [Decimal(12)]
+
+class TestDecodeDates:
+
+    def test_iso_dates(self):
+        dates = columnar.decode_dates(["2021-01-05", "", "2020-02-29"],
+                                      "%Y-%m-%d")
+        assert columnar.dates_to_datetimes(dates) == [
+            datetime.datetime(2021, 1, 5), None, datetime.datetime(2020, 2, 29)]
+
+    def test_odd_shapes_fall_back_to_strptime(self):
+        dates = columnar.decode_dates(["2021-1-5", "2021-01-06"], "%Y-%m-%d")
+        assert columnar.dates_to_datetimes(dates) == [
+            datetime.datetime(2021, 1, 5), datetime.datetime(2021, 1, 6)]
+
+    def test_other_formats(self):
+        dates = columnar.decode_dates(["05/01/2021"], "%d/%m/%Y")
+        assert columnar.dates_to_datetimes(dates) == [datetime.datetime(2021, 1, 5)]
+
+    def test_reports_bad_cells_by_row(self):
+        with pytest.raises(columnar.ColumnDecodeError) as error:
+            columnar.decode_dates(["2021-01-05", "2021-02-30", "tomorrow"],
+                                  "%Y-%m-%d", "SALE_DATE", first_row=10)
+        assert [row for (row, *rest) in error.value.bad_cells] == [11, 12]
+
+    def test_years_datetime_cant_hold(self):
+        with pytest.raises(columnar.ColumnDecodeError) as error:
+            columnar.decode_dates(["2021-01-05", "0000-01-01"], "%Y-%m-%d",
+                                  "SALE_DATE")
+        assert [row for (row, *rest) in error.value.bad_cells] == [1]
+
+    def test_dates_to_datetimes_refuses_what_isnt_a_datetime(self):
+        dates = numpy.array(["2021-01-05", "0000-01-01"], "datetime64[D]")
+        with pytest.raises(columnar.ColumnDecodeError) as error:
+            columnar.dates_to_datetimes(dates, "SALE_DATE", rows=[4, 7])
+        assert [(row, kind) for (row, column, text, kind)
+                in error.value.bad_cells] == [(7, "date")]
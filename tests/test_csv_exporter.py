@@ -0,0 +1,227 @@
+import csv
+import datetime
+from decimal import Decimal
+from unittest import mock
+
+import pytest
+
+from context import csv_exporter, csv_parser
+
+def mock_account(full_name):
+    parent = mock.Mock()
+    parent.is_root.return_value = True
+    for name in full_name.split(":"):
+        account = mock.Mock()
+        account.is_root.return_value = False
+        account.GetName.return_value = name
+        account.get_parent.return_value = parent
+        account.instance = object()
+        parent = account
+    return account
+
+def mock_numeric(value):
+    numeric = mock.Mock()
+    numeric.num.return_value = int(Decimal(value) * 100)
+    numeric.denom.return_value = 100
+    return numeric
+
+def mock_customer(name="Anna Karenina", ID="000001"):
+    customer = mock.Mock()
+    customer.GetName.return_value = name
+    customer.GetID.return_value = ID
+    return customer
+
+def mock_entry(description, quantity, price):
+    entry = mock.Mock()
+    entry.GetDescription.return_value = description
+    entry.GetQuantity.return_value = mock_numeric(quantity)
+    entry.GetInvPrice.return_value = mock_numeric(price)
+    entry.GetNotes.return_value = ""
+    entry.GetInvAccount.return_value = mock_account("Income:Sales")
+    # The sale date is the entry's date entered (See:
+    # mazurka.ekatSale_to_gncInvoiceEntry), not its own date.
+    entry.GetDateEntered.return_value = datetime.datetime(1877, 1, 2)
+    entry.GetDate.return_value = datetime.datetime(1877, 1, 3)
+    return entry
+
+def mock_invoice(entries, customer=None, posted=datetime.datetime(1877, 1, 3),
+                 description=None):
+    invoice = mock.Mock()
+    invoice.GetType.return_value = csv_exporter.gnucash_core_c.GNC_INVOICE_CUST_INVOICE
+    invoice.IsPosted.return_value = True
+    invoice.GetIsCreditNote.return_value = False
+    invoice.GetOwner.return_value = customer or mock_customer()
+    invoice.GetEntries.return_value = entries
+    if description is None:
+        description = "; ".join(entry.GetDescription() for entry in entries)
+    invoice.GetPostedTxn.return_value.GetDescription.return_value = description
+    invoice.GetCurrency.return_value.get_mnemonic.return_value = "NPR"
+    invoice.GetDatePosted.return_value = posted
+    invoice.GetDateDue.return_value = posted
+    invoice.GetPostedAcc.return_value = mock_account("Assets:Accounts Receivable")
+    return invoice
+
+def mock_split(account, amount, memo=""):
+    split = mock.Mock()
+    split.instance = object()
+    split.GetAccount.return_value = account
+    split.GetAmount.return_value = mock_numeric(amount)
+    split.GetMemo.return_value = memo
+    split.GetLot.return_value = None
+    return split
+
+def mock_payment(receivable, bank, amounts, date=datetime.datetime(1877, 1, 4)):
+    transaction = mock.Mock()
+    transaction.GetTxnType.return_value = csv_exporter.gnucash_core_c.TXN_TYPE_PAYMENT
+    transaction.GetDescription.return_value = "Anna Karenina"
+    transaction.GetDate.return_value = date
+    splits = [mock_split(receivable, -amount, "Train fare") for amount in amounts]
+    splits.append(mock_split(bank, sum(amounts)))
+    transaction.GetSplitList.return_value = splits
+    for split in splits:
+        split.GetParent.return_value = transaction
+    return splits
+
+class TestInvoiceRows:
+
+    def test_a_row_per_entry(self):
+        invoice = mock_invoice([mock_entry("Tea", "2", "12.50"),
+                                mock_entry("Samovar", "1", "100")])
+        rows = list(csv_exporter.invoice_rows(invoice))
+        assert len(rows) == 2
+        assert rows[0]["CUSTOMER_NAME"] == "Anna Karenina"
+        assert rows[0]["CUSTOMER_ID"] == "000001"
+        assert rows[0]["SALE_DESCRIPTION"] == "Tea"
+        assert rows[0]["ITEMS_SOLD"] == "2"
+        assert rows[0]["UNIT_PRICE"] == "12.5"
+        assert rows[1]["UNIT_PRICE"] == "100"
+        assert rows[0]["INCOME_ACCOUNT"] == "Income:Sales"
+        assert rows[0]["RECEIVABLE_ACCOUNT"] == "Assets:Accounts Receivable"
+        assert rows[0]["SALE_DATE"] == "1877-01-02"
+        assert rows[0]["POST_DATE"] == "1877-01-03"
+        # Made up out of the sales; not the invoice's own
+        assert rows[0]["INVOICE_DESCRIPTION"] == ""
+
+    def test_invoice_description(self):
+        invoice = mock_invoice([mock_entry("Tea", "2", "12.50")],
+                               description="Moscow")
+        [row] = csv_exporter.invoice_rows(invoice)
+        assert row["INVOICE_DESCRIPTION"] == "Moscow"
+
+    def test_rows_parse_back(self):
+        invoice = mock_invoice([mock_entry("Tea", "2", "12.50")])
+        [row] = csv_exporter.invoice_rows(invoice)
+        assert csv_parser.is_valid_Sale_record(row)
+        sale = csv_parser.parse_Sale(row)
+        assert sale.get_date() == datetime.datetime(1877, 1, 2)
+
+class TestPaymentRow:
+
+    def test_one_row_per_payment(self):
+        receivable = mock_account("Assets:Accounts Receivable")
+        bank = mock_account("Assets:Bank")
+        splits = mock_payment(receivable, bank, [Decimal("10"), Decimal("2.5")])
+        rows = [csv_exporter.payment_row(mock.Mock(), receivable, split)
+                for split in splits[:2]]
+        assert rows[1] is None
+        assert rows[0]["PAYMENT_AMOUNT"] == "12.5"
+        assert rows[0]["PAYMENT_MEMO"] == "Train fare"
+        assert rows[0]["PAYMENT_DATE"] == "1877-01-04"
+        assert rows[0]["POSTED_ACCOUNT"] == "Assets:Accounts Receivable"
+        assert rows[0]["PAYMENT_TRANSFER_ACCOUNT"] == "Assets:Bank"
+
+    def test_customer_from_invoice_lot(self, monkeypatch):
+        monkeypatch.setattr(csv_exporter.gnucash_laska, "as_GncLot",
+                            lambda lot: lot)
+        receivable = mock_account("Assets:Accounts Receivable")
+        splits = mock_payment(receivable, mock_account("Assets:Bank"),
+                              [Decimal("10")])
+        lot = mock.Mock()
+        lot.GetInvoiceFromLot.return_value = mock_invoice(
+            [], customer=mock_customer("Vronsky", "000002"))
+        splits[0].GetLot.return_value = lot
+        row = csv_exporter.payment_row(mock.Mock(), receivable, splits[0])
+        assert row["CUSTOMER_NAME"] == "Vronsky"
+        assert row["CUSTOMER_ID"] == "000002"
+
+    def test_customer_from_credit_lot(self, monkeypatch):
+        monkeypatch.setattr(csv_exporter.gnucash_laska, "as_GncLot",
+                            lambda lot: lot)
+        monkeypatch.setattr(csv_exporter.gnucash_laska, "get_lot_owner_ID",
+                            lambda lot: lot.owner_ID)
+        receivable = mock_account("Assets:Accounts Receivable")
+        splits = mock_payment(receivable, mock_account("Assets:Bank"),
+                              [Decimal("10")])
+        lot = mock.Mock(owner_ID="000002")
+        lot.GetInvoiceFromLot.return_value = None
+        splits[0].GetLot.return_value = lot
+        book = mock.Mock()
+        book.CustomerLookupByID.return_value = mock_customer("Vronsky",
+                                                             "000002")
+        row = csv_exporter.payment_row(book, receivable, splits[0])
+        book.CustomerLookupByID.assert_called_once_with("000002")
+        assert row["CUSTOMER_NAME"] == "Vronsky"
+        assert row["CUSTOMER_ID"] == "000002"
+        assert csv_parser.is_valid_Payment_record(row)
+
+    def test_no_owner_has_no_ID(self):
+        receivable = mock_account("Assets:Accounts Receivable")
+        splits = mock_payment(receivable, mock_account("Assets:Bank"),
+                              [Decimal("10")])
+        row = csv_exporter.payment_row(mock.Mock(), receivable, splits[0])
+        assert row["CUSTOMER_NAME"] == "Anna Karenina"
+        assert row["CUSTOMER_ID"] == ""
+
+    def test_not_a_payment(self):
+        receivable = mock_account("Assets:Accounts Receivable")
+        splits = mock_payment(receivable, mock_account("Assets:Bank"),
+                              [Decimal("10")])
+        splits[0].GetParent.return_value.GetTxnType.return_value = "I"
+        assert csv_exporter.payment_row(mock.Mock(), receivable, splits[0]) is None
+
+class TestExport:
+
+    @pytest.fixture
+    def book(self, monkeypatch):
+        receivable = mock_account("Assets:Accounts Receivable")
+        payments = (
+            mock_payment(receivable, mock_account("Assets:Bank"),
+                         [Decimal("10")])
+            + mock_payment(receivable, mock_account("Assets:Bank"),
+                           [Decimal("5")], date=datetime.datetime(1878, 1, 1)))
+        receivable.GetSplitList.return_value = [
+            split for split in payments if split.GetAccount() is receivable]
+        invoices = [
+            mock_invoice([mock_entry("Tea", "2", "12.50")]),
+            mock_invoice([mock_entry("Hay", "3", "1")],
+                         customer=mock_customer("Levin", "000003"),
+                         posted=datetime.datetime(1878, 1, 1))]
+        monkeypatch.setattr(csv_exporter, "iter_invoices",
+                            lambda GNCBook: iter(invoices))
+        monkeypatch.setattr(csv_exporter, "iter_receivable_accounts",
+                            lambda GNCBook: iter([receivable]))
+        return mock.Mock()
+
+    def read(self, csvfile):
+        with open(csvfile, newline="") as f:
+            return list(csv.DictReader(f))
+
+    def test_everything(self, book, tmp_path):
+        csvfile = str(tmp_path / "export.csv")
+        assert csv_exporter.Export(book, csvfile) == 4
+        rows = self.read(csvfile)
+        assert [row["SALE_DESCRIPTION"] for row in rows] == ["Tea", "Hay", "", ""]
+        assert [row["PAYMENT_AMOUNT"] for row in rows] == ["", "", "10", "5"]
+
+    def test_date_range(self, book, tmp_path):
+        csvfile = str(tmp_path / "export.csv")
+        assert csv_exporter.Export(book, csvfile,
+                                   end=datetime.date(1877, 12, 31)) == 2
+        rows = self.read(csvfile)
+        assert [row["SALE_DESCRIPTION"] for row in rows] == ["Tea", ""]
+
+    def test_customers(self, book, tmp_path):
+        csvfile = str(tmp_path / "export.csv")
+        assert csv_exporter.Export(book, csvfile, customers=["000003"]) == 1
+        [row] = self.read(csvfile)
+        assert row["CUSTOMER_NAME"] == "Levin"
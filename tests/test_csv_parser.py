@@ -0,0 +1,383 @@
+import os
+import csv
+import sys
+import datetime
+import subprocess
+from decimal import Decimal
+
+import pytest
+
+from context import classes
+from context import csv_parser
+
+@pytest.fixture
+def anna():
+    return classes.Customer("Anna Karenina", 1)
+
+@pytest.fixture
+def vronsky():
+    return classes.Customer("Alexei Kirillovich Vronsky", 2)
+
+def payment(customer, amount, memo="Payment Received",
+            date=datetime.date(2021, 1, 1),
+            transfer="Assets:Current Assets:Petty Cash"):
+    return classes.Payment(customer, Decimal(amount), Decimal(0), memo, date,
+                           classes.Account("Assets:Accounts Receivable"),
+                           classes.Account(transfer))
+
+class TestMergePayments:
+
+    def test_merges_same_day_payments(self, anna, vronsky):
+        payments = [payment(anna, 100, "Cash"),
+                    payment(vronsky, 50),
+                    payment(anna, 25, "Cash"),
+                    payment(anna, 10, "Change")]
+        merged = csv_parser.merge_payments(payments)
+        assert len(merged) == 2
+        assert merged[0].Customer == anna
+        assert merged[0].PaymentAmount == Decimal(135)
+        assert merged[0].Memo == "Cash; Change"
+        assert merged[1] is payments[1]
+
+    @pytest.mark.parametrize("other", [
+        {"date": datetime.date(2021, 1, 2)},
+        {"transfer": "Assets:Current Assets:Bank"}])
+    def test_keeps_different_payments_apart(self, anna, other):
+        payments = [payment(anna, 100), payment(anna, 100, **other)]
+        assert csv_parser.merge_payments(payments) == payments
+
+    def test_leaves_invoices_in_place(self, anna):
+        invoice = object()
+        payments = [invoice, payment(anna, 1), payment(anna, 2)]
+        merged = csv_parser.merge_payments(payments)
+        assert merged[0] is invoice
+        assert merged[1].PaymentAmount == Decimal(3)
+
+def sale_record(name, ID, description="Tea", quantity="2", date="2021-01-01"):
+    return {"CUSTOMER_NAME": name, "CUSTOMER_ID": str(ID),
+            "SALE_DESCRIPTION": description, "QUANTITY": quantity,
+            "UNIT_PRICE": "25.50", "INCOME_ACCOUNT": "Income:Sales",
+            "SALE_DATE": date, "CURRENCY": "NPR", "Total": "51"}
+
+class TestParse:
+
+    def test_skips_invalid_records(self):
+        assert csv_parser.Parse([{"CUSTOMER_NAME": "", "Total": "1234"}]) == []
+
+    @pytest.mark.parametrize("options", [{}, {"rejects": []}])
+    def test_checks_each_record_once(self, monkeypatch, options):
+        checked = []
+        is_valid_Sale_record = csv_parser.is_valid_Sale_record
+        def counted(record):
+            checked.append(record["CUSTOMER_NAME"])
+            return is_valid_Sale_record(record)
+        monkeypatch.setattr(csv_parser, "is_valid_Sale_record", counted)
+        csv_parser.Parse([sale_record("Anna Karenina", 1),
+                          sale_record("Kitty", 2)], **options)
+        assert checked == ["Anna Karenina", "Kitty"]
+
+    def test_merges_invoices_to_the_same_customer(self):
+        parsed = csv_parser.Parse([sale_record("Anna Karenina", 1, "Tea"),
+                                   sale_record("Kitty", 2),
+                                   sale_record("Anna Karenina", 1, "Jam")])
+        assert len(parsed) == 2
+        anna = parsed[0]
+        assert [sale.get_description() for sale in anna.get_entries()] == [
+            "Tea", "Jam"]
+        assert anna.get_customer() == classes.Customer("Anna Karenina", 1)
+
+class TestSplitInvoices:
+
+    @pytest.fixture
+    def records(self):
+        return [sale_record("Anna Karenina", 1, "Tea {}".format(day),
+                            date="2021-{:02d}-{:02d}".format(month, day))
+                for month in (2, 1) for day in (1, 2, 3)]
+
+    def descriptions(self, invoices):
+        return [[sale.get_description() for sale in invoice.get_entries()]
+                for invoice in invoices]
+
+    def test_max_entries_per_invoice(self, records):
+        parsed = csv_parser.Parse(records, max_entries_per_invoice=4)
+        assert self.descriptions(parsed) == [
+            ["Tea 1", "Tea 2", "Tea 3", "Tea 1"], ["Tea 2", "Tea 3"]]
+        assert parsed[0].get_description() == \
+            "Tea 1; Tea 2; Tea 3; Tea 1 (part 1/2)"
+        assert parsed[1].get_description() == "Tea 2; Tea 3 (part 2/2)"
+
+    def test_split_period(self, records):
+        parsed = csv_parser.Parse(records, split_period="month",
+                                  max_entries_per_invoice=2)
+        assert [invoice.get_entries()[0].get_date().month
+                for invoice in parsed] == [1, 1, 2, 2]
+        assert self.descriptions(parsed) == [
+            ["Tea 1", "Tea 2"], ["Tea 3"], ["Tea 1", "Tea 2"], ["Tea 3"]]
+        assert parsed[3].get_description().endswith("(part 4/4)")
+
+    def test_split_period_posts_within_the_period(self, records):
+        # The rows aren't in date order: February's come first.
+        records = [dict(record, POST_DATE="2021-02-01",
+                        DUE_DATE="2021-02-15") for record in records]
+        parsed = csv_parser.Parse(records, split_period="month")
+        assert [(invoice.get_postdate().date(), invoice.get_duedate().date())
+                for invoice in parsed] == [
+            (datetime.date(2021, 1, 3), datetime.date(2021, 1, 17)),
+            (datetime.date(2021, 2, 3), datetime.date(2021, 2, 17))]
+        # Without periods, the first invoice's dates, as ever
+        parsed = csv_parser.Parse(records, max_entries_per_invoice=4)
+        assert {invoice.get_postdate().date() for invoice in parsed} == {
+            datetime.date(2021, 2, 1)}
+
+    @pytest.mark.parametrize("text", ["0", "-2", "two"])
+    def test_positive_int(self, text):
+        assert csv_parser.positive_int("3") == 3
+        with pytest.raises(ValueError):
+            csv_parser.positive_int(text)
+
+    def test_keeps_invoice_description(self):
+        invoices = csv_parser.merge_invoices(
+            [csv_parser.Parse([dict(sale_record("Anna Karenina", 1),
+                                    INVOICE_DESCRIPTION="Samovars")])[0]] * 3,
+            max_entries_per_invoice=2)
+        assert [invoice.get_description() for invoice in invoices] == [
+            "Samovars (part 1/2)", "Samovars (part 2/2)"]
+
+    def test_small_invoices_are_left_alone(self, records):
+        parsed = csv_parser.Parse(records[:2], max_entries_per_invoice=2)
+        assert len(parsed) == 1
+        assert parsed[0].get_description() is None
+
+    def test_unknown_period(self, records):
+        with pytest.raises(ValueError, match="Unknown split period"):
+            csv_parser.Parse(records, split_period="fortnight")
+
+class KnownAccounts(set):
+    def suggest(self, name):
+        return ["Income:Sales"]
+
+def test_parse_rejects_unknown_accounts():
+    known_accounts = KnownAccounts(["Income:Sales", "Assets:Accounts Receivable"])
+    record = sale_record("Anna Karenina", 1)
+    assert len(csv_parser.Parse([record], known_accounts=known_accounts)) == 1
+    record["INCOME_ACCOUNT"] = "Income:Sale"
+    with pytest.raises(csv_parser.gnucash_laska.AccountLookupError,
+                       match="Unknown account 'Income:Sale'. Did you mean"):
+        csv_parser.Parse([record], known_accounts=known_accounts)
+
+def described(value):
+    """A record, all the way down, as plain values (records have no __eq__)"""
+    if isinstance(value, (list, tuple)):
+        return [described(item) for item in value]
+    if isinstance(value, classes.Record) and not isinstance(
+            value, (classes.Customer, classes.Currency)):
+        return (type(value).__name__,
+                [(name, described(getattr(value, name)))
+                 for name in type(value).__slots__
+                 if hasattr(value, name)])
+    return value
+
+class TestVectorizedParse:
+
+    @pytest.fixture(autouse=True)
+    def needs_numpy(self):
+        pytest.importorskip("numpy")
+
+    def test_same_as_cell_by_cell(self):
+        records = [sale_record("Anna Karenina", 1),
+                   dict(sale_record("Vronsky", 2, quantity="1.5"),
+                        PAYMENT_AMOUNT="10.50", REFUND="0.50",
+                        PAYMENT_DATE="2021-01-02", POST_DATE="2021-01-03"),
+                   {"CUSTOMER_NAME": "Levin", "CUSTOMER_ID": "3",
+                    "PAYMENT_AMOUNT": "1E+2", "PAYMENT_DATE": "2021-1-4"}]
+        assert (described(csv_parser.Parse(records, vectorized=True))
+                == described(csv_parser.Parse(records)))
+
+    def test_same_as_cell_by_cell_on_a_mixed_sheet(self):
+        # Stray cells in the columns a row's type doesn't use, and
+        # numbers too big for NumPy: neither path should mind.
+        records = [dict(sale_record("Anna Karenina", 1),
+                        PAYMENT_AMOUNT="n/a", REFUND="NaN"),
+                   {"CUSTOMER_NAME": "Levin", "CUSTOMER_ID": "3",
+                    "PAYMENT_AMOUNT": "12345678901234567890.5",
+                    "PAYMENT_DATE": "2021-01-04", "DUE_DATE": "soon",
+                    "QUANTITY": "Infinity", "UNIT_PRICE": "?"},
+                   dict(sale_record("Vronsky", 2, quantity="1e400"),
+                        POST_DATE="2021-01-03", PAYMENT_DATE="never")]
+        vectorized = described(csv_parser.Parse(records, vectorized=True))
+        assert vectorized == described(csv_parser.Parse(records))
+        rejects = []
+        assert described(csv_parser.Parse(records, vectorized=True,
+                                          rejects=rejects)) == vectorized
+        assert rejects == []
+
+    def test_columns_are_looked_up_once(self, monkeypatch):
+        # A column of them is the first of a field's names a row has.
+        records = [dict(sale_record("Anna Karenina", 1), DATE="2021-01-09"),
+                   dict(sale_record("Kitty", 4), SALE_DATE=None,
+                        DATE="2021-01-09")]
+        kinds = [csv_parser.record_kind(record) for record in records]
+        monkeypatch.setattr(csv_parser, "get", None) # Not cell by cell
+        decoded = csv_parser.decode_columns(records, kinds=kinds)
+        assert [row["sale_date"].day for row in decoded] == [1, 9]
+        assert "payment_date" not in decoded[0]
+
+    def test_what_the_columns_decode_to_is_checked(self, monkeypatch):
+        # Should NumPy hand back something that isn't a datetime, the
+        # dates are read again, cell by cell, rather than trusted.
+        records = [sale_record("Anna Karenina", 1),
+                   sale_record("Kitty", 4, date="2021-01-05")]
+        dates_to_datetimes = csv_parser.columnar.dates_to_datetimes
+        monkeypatch.setattr(
+            csv_parser.columnar, "dates_to_datetimes",
+            lambda dates, *args, **kwargs: [
+                None if date is None else date.toordinal()
+                for date in dates_to_datetimes(dates)])
+        assert (described(csv_parser.Parse(records, vectorized=True))
+                == described(csv_parser.Parse(records)))
+
+    def test_check_decoded_column(self):
+        csv_parser.check_decoded_column("unit_price", [Decimal(1), None])
+        with pytest.raises(ValueError) as error:
+            csv_parser.check_decoded_column(
+                "sale_date", [datetime.datetime(2021, 1, 1), 0], [3, 4])
+        assert [(row, kind) for (row, column, text, kind)
+                in error.value.bad_cells] == [(4, "date")]
+        assert isinstance(error.value, csv_parser.REJECTABLE_ERRORS)
+
+    def test_reports_all_bad_cells_by_row(self):
+        records = [sale_record("Anna Karenina", 1),
+                   {"CUSTOMER_NAME": "Nobody"},
+                   sale_record("Vronsky", 2, quantity="two"),
+                   sale_record("Levin", 3, date="2021-13-01")]
+        with pytest.raises(csv_parser.columnar.ColumnDecodeError) as error:
+            csv_parser.Parse(records, vectorized=True)
+        assert [(row, column) for (row, column, text, kind)
+                in error.value.bad_cells] == [(2, "ITEMS_SOLD"), (3, "SALE_DATE")]
+
+def test_numpy_is_only_imported_to_vectorize():
+    # In a fresh interpreter: this one may have imported NumPy already.
+    script = "\n".join([
+        "import sys",
+        "sys.path.insert(0, {!r})".format(os.path.dirname(__file__)),
+        "from context import csv_parser",
+        "csv_parser.Parse([{!r}])".format(sale_record("Anna Karenina", 1)),
+        "print('numpy' in sys.modules)"])
+    output = subprocess.run([sys.executable, "-c", script], check=True,
+                            capture_output=True, text=True).stdout
+    assert output.split() == ["False"]
+
+class TestQuarantine:
+
+    @pytest.fixture
+    def records(self):
+        return [sale_record("Anna Karenina", 1),
+                sale_record("Vronsky", 2, date="1877-02-30"),
+                {"CUSTOMER_NAME": "Nobody"},
+                dict(sale_record("Levin", 3), INCOME_ACCOUNT="Income:"),
+                sale_record("Kitty", 4),
+                {"CUSTOMER_NAME": " ", "Total": "", "SOURCE_ROW": "7"}]
+
+    def test_rejects_bad_rows_and_parses_the_rest(self, records):
+        rejects = []
+        parsed = csv_parser.Parse(records, rejects=rejects)
+        assert [invoice.get_customer().get_name() for invoice in parsed] == [
+            "Anna Karenina", "Kitty"]
+        # The blank row is just skipped.
+        assert [reject.row for reject in rejects] == [1, 2, 3]
+        assert "ValueError" in rejects[0].reason
+        assert rejects[1].reason == csv_parser.NOT_A_RECORD_REASON
+        assert "Invalid account: 'Income:'" in rejects[2].reason
+
+    def test_rejects_in_row_order_after_the_others(self, records):
+        rejects = [csv_parser.Reject(9, {}, "From another spreadsheet")]
+        csv_parser.Parse(records, rejects=rejects)
+        assert [reject.row for reject in rejects] == [9, 1, 2, 3]
+
+    def test_reader_options(self):
+        assert csv_parser.reader_options()["require"] == ["CUSTOMER_ID"]
+        assert csv_parser.reader_options(quarantine=True)["require"] is None
+
+    def test_fails_without_quarantine(self, records):
+        with pytest.raises(ValueError):
+            csv_parser.Parse(records)
+
+    def test_rejects_unknown_accounts(self):
+        rejects = []
+        records = [sale_record("Anna Karenina", 1),
+                   dict(sale_record("Levin", 3), INCOME_ACCOUNT="Income:Hay")]
+        parsed = csv_parser.Parse(
+            records, known_accounts=KnownAccounts(
+                ["Income:Sales", "Assets:Accounts Receivable"]),
+            rejects=rejects)
+        assert len(parsed) == 1
+        assert [reject.row for reject in rejects] == [1]
+        assert "Unknown account 'Income:Hay'" in rejects[0].reason
+
+    def test_vectorized(self, records):
+        pytest.importorskip("numpy")
+        rejects = []
+        records[0] = sale_record("Anna Karenina", 1, quantity="two")
+        parsed = csv_parser.Parse(records, vectorized=True, rejects=rejects)
+        assert [invoice.get_customer().get_name() for invoice in parsed] == [
+            "Kitty"]
+        assert [reject.row for reject in rejects] == [0, 1, 2, 3]
+        assert rejects[0].reason == "ITEMS_SOLD 'two' is not a valid number"
+
+    @pytest.mark.parametrize("cells", [{"QUANTITY": "\u00b2"},
+                                       {"SALE_DATE": "0000-01-01"}])
+    def test_vectorized_rejects_what_the_scalar_path_does(self, cells):
+        pytest.importorskip("numpy")
+        records = [sale_record("Anna Karenina", 1),
+                   dict(sale_record("Kitty", 4), **cells)]
+        results = []
+        for vectorized in (False, True):
+            rejects = []
+            parsed = csv_parser.Parse(records, vectorized=vectorized,
+                                      rejects=rejects)
+            results.append(([invoice.get_customer().get_name()
+                             for invoice in parsed],
+                            [reject.row for reject in rejects]))
+        assert results[0] == results[1] == (["Anna Karenina"], [1])
+
+    def test_rejects_the_rows_of_invoices_that_wont_merge(self):
+        # Anna's sales are in two currencies: her invoices can't be merged.
+        records = [sale_record("Anna Karenina", 1),
+                   sale_record("Kitty", 4),
+                   dict(sale_record("Anna Karenina", 1), CURRENCY="USD",
+                        PAYMENT_AMOUNT="10", PAYMENT_DATE="2021-01-02")]
+        with pytest.raises(AssertionError):
+            csv_parser.Parse(records)
+        rejects = []
+        parsed = csv_parser.Parse(records, rejects=rejects)
+        # Row 2's payment goes along with its sale.
+        assert [type(transaction).__name__ for transaction in parsed] == [
+            "Invoice"]
+        assert parsed[0].get_customer().get_name() == "Kitty"
+        assert [reject.row for reject in rejects] == [0, 2]
+        assert "same currency" in rejects[0].reason
+
+    def test_write_rejects_without_any(self, tmp_path):
+        rejects_file = str(tmp_path / "rejects.csv")
+        assert csv_parser.write_rejects([], rejects_file) == 0
+        with open(rejects_file, newline="") as f:
+            assert f.read().strip() == "SOURCE_ROW,REJECT_REASON"
+
+    def test_write_rejects_round_trip(self, records, tmp_path):
+        rejects = []
+        csv_parser.Parse(records, rejects=rejects)
+        rejects_file = str(tmp_path / "rejects.csv")
+        assert csv_parser.write_rejects(rejects, rejects_file) == 3
+        with open(rejects_file, newline="") as f:
+            rows = list(csv.DictReader(f))
+        assert [row["SOURCE_ROW"] for row in rows] == ["3", "4", "5"]
+        assert rows[0]["CUSTOMER_NAME"] == "Vronsky"
+        assert rows[2]["REJECT_REASON"] == rejects[2].reason
+        # Fixed, and fed back: SOURCE_ROW still points at the spreadsheet.
+        rows[0]["SALE_DATE"] = "1877-02-28"
+        again = []
+        assert len(csv_parser.Parse(rows, rejects=again)) == 1
+        csv_parser.write_rejects(again, rejects_file)
+        with open(rejects_file, newline="") as f:
+            assert [row["SOURCE_ROW"] for row in csv.DictReader(f)] == [
+                "4", "5"]
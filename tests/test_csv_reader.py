@@ -0,0 +1,70 @@
+import bz2
+import gzip
+import lzma
+import tempfile
+
+import pytest
+
+from context import csv_reader, csv_parser
+
+@pytest.fixture
+def csv_filepath(tmp_path):
+    csvfile = tmp_path / "sales.csv"
+    csvfile.write_text(
+        "CUSTOMER_NAME,CUSTOMER_ID,QUANTITY,Total,Remarks\n"
+        "Anna Karenina,1,2,51,first\n"
+        "\n"
+        ",,,51,Total of the day\n"
+        "Vronsky,2,1,25,\n")
+    return str(csvfile)
+
+def test_read_everything(csv_filepath):
+    records = csv_reader.Read(csv_filepath)
+    assert len(records) == 3
+    assert records[0]["Remarks"] == "first"
+
+def test_projection(csv_filepath):
+    records = csv_reader.Read(csv_filepath,
+                              fields={"CUSTOMER_NAME", "QUANTITY", "NOTE"})
+    assert records == [{"CUSTOMER_NAME": "Anna Karenina", "QUANTITY": "2"},
+                       {"CUSTOMER_NAME": "", "QUANTITY": ""},
+                       {"CUSTOMER_NAME": "Vronsky", "QUANTITY": "1"}]
+
+def test_required_fields(csv_filepath):
+    records = csv_reader.Read(csv_filepath, require=["CUSTOMER_ID"],
+                              row_field="SOURCE_ROW")
+    assert [record["CUSTOMER_NAME"] for record in records] == [
+        "Anna Karenina", "Vronsky"]
+    assert [record["SOURCE_ROW"] for record in records] == ["2", "5"]
+
+def test_missing_required_column(csv_filepath):
+    assert csv_reader.Read(csv_filepath, require=["PAYMENT_AMOUNT"]) == []
+
+def test_parser_options(csv_filepath):
+    records = csv_reader.Read(csv_filepath, **csv_parser.reader_options())
+    assert records[0] == {"CUSTOMER_NAME": "Anna Karenina", "CUSTOMER_ID": "1",
+                          "QUANTITY": "2", "SOURCE_ROW": "2"}
+
+@pytest.mark.parametrize("extension, compress", [
+    (".gz", gzip.compress), (".bz2", bz2.compress), (".xz", lzma.compress)])
+def test_compressed(csv_filepath, extension, compress, monkeypatch):
+    with open(csv_filepath, "rb") as plain:
+        compressed = csv_filepath + extension
+        with open(compressed, "wb") as compressed_file:
+            compressed_file.write(compress(plain.read()))
+    # Streamed: nothing is decompressed to disk along the way.
+    monkeypatch.setattr(tempfile, "mkstemp", None)
+    monkeypatch.setattr(tempfile, "mkdtemp", None)
+    assert csv_reader.Read(compressed, require=["CUSTOMER_ID"],
+                           row_field="SOURCE_ROW") == \
+        csv_reader.Read(csv_filepath, require=["CUSTOMER_ID"],
+                        row_field="SOURCE_ROW")
+    assert len(csv_reader.Read(compressed)) == 3
+
+def test_compressed_semicolons(tmp_path):
+    # The dialect is sniffed from what's been decompressed.
+    compressed = tmp_path / "sales.csv.gz"
+    compressed.write_bytes(gzip.compress(
+        b"CUSTOMER_NAME;CUSTOMER_ID\nAnna Karenina;1\nLevin;2\n"))
+    assert [record["CUSTOMER_ID"] for record
+            in csv_reader.Stream(str(compressed))] == ["1", "2"]
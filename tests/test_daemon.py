@@ -0,0 +1,147 @@
+import os
+from unittest import mock
+
+import pytest
+
+from context import daemon
+
+@pytest.fixture
+def inbox(tmp_path):
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    return inbox
+
+@pytest.fixture
+def mock_gnucash(monkeypatch, tmp_path):
+    # The batches are written next to the (relative) books.
+    monkeypatch.chdir(tmp_path)
+    danced = []
+    session = mock.Mock()
+    monkeypatch.setattr(daemon.gnucash, "Session", mock.Mock(return_value=session),
+                        raising=False)
+    monkeypatch.setattr(daemon.gnucash_laska, "AccountTree", mock.Mock())
+    monkeypatch.setattr(daemon.mazurka, "danse_mazurka",
+                        lambda book, parsed, *args, **kwargs: danced.append(parsed))
+    monkeypatch.setattr(daemon.registry, "Read",
+                        lambda spreadsheet, sheets=None, **projection: open(spreadsheet).read())
+    def parse(read, **kwargs):
+        if "bad" in read:
+            raise ValueError("Unknown account 'Assets:Moscow'")
+        return [read]
+    monkeypatch.setattr(daemon.csv_parser, "Parse", parse)
+    return session, danced
+
+def drop(inbox, name, content="good"):
+    (inbox / name).write_text(content)
+
+def test_waits_until_file_stops_changing(inbox, mock_gnucash):
+    session, danced = mock_gnucash
+    watcher = daemon.Daemon("book.gnucash", str(inbox), save_every=0)
+    watcher.open()
+    drop(inbox, "anna.csv")
+    watcher.run_once()
+    assert danced == []
+    watcher.run_once()
+    assert danced == [["good"]]
+    session.save.assert_called_once()
+    assert os.listdir(str(inbox / "done")) == ["anna.csv"]
+
+def test_saves_on_cadence(inbox, mock_gnucash):
+    session, danced = mock_gnucash
+    watcher = daemon.Daemon("book.gnucash", str(inbox), save_every=3600)
+    watcher.open()
+    drop(inbox, "anna.csv")
+    watcher.run_once()
+    watcher.run_once()
+    assert danced == [["good"]]
+    session.save.assert_not_called()
+    # Not saved yet: still in the inbox, but not imported again.
+    assert os.path.exists(str(inbox / "anna.csv"))
+    watcher.run_once()
+    assert len(danced) == 1
+    watcher.close()
+    session.save.assert_called_once()
+    session.end.assert_called_once()
+    assert os.listdir(str(inbox / "done")) == ["anna.csv"]
+
+def test_bad_file_goes_to_failed(inbox, mock_gnucash):
+    session, danced = mock_gnucash
+    watcher = daemon.Daemon("book.gnucash", str(inbox), save_every=0)
+    watcher.open()
+    drop(inbox, "vronsky.xlsx", "bad")
+    drop(inbox, "notes.txt")
+    watcher.run_once()
+    watcher.run_once()
+    assert danced == []
+    session.save.assert_not_called()
+    assert sorted(os.listdir(str(inbox / "failed"))) == [
+        "vronsky.xlsx", "vronsky.xlsx.error"]
+    assert "Assets:Moscow" in (inbox / "failed" / "vronsky.xlsx.error").read_text()
+    assert os.path.exists(str(inbox / "notes.txt"))
+
+def test_forgets_what_the_parser_made(inbox, mock_gnucash, monkeypatch):
+    session, danced = mock_gnucash
+    def parse(read, **kwargs):
+        return [daemon.csv_parser.to_Account("Income:Sales:" + read)]
+    monkeypatch.setattr(daemon.csv_parser, "Parse", parse)
+    watcher = daemon.Daemon("book.gnucash", str(inbox), save_every=0)
+    watcher.open()
+    drop(inbox, "anna.csv", "Samovars")
+    watcher.run_once()
+    watcher.run_once()
+    assert len(danced) == 1
+    assert daemon.csv_parser.to_Account.cache_info().currsize == 0
+
+def test_forgets_what_the_rules_matched(inbox, mock_gnucash):
+    session, danced = mock_gnucash
+    rules = mock.Mock(columns=frozenset())
+    watcher = daemon.Daemon("book.gnucash", str(inbox), save_every=0,
+                            rules=rules)
+    watcher.open()
+    drop(inbox, "anna.csv")
+    watcher.run_once()
+    watcher.run_once()
+    assert len(danced) == 1
+    rules.clear_memos.assert_called_once_with()
+
+def test_half_written_book_is_not_saved(inbox, mock_gnucash, monkeypatch):
+    session, danced = mock_gnucash
+    def broken_mazurka(*args, **kwargs):
+        raise RuntimeError("Ran out of invoice IDs")
+    monkeypatch.setattr(daemon.mazurka, "danse_mazurka", broken_mazurka)
+    watcher = daemon.Daemon("book.gnucash", str(inbox), poll_every=0)
+    drop(inbox, "anna.csv")
+    with pytest.raises(daemon.DaemonError, match="invoice IDs"):
+        watcher.run()
+    session.save.assert_not_called()
+    session.end.assert_called_once()
+
+def test_move_to_does_not_overwrite(tmp_path):
+    (tmp_path / "anna.csv").write_text("1")
+    daemon.move_to(str(tmp_path / "done"), str(tmp_path / "anna.csv"))
+    (tmp_path / "anna.csv").write_text("2")
+    moved = daemon.move_to(str(tmp_path / "done"), str(tmp_path / "anna.csv"))
+    assert moved == str(tmp_path / "done" / "anna.1.csv")
+    assert (tmp_path / "done" / "anna.csv").read_text() == "1"
+
+@pytest.fixture
+def mock_daemon(monkeypatch):
+    Daemon = mock.Mock()
+    monkeypatch.setattr(daemon, "Daemon", Daemon)
+    monkeypatch.setattr(daemon.signal, "signal", mock.Mock())
+    return Daemon
+
+@pytest.mark.parametrize("options, sheets", [
+    ([], None),
+    (["--sheet", "Baisakh", "--sheet-index", "1"], ["Baisakh", 1]),
+    (["--all-sheets"], daemon.registry.ALL_SHEETS)])
+def test_main_passes_the_sheets(mock_daemon, options, sheets):
+    daemon.main(["book.gnucash", "inbox"] + options)
+    assert mock_daemon.call_args[1]["sheets"] == sheets
+    mock_daemon.return_value.run.assert_called_once_with()
+
+def test_main_all_sheets_alone(mock_daemon):
+    with pytest.raises(SystemExit):
+        daemon.main(["book.gnucash", "inbox", "--all-sheets",
+                     "--sheet", "Baisakh"])
+    mock_daemon.assert_not_called()
@@ -40,6 +40,18 @@ class TestIsValidCurrency:
         with pytest.raises(ValueError):
             gncl.is_valid_currency(invalid_input)
 
+def test_currency_codes_reads_the_commodity_table_once(monkeypatch):
+    commodities = [mock.Mock(**{"get_mnemonic.return_value": code})
+                   for code in ("NPR", "RUB")]
+    table = mock.Mock(**{"get_commodities.return_value": commodities})
+    get_table = mock.Mock(return_value=table)
+    monkeypatch.setattr(gncl, "_currency_codes", None)
+    monkeypatch.setattr(gncl, "get_dummy_commodity_table", get_table)
+    assert gncl.currency_codes() == {"NPR", "RUB"}
+    assert gncl.is_valid_currency("RUB")
+    assert not gncl.is_valid_currency("LOL")
+    table.get_commodities.assert_called_once_with("CURRENCY")
+
 class TestIsValidAccountSpecification:
 
     @pytest.mark.parametrize(
@@ -61,3 +73,90 @@ class TestIsValidAccountSpecification:
          "Assets:Current Assets:Cash in Wallet:Unicode नाम:"])
     def test_slightly_incorrect_inputs(self, account_spec):
         assert gncl.is_valid_account_specification(account_spec) == False
+
+class TestAccountTree:
+
+    def mock_account(self, name, *children):
+        account = mock.Mock()
+        account.GetName.return_value = name
+        account.get_children.return_value = list(children)
+        return account
+
+    @pytest.fixture
+    def mock_book(self):
+        book = mock.Mock()
+        root = self.mock_account(
+            "Root Account",
+            self.mock_account("Assets",
+                              self.mock_account("Accounts Receivable"),
+                              self.mock_account("Current Assets",
+                                                self.mock_account("Petty Cash"),
+                                                self.mock_account("Bank"),
+                                                self.mock_account("Bank"))),
+            self.mock_account("Income", self.mock_account("Sales")))
+        book.get_root_account.return_value = root
+        return book
+
+    def test_names(self, mock_book):
+        assert gncl.AccountTree(mock_book).names() == [
+            "Assets", "Assets:Accounts Receivable", "Assets:Current Assets",
+            "Assets:Current Assets:Petty Cash", "Assets:Current Assets:Bank",
+            "Income", "Income:Sales"]
+
+    def test_lookup(self, mock_book):
+        tree = gncl.AccountTree(mock_book)
+        assert "Income:Sales" in tree
+        assert tree.lookup("Income:Sales").GetName() == "Sales"
+
+    def test_lookup_unknown(self, mock_book):
+        tree = gncl.AccountTree(mock_book)
+        with pytest.raises(gncl.AccountLookupError,
+                           match="Did you mean: 'Assets:Current Assets:Petty Cash'"):
+            tree.lookup("Assets:Petty Cash")
+
+    def test_lookup_ambiguous(self, mock_book):
+        with pytest.raises(gncl.AccountLookupError, match="Ambiguous"):
+            gncl.AccountTree(mock_book).lookup("Assets:Current Assets:Bank")
+
+    @pytest.mark.parametrize("name,expect", [
+        ("income:sales", "Income:Sales"),
+        ("Revenue:Sales", "Income:Sales"),
+        ("Income:Sale", "Income:Sales")])
+    def test_suggest(self, mock_book, name, expect):
+        assert expect in gncl.AccountTree(mock_book).suggest(name)
+
+class TestGetLotOwnerID:
+
+    # Owners, as the engine has them: (ID, end owner)
+    OWNERS = {"anna": ("000001", "anna"),
+              "anna's job": ("JOB-7", "anna")}
+
+    @pytest.fixture
+    def engine(self, monkeypatch):
+        engine = mock.Mock()
+        engine.gncOwnerGetEndOwner.side_effect = (
+            lambda owner: self.OWNERS[owner][1])
+        engine.gncOwnerGetID.side_effect = lambda owner: self.OWNERS[owner][0]
+        monkeypatch.setattr(gnucash, "gnucash_core_c", engine, raising=False)
+        return engine
+
+    @pytest.mark.parametrize("owner", ["anna", "anna's job"])
+    def test_invoice(self, engine, owner):
+        engine.gncInvoiceGetOwner.return_value = owner
+        lot = mock.Mock()
+        # Billed to the job or not, the lot is Anna's.
+        assert gncl.get_lot_owner_ID(lot) == "000001"
+        engine.gncInvoiceGetOwner.assert_called_once_with(
+            lot.GetInvoiceFromLot.return_value.instance)
+
+    def test_payment(self, engine):
+        engine.gncOwnerNew.return_value = "anna's job"
+        engine.gncOwnerGetOwnerFromLot.return_value = True
+        lot = mock.Mock(**{"GetInvoiceFromLot.return_value": None})
+        assert gncl.get_lot_owner_ID(lot) == "000001"
+        engine.gncOwnerFree.assert_called_once_with("anna's job")
+
+    def test_no_owner(self, engine):
+        engine.gncOwnerGetOwnerFromLot.return_value = False
+        lot = mock.Mock(**{"GetInvoiceFromLot.return_value": None})
+        assert gncl.get_lot_owner_ID(lot) is None
@@ -0,0 +1,168 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+
+from context import batch
+from context import manifest
+
+def write_manifest(tmp_path, books):
+    path = tmp_path / "manifest.json"
+    path.write_text(json.dumps(books))
+    return str(path)
+
+class TestLoadManifest:
+
+    def test_paths_are_relative_to_the_manifest(self, tmp_path):
+        jobs = manifest.load_manifest(write_manifest(tmp_path, {"books": [
+            {"book": "moscow.gnucash", "inputs": ["sales.ods", "/abs/pay.csv"],
+             "rejects": "rejects.csv"}]}))
+        assert jobs == [{"book": str(tmp_path / "moscow.gnucash"),
+                         "inputs": [str(tmp_path / "sales.ods"), "/abs/pay.csv"],
+                         "rejects": str(tmp_path / "rejects.csv")}]
+
+    @pytest.mark.parametrize("sheets", ["*", "Sales", 1, ["Sales", 1]])
+    def test_sheets(self, tmp_path, sheets):
+        [job] = manifest.load_manifest(write_manifest(tmp_path, [
+            {"book": "a.gnucash", "inputs": ["a.ods"], "sheets": sheets}]))
+        assert job["sheets"] == sheets
+
+    def test_a_book_only_once(self, tmp_path):
+        with pytest.raises(manifest.ManifestError, match="more than once"):
+            manifest.load_manifest(write_manifest(tmp_path, [
+                {"book": "moscow.gnucash", "inputs": ["a.ods"]},
+                {"book": "./moscow.gnucash", "inputs": ["b.ods"]}]))
+
+    @pytest.mark.parametrize("books", [[], {"books": [{"book": "a.gnucash"}]},
+                                       [{"inputs": ["a.ods"]}],
+                                       [{"book": "a.gnucash", "inputs": ["a.ods"],
+                                         "max_entries_per_invoice": 0}],
+                                       [{"book": "a.gnucash", "inputs": ["a.ods"],
+                                         "sheets": []}],
+                                       [{"book": "a.gnucash", "inputs": ["a.ods"],
+                                         "sheets": ["Sales", True]}],
+                                       [{"book": "a.gnucash", "inputs": ["a.ods"],
+                                         "sheets": {"Sales": 0}}]])
+    def test_bad_manifests(self, tmp_path, books):
+        with pytest.raises(manifest.ManifestError):
+            manifest.load_manifest(write_manifest(tmp_path, books))
+
+@pytest.fixture
+def mock_gnucash(monkeypatch, tmp_path):
+    # The batches are written next to the (relative) books.
+    monkeypatch.chdir(tmp_path)
+    sessions = {}
+    def Session(book):
+        sessions[book] = mock.Mock()
+        return sessions[book]
+    monkeypatch.setattr(manifest.gnucash, "Session", Session, raising=False)
+    monkeypatch.setattr(manifest.gnucash_laska, "AccountTree", mock.Mock())
+    monkeypatch.setattr(manifest.registry, "Read",
+                        lambda spreadsheet, sheets=None, **projection: spreadsheet)
+    def danse_mazurka(book, parsed, **kwargs):
+        if any("broken" in spreadsheet for spreadsheet in parsed):
+            raise RuntimeError("Vronsky fell off his horse")
+    monkeypatch.setattr(manifest.mazurka, "danse_mazurka", danse_mazurka)
+    monkeypatch.setattr(manifest.csv_parser, "Parse",
+                        lambda read, **kwargs: [read])
+    monkeypatch.setattr(manifest, "ProcessPoolExecutor", ThreadPoolExecutor)
+    return sessions
+
+def test_run_reports_every_book(mock_gnucash):
+    jobs = [{"book": "moscow.gnucash", "inputs": ["moscow.ods"]},
+            {"book": "petersburg.gnucash", "inputs": ["broken.ods"]},
+            {"book": "pokrovskoe.gnucash", "inputs": ["hay.ods", "rye.ods"]}]
+    reports = manifest.Run(jobs, workers=2)
+    assert [report["ok"] for report in reports] == [True, False, True]
+    assert "fell off his horse" in reports[1]["error"]
+    assert set(reports[0]["seconds"]) == {"load", "parse", "write", "save"}
+    mock_gnucash["moscow.gnucash"].save.assert_called_once()
+    mock_gnucash["petersburg.gnucash"].save.assert_not_called()
+    assert os.path.exists(batch.batch_path("moscow.gnucash", reports[0]["batch"]))
+    assert "batch" not in reports[1]
+    for session in mock_gnucash.values():
+        session.end.assert_called_once()
+    table = manifest.format_report(reports)
+    assert "FAILED" in table and "petersburg.gnucash" in table
+
+def test_writes_rejects_even_without_any(mock_gnucash, tmp_path):
+    rejects_file = tmp_path / "moscow-rejects.csv"
+    rejects_file.write_text("CUSTOMER_NAME,SOURCE_ROW,REJECT_REASON\n"
+                            "Stiva,3,last month's\n")
+    report = manifest.import_book({"book": "moscow.gnucash",
+                                   "inputs": ["moscow.ods"],
+                                   "rejects": str(rejects_file)})
+    assert report["ok"] and report["rejects"] == 0
+    assert rejects_file.read_text().strip() == "SOURCE_ROW,REJECT_REASON"
+
+def test_rejects_say_which_input_they_came_from(mock_gnucash, tmp_path,
+                                                monkeypatch):
+    def Parse(read, rejects=None, **kwargs):
+        rejects.append(manifest.csv_parser.Reject(
+            0, {"CUSTOMER_NAME": "Stiva", "SOURCE_ROW": 2}, "Broke"))
+        return []
+    monkeypatch.setattr(manifest.csv_parser, "Parse", Parse)
+    rejects_file = tmp_path / "moscow-rejects.csv"
+    report = manifest.import_book({"book": "moscow.gnucash",
+                                   "inputs": ["sales.ods", "payments.xlsx"],
+                                   "rejects": str(rejects_file)})
+    assert report["ok"] and report["rejects"] == 2
+    assert rejects_file.read_text().splitlines() == [
+        "CUSTOMER_NAME,SOURCE_FILE,SOURCE_ROW,REJECT_REASON",
+        "Stiva,sales.ods,2,Broke",
+        "Stiva,payments.xlsx,2,Broke"]
+
+def test_run_survives_a_dead_worker(mock_gnucash, monkeypatch):
+    from concurrent.futures.process import BrokenProcessPool
+    import_book = manifest.import_book
+    def crashing_import_book(job):
+        if job["book"] == "petersburg.gnucash":
+            raise BrokenProcessPool("A worker died")
+        return import_book(job)
+    monkeypatch.setattr(manifest, "import_book", crashing_import_book)
+    jobs = [{"book": "moscow.gnucash", "inputs": ["moscow.ods"]},
+            {"book": "petersburg.gnucash", "inputs": ["petersburg.ods"]},
+            {"book": "pokrovskoe.gnucash", "inputs": ["hay.ods"]}]
+    reports = manifest.Run(jobs, workers=1)
+    assert [report["book"] for report in reports] == [
+        "moscow.gnucash", "petersburg.gnucash", "pokrovskoe.gnucash"]
+    assert [report["ok"] for report in reports] == [True, False, True]
+    assert "A worker died" in reports[1]["error"]
+    assert "FAILED" in manifest.format_report(reports)
+
+def test_incremental(mock_gnucash, tmp_path, monkeypatch):
+    read = {"moscow.ods": ["Anna", "Levin"]}
+    monkeypatch.setattr(manifest.registry, "Read",
+                        lambda spreadsheet, sheets=None, **projection:
+                        list(read[spreadsheet]))
+    parsed = []
+    monkeypatch.setattr(manifest.csv_parser, "Parse",
+                        lambda rows, **kwargs: parsed.append(rows) or [])
+    job = {"book": str(tmp_path / "moscow.gnucash"), "inputs": ["moscow.ods"],
+           "incremental": True}
+    assert manifest.import_book(job)["ok"]
+    read["moscow.ods"].append("Kitty")
+    report = manifest.import_book(job)
+    assert report["skipped"] == 2
+    assert parsed == [["Anna", "Levin"], ["Kitty"]]
+
+def test_incremental_refuses_a_changed_input(mock_gnucash, tmp_path,
+                                             monkeypatch):
+    read = {"moscow.ods": ["Anna", "Levin"]}
+    projections = []
+    def Read(spreadsheet, sheets=None, **projection):
+        projections.append(projection)
+        return list(read[spreadsheet])
+    monkeypatch.setattr(manifest.registry, "Read", Read)
+    job = {"book": str(tmp_path / "moscow.gnucash"), "inputs": ["moscow.ods"],
+           "incremental": True, "rules": str(tmp_path / "rules.json")}
+    (tmp_path / "rules.json").write_text('{"rules": []}')
+    assert manifest.import_book(job)["ok"]
+    # The rows are read whole, whatever the parser (and the rules) need.
+    assert projections == [manifest.watermark.reader_options()]
+    read["moscow.ods"][0] = "Stiva"
+    report = manifest.import_book(job)
+    assert not report["ok"] and "duplicate" in report["error"]
+    assert manifest.import_book(dict(job, reimport=True))["ok"]
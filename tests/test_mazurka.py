@@ -0,0 +1,320 @@
+import itertools
+from unittest import mock
+
+import pytest
+
+from context import mazurka
+from context import progress
+
+def mock_lot(owner_ID, closed=False):
+    lot = mock.Mock()
+    lot.is_closed.return_value = closed
+    # (See: mock_owners)
+    lot.GetInvoiceFromLot.return_value.instance = ("invoice", owner_ID)
+    return lot
+
+@pytest.fixture
+def mock_account():
+    account = mock.Mock()
+    account.get_full_name.return_value = "Assets:Accounts Receivable"
+    return account
+
+class TestOpenLotIndex:
+
+    def test_scans_account_once(self, mock_account, mock_owners, monkeypatch):
+        monkeypatch.setattr(mazurka.gnucash_laska, "as_GncLot", lambda lot: lot)
+        anna, stiva, closed = mock_lot("000001"), mock_lot("000002"), mock_lot("000001", True)
+        mock_account.GetLotList.return_value = [anna, stiva, closed]
+        index = mazurka.OpenLotIndex()
+        assert index.get_lots(mock_account, "000001") == [anna]
+        assert index.get_lots(mock_account, "000002") == [stiva]
+        assert index.get_lots(mock_account, "000003") == []
+        mock_account.GetLotList.assert_called_once()
+
+    def test_drops_closed_lots(self, mock_account, mock_owners, monkeypatch):
+        monkeypatch.setattr(mazurka.gnucash_laska, "as_GncLot", lambda lot: lot)
+        anna = mock_lot("000001")
+        mock_account.GetLotList.return_value = [anna]
+        index = mazurka.OpenLotIndex()
+        assert index.get_lots(mock_account, "000001") == [anna]
+        anna.is_closed.return_value = True
+        assert index.get_lots(mock_account, "000001") == []
+
+    def test_add_lot(self, mock_account, monkeypatch):
+        monkeypatch.setattr(mazurka.gnucash_laska, "as_GncLot", lambda lot: lot)
+        mock_account.GetLotList.return_value = []
+        index = mazurka.OpenLotIndex()
+        new_lot = mock_lot("000001")
+        # Not scanned yet: left for the scan to find.
+        index.add_lot(mock_account, "000001", new_lot)
+        assert index.accounts == {}
+        assert index.get_lots(mock_account, "000001") == []
+        index.add_lot(mock_account, "000001", new_lot)
+        assert index.get_lots(mock_account, "000001") == [new_lot]
+
+def mock_credit_lot(owner_ID):
+    lot = mock.Mock()
+    lot.is_closed.return_value = False
+    lot.GetInvoiceFromLot.return_value = None
+    lot.instance = ("credit", owner_ID)
+    return lot
+
+@pytest.fixture
+def mock_owners(monkeypatch):
+    """gncOwnerGetOwnerFromLot, gncInvoiceGetOwner & co., for the lots"""
+    core = mazurka.gnucash_laska.gnucash.gnucash_core_c
+    owners = {}
+    monkeypatch.setattr(core, "gncOwnerNew", lambda: {}, raising=False)
+    monkeypatch.setattr(core, "gncOwnerFree", lambda owner: None,
+                        raising=False)
+    def get_owner_from_lot(lot, owner):
+        if lot is None or lot[0] != "credit":
+            return False
+        owner["ID"] = lot[1]
+        return True
+    monkeypatch.setattr(core, "gncOwnerGetOwnerFromLot", get_owner_from_lot,
+                        raising=False)
+    monkeypatch.setattr(core, "gncOwnerGetID", lambda owner: owner["ID"],
+                        raising=False)
+    monkeypatch.setattr(core, "gncInvoiceGetOwner",
+                        lambda invoice: {"ID": invoice[1]}, raising=False)
+    monkeypatch.setattr(core, "gncOwnerGetEndOwner", lambda owner: owner,
+                        raising=False)
+
+class TestOpenLotIndexCredits:
+
+    def test_indexes_credit_lots(self, mock_account, mock_owners, monkeypatch):
+        monkeypatch.setattr(mazurka.gnucash_laska, "as_GncLot", lambda lot: lot)
+        invoice, credit = mock_lot("000001"), mock_credit_lot("000001")
+        mock_account.GetLotList.return_value = [invoice, credit]
+        index = mazurka.OpenLotIndex()
+        assert index.get_lots(mock_account, "000001") == [invoice, credit]
+
+class TestAddPayment:
+
+    @pytest.fixture
+    def payment(self):
+        payment = mock.Mock(mazurka.classes.Payment)
+        payment.Customer.get_ID.return_value = "000001"
+        (payment.GList, payment.AutoPay, payment.Transaction) = (None, True, None)
+        return payment
+
+    @pytest.fixture
+    def book(self, mock_account, monkeypatch):
+        monkeypatch.setattr(mazurka.gnucash_laska, "as_GncLot", lambda lot: lot)
+        monkeypatch.setattr(mazurka.gnucash_laska, "to_GList",
+                            lambda lots: list(lots))
+        transaction = mock.Mock()
+        transaction.GetSplitList.return_value = []
+        monkeypatch.setattr(mazurka.gnucash, "Transaction",
+                            mock.Mock(return_value=transaction), raising=False)
+        Accounts = mock.Mock(**{"lookup.return_value": mock_account})
+        return (mock.Mock(), Accounts)
+
+    def test_pays_credit_lots_too(self, payment, book, mock_account,
+                                  mock_owners):
+        (GNCBook, Accounts) = book
+        invoice, credit = mock_lot("000001"), mock_credit_lot("000001")
+        mock_account.GetLotList.return_value = [invoice, credit]
+        mazurka.add_ekatPayment_to_GNCBook(GNCBook, payment,
+                                           mazurka.OpenLotIndex(), Accounts)
+        Customer = GNCBook.CustomerLookupByID.return_value
+        (args, kwargs) = Customer.ApplyPaymentSecs.call_args
+        # The lots, and AutoPay
+        assert (args[1], args[-1]) == ([invoice, credit], True)
+
+    def test_autopay_without_lots(self, payment, book, mock_account,
+                                  mock_owners):
+        (GNCBook, Accounts) = book
+        mock_account.GetLotList.return_value = [mock_lot("000002")]
+        mazurka.add_ekatPayment_to_GNCBook(GNCBook, payment,
+                                           mazurka.OpenLotIndex(), Accounts)
+        Customer = GNCBook.CustomerLookupByID.return_value
+        (args, kwargs) = Customer.ApplyPaymentSecs.call_args
+        # As without the index: GnuCash looks for the lots itself.
+        assert (args[1], args[-1]) == (None, True)
+
+    def test_indexes_the_credit_it_leaves(self, payment, book, mock_account,
+                                          mock_owners, monkeypatch):
+        (GNCBook, Accounts) = book
+        mock_account.GetLotList.return_value = []
+        credit = mock_credit_lot("000001")
+        split = mock.Mock(**{"GetLot.return_value": credit})
+        monkeypatch.setattr(mazurka.gnucash_laska, "is_same",
+                            lambda one, other: one is other)
+        split.GetAccount.return_value = mock_account
+        mazurka.gnucash.Transaction.return_value.GetSplitList.return_value = [
+            split]
+        index = mazurka.OpenLotIndex()
+        mazurka.add_ekatPayment_to_GNCBook(GNCBook, payment, index, Accounts)
+        assert index.get_lots(mock_account, "000001") == [credit]
+
+    def test_payment_of_nothing_has_no_transaction(self, payment, book,
+                                                   mock_account, mock_owners):
+        (GNCBook, Accounts) = book
+        mock_account.GetLotList.return_value = [mock_lot("000001")]
+        (payment.PaymentAmount, payment.Refund) = (0, 0)
+        Batch = mock.Mock()
+        mazurka.add_ekatPayment_to_GNCBook(GNCBook, payment,
+                                           mazurka.OpenLotIndex(), Accounts,
+                                           Batch)
+        mazurka.gnucash.Transaction.assert_not_called()
+        Customer = GNCBook.CustomerLookupByID.return_value
+        (args, kwargs) = Customer.ApplyPaymentSecs.call_args
+        assert args[0] is None
+        Batch.add_transaction.assert_not_called()
+
+    def test_destroys_an_empty_transaction(self, payment, book, mock_account,
+                                           mock_owners):
+        (GNCBook, Accounts) = book
+        mock_account.GetLotList.return_value = []
+        Batch = mock.Mock()
+        index = mazurka.OpenLotIndex()
+        mazurka.add_ekatPayment_to_GNCBook(GNCBook, payment, index, Accounts,
+                                           Batch)
+        transaction = mazurka.gnucash.Transaction.return_value
+        transaction.Destroy.assert_called_once()
+        transaction.CommitEdit.assert_not_called()
+        Batch.add_transaction.assert_not_called()
+        assert index.get_lots(mock_account, "000001") == []
+
+class TestApplyCredits:
+
+    @pytest.fixture
+    def book(self, mock_account, monkeypatch):
+        monkeypatch.setattr(mazurka.gnucash_laska, "as_GncLot", lambda lot: lot)
+        monkeypatch.setattr(mazurka.gnucash_laska, "to_GList",
+                            lambda lots: list(lots))
+        monkeypatch.setattr(mazurka.gnucash, "GncNumeric", mock.Mock(),
+                            raising=False)
+        Accounts = mock.Mock(**{"lookup.return_value": mock_account})
+        return (mock.Mock(), Accounts)
+
+    @pytest.fixture
+    def customer(self):
+        customer = mock.Mock()
+        customer.get_ID.return_value = "000001"
+        return customer
+
+    def test_applies_the_indexed_lots(self, book, customer, mock_account,
+                                      mock_owners):
+        (GNCBook, Accounts) = book
+        invoice, credit = mock_lot("000001"), mock_credit_lot("000001")
+        mock_account.GetLotList.return_value = [mock_lot("000002"), invoice,
+                                                credit]
+        index = mazurka.OpenLotIndex()
+        mazurka.apply_credits_to_invoices(GNCBook, customer, mock.Mock(),
+                                          None, Accounts, index)
+        Customer = GNCBook.CustomerLookupByID.return_value
+        (args, kwargs) = Customer.ApplyPaymentSecs.call_args
+        assert (args[1], args[-1]) == ([invoice, credit], True)
+        # The account is scanned once, for all the customers.
+        mazurka.apply_credits_to_invoices(GNCBook, customer, mock.Mock(),
+                                          None, Accounts, index)
+        mock_account.GetLotList.assert_called_once()
+
+    def test_nothing_to_apply(self, book, customer, mock_account,
+                              mock_owners):
+        (GNCBook, Accounts) = book
+        mock_account.GetLotList.return_value = [mock_lot("000002")]
+        mazurka.apply_credits_to_invoices(GNCBook, customer, mock.Mock(),
+                                          None, Accounts,
+                                          mazurka.OpenLotIndex())
+        Customer = GNCBook.CustomerLookupByID.return_value
+        Customer.ApplyPaymentSecs.assert_not_called()
+
+class TestDanseMazurka:
+
+    @pytest.fixture
+    def invoices(self):
+        invoices = []
+        for ID in ["000001", "000001", "000002"]:
+            invoice = mock.Mock(mazurka.classes.Invoice)
+            invoice.get_customer.return_value.get_ID.return_value = ID
+            invoice.get_ReceivableAC.return_value = "Assets:Accounts Receivable"
+            invoices.append(invoice)
+        return invoices
+
+    @pytest.mark.parametrize("deferred_autopay", [True, False])
+    def test_deferred_autopay(self, invoices, deferred_autopay, monkeypatch):
+        add_invoices = mock.Mock()
+        apply_credits = mock.Mock()
+        monkeypatch.setattr(mazurka, "add_ekatInvoices_to_GNCBook", add_invoices)
+        monkeypatch.setattr(mazurka, "apply_credits_to_invoices", apply_credits)
+        mazurka.danse_mazurka(mock.Mock(), invoices,
+                              deferred_autopay=deferred_autopay,
+                              Accounts=mock.Mock())
+        assert add_invoices.call_args.kwargs["Autopay"] is not deferred_autopay
+        # Once per customer, not once per invoice, with the index
+        assert apply_credits.call_count == (2 if deferred_autopay else 0)
+        for (args, kwargs) in apply_credits.call_args_list:
+            assert isinstance(args[-1], mazurka.OpenLotIndex)
+
+    def test_batches_invoices_between_payments(self, invoices, monkeypatch):
+        batches = []
+        monkeypatch.setattr(mazurka, "add_ekatInvoices_to_GNCBook",
+                            lambda book, invoices, *args, **kwargs:
+                            batches.append(list(invoices)))
+        monkeypatch.setattr(mazurka, "add_ekatPayment_to_GNCBook", mock.Mock())
+        payment = mock.Mock(mazurka.classes.Payment)
+        mazurka.danse_mazurka(mock.Mock(),
+                              [invoices[0], invoices[1], payment, invoices[2]],
+                              Accounts=mock.Mock())
+        assert batches == [invoices[:2], invoices[2:]]
+
+    @pytest.mark.parametrize("deferred_autopay", [False, True])
+    def test_reports_progress(self, invoices, monkeypatch, deferred_autopay):
+        reported = []
+        steps = []
+        def progress_at(step):
+            return lambda *args, **kwargs: steps.append(
+                (step, reported[-1].done))
+        monkeypatch.setattr(mazurka, "next_invoice_ID", mock.Mock())
+        monkeypatch.setattr(mazurka, "ekat_to_gnc_Invoice",
+                            mock.Mock(side_effect=progress_at("make")))
+        monkeypatch.setattr(mazurka, "post_gncInvoice",
+                            mock.Mock(side_effect=progress_at("post")))
+        monkeypatch.setattr(mazurka, "add_ekatPayment_to_GNCBook",
+                            mock.Mock(side_effect=progress_at("pay")))
+        monkeypatch.setattr(mazurka, "apply_credits_to_invoices",
+                            mock.Mock(side_effect=progress_at("credits")))
+        # A second goes by at every look at the clock: every step is reported.
+        monkeypatch.setattr(progress.time, "monotonic",
+                            itertools.count().__next__)
+        payment = mock.Mock(mazurka.classes.Payment)
+        mazurka.danse_mazurka(mock.Mock(),
+                              [invoices[0], invoices[1], payment, invoices[2]],
+                              Accounts=mock.Mock(),
+                              deferred_autopay=deferred_autopay,
+                              progress=reported.append)
+        # Every invoice as it's made, and as it's posted; every payment,
+        # and every customer's credits (two customers)
+        total = 7 + (2 if deferred_autopay else 0)
+        assert [(progress.done, progress.total) for progress in reported] == [
+            (done, total) for done in range(total + 1)]
+        # How far along it was, as each step began
+        assert steps == [("make", 0), ("post", 1), ("make", 2), ("post", 3),
+                         ("pay", 4), ("make", 5), ("post", 6)] + (
+            [("credits", 7), ("credits", 8)] if deferred_autopay else [])
+
+def test_next_invoice_ID():
+    book = mock.Mock()
+    book.increment_and_format_counter.side_effect = ["000007", "000008"]
+    assert mazurka.next_invoice_ID(book) == "000007"
+    book.increment_and_format_counter.assert_called_once_with("gncInvoice")
+
+def test_IDs_are_taken_as_the_invoices_are_made(monkeypatch):
+    book = mock.Mock()
+    book.increment_and_format_counter.side_effect = ["000007", "000008"]
+    made = []
+    def ekat_to_gnc_Invoice(book, invoice, ID, *args):
+        if invoice == "broken":
+            raise ValueError("No such account")
+        made.append(ID)
+    monkeypatch.setattr(mazurka, "ekat_to_gnc_Invoice", ekat_to_gnc_Invoice)
+    monkeypatch.setattr(mazurka, "post_gncInvoice", mock.Mock())
+    with pytest.raises(ValueError):
+        mazurka.add_ekatInvoices_to_GNCBook(book, ["anna", "broken", "vronsky"])
+    # Only the ID of the invoice that failed is gone.
+    assert made == ["000007"]
+    assert book.increment_and_format_counter.call_count == 2
@@ -44,3 +44,74 @@ class TestGenerateCSVFromODSUsingLibreOffice:
         with pytest.raises(AssertionError, match="Invalid Output Directory"):
             ods_reader.generate_csv_from_ods_using_libreoffice(empty_ods_filepath,
                                                             invalid_out_dir)
+
+class TestSheetSelection:
+
+    @pytest.fixture
+    def multisheet_ods_filepath(self, tmp_path):
+        """Return the path to a bare-bones .ods file with three sheets"""
+        import zipfile
+        content = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<office:document-content'
+            ' xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0"'
+            ' xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0"'
+            ' xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0">'
+            '<office:body><office:spreadsheet>'
+            '<table:table table:name="Baisakh">'
+            '<table:table-row><table:table-cell><text:p>Anna</text:p>'
+            '</table:table-cell></table:table-row></table:table>'
+            '<table:table table:name="Jestha"/>'
+            '<table:table table:name="असार"/>'
+            '</office:spreadsheet></office:body>'
+            '</office:document-content>')
+        ods = tmp_path/"multisheet.ods"
+        with zipfile.ZipFile(ods, "w") as odszip:
+            odszip.writestr("content.xml", content)
+        return str(ods)
+
+    def test_get_sheet_names(self, multisheet_ods_filepath):
+        assert (ods_reader.get_sheet_names(multisheet_ods_filepath)
+                == ["Baisakh", "Jestha", "असार"])
+
+    @pytest.mark.parametrize("sheets,expect",
+                             [(ods_reader.ALL_SHEETS, ["Baisakh", "Jestha", "असार"]),
+                              ("Jestha", ["Jestha"]),
+                              (0, ["Baisakh"]),
+                              (-1, ["असार"]),
+                              (["असार", 0], ["असार", "Baisakh"]),
+                              # The same sheet twice: read once
+                              (["Jestha", 0, 1, "Baisakh"], ["Jestha", "Baisakh"])])
+    def test_select_sheets(self, sheets, expect):
+        names = ["Baisakh", "Jestha", "असार"]
+        assert ods_reader.select_sheets(names, sheets) == expect
+
+    @pytest.mark.parametrize("sheets", ["Shrawan", 3, [0, "Shrawan"], True, 1.5])
+    def test_select_sheets_invalid(self, sheets):
+        with pytest.raises(ods_reader.SheetSelectionError):
+            ods_reader.select_sheets(["Baisakh", "Jestha", "असार"], sheets)
+
+    def test_read_reads_the_sheet_names_once(self, multisheet_ods_filepath,
+                                             monkeypatch):
+        get_sheet_names = ods_reader.get_sheet_names
+        calls = []
+        def counting_get_sheet_names(odsfile):
+            calls.append(odsfile)
+            return get_sheet_names(odsfile)
+        def run_libreoffice(arguments):
+            # As LibreOffice would: a CSV file per sheet, in --outdir
+            outdir = arguments[arguments.index("--outdir") + 1]
+            for name in get_sheet_names(multisheet_ods_filepath):
+                path = ods_reader.os.path.join(
+                    outdir, "multisheet-{}.csv".format(name))
+                with open(path, "w") as csvfile:
+                    csvfile.write("CUSTOMER_NAME,QUANTITY\n{},1\n".format(name))
+        monkeypatch.setattr(ods_reader, "get_sheet_names",
+                            counting_get_sheet_names)
+        monkeypatch.setattr(ods_reader, "run_libreoffice", run_libreoffice)
+        records = ods_reader.Read(multisheet_ods_filepath,
+                                  sheets=["Jestha", 1, 0])
+        assert [(record["CUSTOMER_NAME"], record["SHEET"])
+                for record in records] == [("Jestha", "Jestha"),
+                                           ("Baisakh", "Baisakh")]
+        assert len(calls) == 1
@@ -0,0 +1,87 @@
+from unittest import mock
+
+import pytest
+
+from context import pipeline
+
+@pytest.fixture
+def records():
+    # (customer, what): the parser is mocked to turn these into
+    # ("invoice", customer) and ("payment", customer)
+    return [{"CUSTOMER_NAME": customer, "WHAT": what}
+            for (customer, what) in [("Anna", "payment"), ("Anna", "invoice"),
+                                     ("Anna", "invoice"), ("Kitty", "payment"),
+                                     ("Kitty", "invoice")]]
+
+@pytest.fixture
+def mock_gnucash(monkeypatch):
+    batches = []
+    session = mock.Mock()
+    monkeypatch.setattr(pipeline.gnucash, "Session", mock.Mock(return_value=session),
+                        raising=False)
+    monkeypatch.setattr(pipeline.gnucash_laska, "AccountTree", mock.Mock())
+    monkeypatch.setattr(pipeline.gnucash_laska, "currency_codes", mock.Mock())
+    monkeypatch.setattr(pipeline.mazurka, "danse_mazurka",
+                        lambda book, batch, *args, **kwargs: batches.append(batch))
+    monkeypatch.setattr(pipeline.csv_parser, "record_kind",
+                        lambda record: (True, True))
+    monkeypatch.setattr(pipeline.csv_parser, "get",
+                        lambda what, record: record["CUSTOMER_NAME"])
+    def parse_record(record, kind=None):
+        transaction = (record["WHAT"], record["CUSTOMER_NAME"])
+        if record["WHAT"] == "invoice":
+            return (transaction, None)
+        return (None, transaction)
+    monkeypatch.setattr(pipeline.csv_parser, "parse_record", parse_record)
+    monkeypatch.setattr(pipeline.csv_parser, "merge_invoices",
+                        lambda invoices, *options: list(invoices))
+    return session, batches
+
+def test_run_grouped_by_customer(records, mock_gnucash):
+    session, batches = mock_gnucash
+    written = pipeline.Run(iter(records), "book.gnucash",
+                           grouped_by_customer=True, chunk_size=2)
+    assert len(written) == 5
+    # Each customer's payments come before their invoices
+    anna = [transaction for transaction in written if transaction[1] == "Anna"]
+    assert anna == [("payment", "Anna"), ("invoice", "Anna"), ("invoice", "Anna")]
+    assert written.index(("payment", "Kitty")) < written.index(("invoice", "Kitty"))
+    session.save.assert_called_once()
+    session.end.assert_called_once()
+
+def test_run_ungrouped_writes_invoices_last(records, mock_gnucash):
+    session, batches = mock_gnucash
+    written = pipeline.Run(records, "book.gnucash")
+    assert [what for (what, customer) in written] == [
+        "payment", "payment", "invoice", "invoice", "invoice"]
+
+def test_run_failure_saves_nothing(records, mock_gnucash):
+    session, batches = mock_gnucash
+    def broken_records():
+        yield records[0]
+        raise ValueError("Bad row")
+    with pytest.raises(pipeline.PipelineError, match="Bad row"):
+        pipeline.Run(broken_records(), "book.gnucash")
+    session.save.assert_not_called()
+    session.end.assert_called_once()
+
+def test_run_reads_currency_codes_before_the_threads(records, mock_gnucash,
+                                                    monkeypatch):
+    import threading
+    threads = []
+    monkeypatch.setattr(pipeline.gnucash_laska, "currency_codes",
+                        lambda: threads.append(threading.active_count()))
+    pipeline.Run(records, "book.gnucash")
+    # Called once, with none of the pipeline's threads running yet
+    assert threads == [1]
+
+def test_run_parser_failure_saves_nothing(records, mock_gnucash, monkeypatch):
+    session, batches = mock_gnucash
+    def parse_record(record, kind=None):
+        raise ValueError("Unparseable row")
+    # The parser is forked, so it gets this one too.
+    monkeypatch.setattr(pipeline.csv_parser, "parse_record", parse_record)
+    with pytest.raises(pipeline.PipelineError, match="Unparseable row"):
+        pipeline.Run(records, "book.gnucash")
+    session.save.assert_not_called()
+    session.end.assert_called_once()
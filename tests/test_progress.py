@@ -0,0 +1,56 @@
+import io
+import logging
+
+import pytest
+
+from context import progress
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(progress.time, "monotonic", clock)
+    return clock
+
+def test_tracker_rate_and_eta(clock):
+    reported = []
+    tracker = progress.ProgressTracker(100, reported.append, every=1)
+    tracker.start()
+    clock.now = 2.0
+    tracker.advance(50)
+    assert reported[-1] == progress.Progress(50, 100, 2.0, 25.0, 2.0)
+    assert reported[0].eta is None
+
+def test_tracker_throttles_but_reports_the_end(clock):
+    reported = []
+    tracker = progress.ProgressTracker(3, reported.append, every=1)
+    tracker.start()
+    tracker.advance()
+    tracker.advance()
+    assert len(reported) == 1
+    tracker.advance()
+    assert [report.done for report in reported] == [0, 3]
+
+def test_terminal_progress():
+    stream = io.StringIO()
+    draw = progress.terminal_progress(stream, width=10)
+    draw(progress.Progress(5, 10, 5.0, 1.0, 5.0))
+    draw(progress.Progress(10, 10, 10.0, 1.0, 0.0))
+    assert stream.getvalue() == (
+        "\r[#####     ] 5/10 steps (50%), 1.0/s, ETA 0:00:05"
+        "\r[##########] 10/10 steps (100%), 1.0/s, ETA 0:00:00\n")
+
+def test_logging_progress(caplog):
+    log = progress.logging_progress(logging.getLogger("test"), every=10)
+    with caplog.at_level(logging.INFO):
+        log(progress.Progress(0, 10, 0.0, 0.0, None))
+        log(progress.Progress(5, 10, 5.0, 1.0, 5.0))
+        log(progress.Progress(10, 10, 10.0, 1.0, 0.0))
+    assert [record.getMessage() for record in caplog.records] == [
+        "Written 0/10 steps (0%), 0.0/s, ETA --:--:--",
+        "Written 10/10 steps (100%), 1.0/s, ETA 0:00:00"]
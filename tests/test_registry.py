@@ -0,0 +1,84 @@
+import os
+import bz2
+import gzip
+import lzma
+import sys
+import zipfile
+import subprocess
+
+import pytest
+
+from context import registry
+from context import ods_reader
+
+CSV = "CUSTOMER_NAME,CUSTOMER_ID,QUANTITY\nAnna Karenina,1,2\nLevin,2,3\n"
+
+def write_zip(path, files):
+    with zipfile.ZipFile(str(path), "w") as archive:
+        for (name, content) in files.items():
+            archive.writestr(name, content)
+    return str(path)
+
+@pytest.mark.parametrize("name, files, expected", [
+    ("book.ods", {"mimetype": "application/vnd.oasis.opendocument.spreadsheet"},
+     "ods"),
+    # What's inside wins over what it's called.
+    ("book.ods", {"[Content_Types].xml": "", "xl/workbook.xml": ""}, "xlsx"),
+    ("book.xlsx", {"xl/workbook.xml": ""}, "xlsx"),
+])
+def test_sniff_zip(tmp_path, name, files, expected):
+    assert registry.sniff_format(write_zip(tmp_path / name, files)) == expected
+
+def test_sniff_zip_of_something_else(tmp_path):
+    with pytest.raises(registry.ReaderError):
+        registry.sniff_format(write_zip(tmp_path / "photos.zip", {"a.jpg": ""}))
+
+@pytest.mark.parametrize("name, compress", [
+    ("sales.csv.gz", gzip.compress), ("sales.csv.bz2", bz2.compress),
+    ("sales.csv.xz", lzma.compress), ("sales.dat", gzip.compress)])
+def test_read_compressed_csv(tmp_path, name, compress):
+    path = tmp_path / name
+    path.write_bytes(compress(CSV.encode()))
+    assert registry.sniff_format(str(path)) == "compressed csv"
+    records = registry.Read(str(path), fields={"CUSTOMER_NAME"})
+    assert records == [{"CUSTOMER_NAME": "Anna Karenina"},
+                       {"CUSTOMER_NAME": "Levin"}]
+
+@pytest.mark.parametrize("name", ["sales.csv", "sales.ods", "sales"])
+def test_plain_text_is_csv(tmp_path, name):
+    path = tmp_path / name
+    path.write_text(CSV)
+    # Even if it's called .ods: no LibreOffice for a CSV.
+    assert registry.sniff_format(str(path)) == "csv"
+
+def test_csv_ignores_sheets(tmp_path):
+    path = tmp_path / "sales.csv"
+    path.write_text(CSV)
+    assert len(registry.Read(str(path), sheets=["Moscow"])) == 2
+
+def test_readers_are_imported_lazily(tmp_path):
+    path = tmp_path / "sales.csv"
+    path.write_text(CSV)
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    script = ("import sys\n"
+              "from ekaterina.readers import registry\n"
+              "registry.Read(sys.argv[1])\n"
+              "print(sorted(name for name in sys.modules\n"
+              "             if name.startswith('ekaterina.readers.')))\n")
+    output = subprocess.run([sys.executable, "-c", script, str(path)],
+                            cwd=root, check=True, capture_output=True,
+                            text=True).stdout
+    assert output.strip() == str(["ekaterina.readers.csv_reader",
+                                  "ekaterina.readers.registry"])
+
+def test_register(tmp_path, monkeypatch):
+    monkeypatch.setattr(registry, "READERS", registry.READERS.copy())
+    registry.register("anna", "ekaterina.readers.csv_reader", [".anna"])
+    path = tmp_path / "sales.anna"
+    path.write_text(CSV)
+    assert registry.sniff_format(str(path)) == "anna"
+    with pytest.raises(registry.ReaderError):
+        registry.get_reader("vronsky")
+
+def test_all_sheets():
+    assert registry.ALL_SHEETS == ods_reader.ALL_SHEETS
@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from context import rules
+from context import csv_parser
+
+@pytest.fixture
+def samovar_rules():
+    return rules.Rules([
+        {"when": {"SALE_DESCRIPTION": "(?i).*samovar.*", "BRANCH": "Moscow"},
+         "set": {"INCOME_ACCOUNT": "Income:Samovars:Moscow"}},
+        {"when": {"SALE_DESCRIPTION": "(?i).*samovar.*"},
+         "set": {"INCOME_ACCOUNT": "Income:Samovars",
+                 "INVOICE_DESCRIPTION": "Samovars"}},
+        {"when": {"CURRENCY": "RUB"},
+         "set": {"RECEIVABLE_ACCOUNT": "Assets:Accounts Receivable:RUB"}},
+        {"set": {"INCOME_ACCOUNT": "Income:Sales"}}])
+
+@pytest.mark.parametrize("record, expected", [
+    ({"SALE_DESCRIPTION": "Brass Samovar", "BRANCH": "Moscow"},
+     {"INCOME_ACCOUNT": "Income:Samovars:Moscow",
+      "INVOICE_DESCRIPTION": "Samovars"}),
+    ({"SALE_DESCRIPTION": "Brass Samovar", "BRANCH": "Petersburg"},
+     {"INCOME_ACCOUNT": "Income:Samovars", "INVOICE_DESCRIPTION": "Samovars"}),
+    ({"SALE_DESCRIPTION": "Tea", "CURRENCY": " RUB "},
+     {"INCOME_ACCOUNT": "Income:Sales",
+      "RECEIVABLE_ACCOUNT": "Assets:Accounts Receivable:RUB"}),
+    ({"SALE_DESCRIPTION": "Tea"}, {"INCOME_ACCOUNT": "Income:Sales"}),
+])
+def test_derive(samovar_rules, record, expected):
+    assert samovar_rules.derive(record) == expected
+    # Again, from the memos this time.
+    assert samovar_rules.derive(record) == expected
+
+def test_memo_per_distinct_value(samovar_rules):
+    for count in range(3):
+        samovar_rules.derive({"SALE_DESCRIPTION": "Samovar", "BRANCH": "Moscow"})
+        samovar_rules.derive({"SALE_DESCRIPTION": "Tea", "BRANCH": "Moscow"})
+    assert set(samovar_rules.matches["SALE_DESCRIPTION"]) == {"Samovar", "Tea"}
+    assert set(samovar_rules.matches["BRANCH"]) == {"Moscow"}
+
+def test_memos_are_capped(samovar_rules, monkeypatch):
+    monkeypatch.setattr(rules, "MEMO_SIZE", 2)
+    for description in ["Samovar", "Tea", "Hay"]:
+        samovar_rules.derive({"SALE_DESCRIPTION": description})
+    assert set(samovar_rules.matches["SALE_DESCRIPTION"]) == {"Hay"}
+    assert samovar_rules.derive({"SALE_DESCRIPTION": "Samovar"}) == \
+        samovar_rules.derive({"SALE_DESCRIPTION": "Samovar"})
+
+def test_clear_memos(samovar_rules):
+    record = {"SALE_DESCRIPTION": "Samovar", "BRANCH": "Moscow"}
+    derived = dict(samovar_rules.derive(record))
+    samovar_rules.clear_memos()
+    assert not any(samovar_rules.matches.values())
+    assert samovar_rules.fills == {}
+    assert samovar_rules.derive(record) == derived
+
+def test_apply_fills_only_empty_columns(samovar_rules):
+    record = {"SALE_DESCRIPTION": "Samovar", "INCOME_ACCOUNT": "Income:Gifts",
+              "INVOICE_DESCRIPTION": " "}
+    filled = samovar_rules.apply(record)
+    assert filled == {"SALE_DESCRIPTION": "Samovar",
+                      "INCOME_ACCOUNT": "Income:Gifts",
+                      "INVOICE_DESCRIPTION": "Samovars"}
+    assert record["INVOICE_DESCRIPTION"] == " "
+    untouched = {"SALE_DESCRIPTION": "Tea", "INCOME_ACCOUNT": "Income:Tea"}
+    assert samovar_rules.apply(untouched) is untouched
+
+def test_columns(samovar_rules):
+    assert samovar_rules.columns == {
+        "SALE_DESCRIPTION", "BRANCH", "CURRENCY", "INCOME_ACCOUNT",
+        "INVOICE_DESCRIPTION", "RECEIVABLE_ACCOUNT"}
+    assert "BRANCH" in csv_parser.reader_options(samovar_rules)["fields"]
+
+@pytest.mark.parametrize("bad_rules", [
+    [{"when": {"BRANCH": "Moscow"}}],
+    [{"when": {"BRANCH": "("}, "set": {"INCOME_ACCOUNT": "Income:Sales"}}],
+    [{"set": {"INCOME_ACCOUNT": 4}}],
+    ["Income:Sales"]])
+def test_bad_rules(bad_rules):
+    with pytest.raises(rules.RulesError):
+        rules.Rules(bad_rules)
+
+def test_load_rules(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps(
+        {"rules": [{"set": {"INCOME_ACCOUNT": "Income:Sales"}}]}))
+    assert len(rules.load_rules(str(path))) == 1
+    path.write_text("{")
+    with pytest.raises(rules.RulesError):
+        rules.load_rules(str(path))
+
+def test_parse_with_rules(samovar_rules):
+    record = {"CUSTOMER_NAME": "Anna Karenina", "CUSTOMER_ID": "1",
+              "SALE_DESCRIPTION": "Samovar", "QUANTITY": "1",
+              "UNIT_PRICE": "100", "SALE_DATE": "2021-01-01",
+              "CURRENCY": "NPR"}
+    # No INCOME_ACCOUNT: not a sale, without the rules.
+    assert csv_parser.Parse([record]) == []
+    (invoice,) = csv_parser.Parse([record], rules=samovar_rules)
+    assert str(invoice.get_entries()[0].get_incomeaccount()) == "Income:Samovars"
+    assert invoice.get_description() == "Samovars"
@@ -0,0 +1,88 @@
+import pytest
+
+from context import watermark
+
+def rows(count, start=0):
+    return [{"CUSTOMER_ID": str(row), "QUANTITY": "1", "SOURCE_ROW": str(row + 2)}
+            for row in range(start, start + count)]
+
+def test_first_run_is_full():
+    (fresh, mark, incremental) = watermark.new_rows(rows(3))
+    assert fresh == rows(3)
+    assert not incremental
+    assert mark.rows == 3
+
+def test_appended_rows():
+    (_, mark, _) = watermark.new_rows(rows(3))
+    (fresh, new_mark, incremental) = watermark.new_rows(rows(5), mark)
+    assert incremental
+    assert fresh == rows(2, start=3)
+    assert new_mark == watermark.new_rows(rows(5))[1]
+
+def test_nothing_new():
+    (_, mark, _) = watermark.new_rows(rows(3))
+    assert watermark.new_rows(rows(3), mark) == ([], mark, True)
+
+@pytest.mark.parametrize("changed", [
+    rows(2),                                                # shorter
+    [dict(rows(1)[0], QUANTITY="2")] + rows(4, start=1),    # edited
+])
+def test_changed_prefix_is_refused(changed):
+    (_, mark, _) = watermark.new_rows(rows(3))
+    with pytest.raises(watermark.WatermarkError, match="duplicate"):
+        watermark.new_rows(changed, mark)
+    (fresh, _, incremental) = watermark.new_rows(changed, mark, reimport=True)
+    assert not incremental
+    assert fresh == changed
+
+def test_set_save_and_roll_back(tmp_path):
+    book = str(tmp_path / "book.gnucash")
+    source = str(tmp_path / "moscow.csv")
+    marks = watermark.Watermarks(book)
+    assert marks.get(source) is None
+    first = watermark.Watermark(3, "anna")
+    marks.set(source, first, "batch-1")
+    marks.save()
+    marks = watermark.Watermarks(book)
+    assert marks.get(source) == first
+    marks.set(source, watermark.Watermark(5, "levin"), "batch-2")
+    assert marks.roll_back("batch-3") == 0
+    assert marks.roll_back("batch-2") == 1
+    assert marks.get(source) == first
+    # One after the other, the latest first
+    assert marks.roll_back("batch-1") == 1
+    assert marks.get(source) is None
+
+def test_roll_back_only_the_latest(tmp_path):
+    source = str(tmp_path / "moscow.csv")
+    marks = watermark.Watermarks(str(tmp_path / "book.gnucash"))
+    marks.set(source, watermark.Watermark(3, "anna"), "batch-1")
+    marks.set(source, watermark.Watermark(5, "levin"), "batch-2")
+    with pytest.raises(watermark.WatermarkError, match="batch-2"):
+        marks.roll_back("batch-1")
+    assert marks.get(source) == watermark.Watermark(5, "levin")
+
+def test_roll_back_a_mark_kept_without_history(tmp_path):
+    source = str(tmp_path / "moscow.csv")
+    marks = watermark.Watermarks(str(tmp_path / "book.gnucash"))
+    marks.marks[watermark.source_key(source)] = {
+        "rows": 5, "sha256": "levin", "batch": "batch-2",
+        "previous": {"rows": 3, "sha256": "anna"}}
+    assert marks.roll_back("batch-2") == 1
+    assert marks.get(source) == watermark.Watermark(3, "anna")
+
+def test_sheets_have_marks_of_their_own(tmp_path):
+    source = str(tmp_path / "moscow.ods")
+    marks = watermark.Watermarks(str(tmp_path / "book.gnucash"))
+    marks.set(source, watermark.Watermark(3, "anna"), "batch-1")
+    marks.set(source, watermark.Watermark(5, "levin"), "batch-2",
+              sheets=["Payments"])
+    assert marks.get(source) == watermark.Watermark(3, "anna")
+    assert marks.get(source, ["Payments"]) == watermark.Watermark(5, "levin")
+    assert marks.get(source, "*") is None
+
+def test_unreadable(tmp_path):
+    book = tmp_path / "book.gnucash"
+    (tmp_path / "book.gnucash.watermarks.json").write_text("{")
+    with pytest.raises(watermark.WatermarkError):
+        watermark.Watermarks(str(book))
@@ -0,0 +1,141 @@
+import zipfile
+
+import pytest
+
+from context import registry
+from context import ods_reader
+from context import xlsx_reader
+
+MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+RELS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PACKAGE_RELS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+def worksheet(rows):
+    return ('<worksheet xmlns="{}"><sheetData>{}</sheetData></worksheet>'
+            .format(MAIN, "".join(rows)))
+
+@pytest.fixture
+def xlsx_filepath(tmp_path):
+    """Return the path to a bare-bones .xlsx file with two sheets"""
+    workbook = (
+        '<workbook xmlns="{}" xmlns:r="{}"><workbookPr/><sheets>'
+        '<sheet name="Baisakh" sheetId="1" r:id="rId1"/>'
+        '<sheet name="Jestha" sheetId="2" r:id="rId2"/>'
+        '</sheets></workbook>').format(MAIN, RELS)
+    relationships = (
+        '<Relationships xmlns="{}">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" Target="/xl/worksheets/sheet2.xml"/>'
+        '</Relationships>').format(PACKAGE_RELS)
+    shared_strings = (
+        '<sst xmlns="{}">'
+        '<si><t>CUSTOMER_NAME</t></si>'
+        '<si><t>QUANTITY</t></si>'
+        '<si><t>SALE_DATE</t></si>'
+        '<si><r><t>Anna </t></r><r><t>Karenina</t></r>'
+        '<rPh><t>アンナ</t></rPh></si>'
+        '<si><t>Total</t></si>'
+        '</sst>').format(MAIN)
+    styles = (
+        '<styleSheet xmlns="{}">'
+        '<numFmts><numFmt numFmtId="164" formatCode="yyyy\\-mm\\-dd"/></numFmts>'
+        '<cellStyleXfs><xf numFmtId="14"/></cellStyleXfs>'
+        '<cellXfs><xf numFmtId="0"/><xf numFmtId="164"/></cellXfs>'
+        '</styleSheet>').format(MAIN)
+    sheet1 = worksheet([
+        '<row r="1"><c r="A1" t="s"><v>0</v></c><c r="B1" t="s"><v>1</v></c>'
+        '<c r="C1" t="s"><v>2</v></c><c r="D1" t="s"><v>4</v></c></row>',
+        '<row r="2"><c r="A2" t="s"><v>3</v></c><c r="B2"><v>1.5E1</v></c>'
+        '<c r="C2" s="1"><v>44197</v></c></row>',
+        '<row r="3"><c r="A3"/></row>',
+        '<row r="5"><c r="B5" t="inlineStr"><is><t>3</t></is></c>'
+        '<c r="D5" t="str"><v>45</v></c></row>'])
+    sheet2 = worksheet([
+        '<row r="1"><c r="A1" t="s"><v>0</v></c></row>',
+        '<row r="2"><c r="A2" t="inlineStr"><is><t>Vronsky</t></is></c></row>'])
+
+    xlsx = tmp_path/"workbook.xlsx"
+    with zipfile.ZipFile(xlsx, "w") as xlsxzip:
+        xlsxzip.writestr("xl/workbook.xml", workbook)
+        xlsxzip.writestr("xl/_rels/workbook.xml.rels", relationships)
+        xlsxzip.writestr("xl/sharedStrings.xml", shared_strings)
+        xlsxzip.writestr("xl/styles.xml", styles)
+        xlsxzip.writestr("xl/worksheets/sheet1.xml", sheet1)
+        xlsxzip.writestr("xl/worksheets/sheet2.xml", sheet2)
+    return str(xlsx)
+
+@pytest.mark.parametrize("reference,expect",
+                         [("A1", 0), ("Z9", 25), ("AA10", 26), ("AB12", 27)])
+def test_column_index(reference, expect):
+    assert xlsx_reader.column_index(reference) == expect
+
+@pytest.mark.parametrize("serial, date1904, expect", [
+    ("44197", False, "2021-01-01"),
+    ("44197.75", False, "2021-01-01"),          # the time is dropped
+    ("44197.99999999", False, "2021-01-02"),    # floating point fuzz
+    ("1", False, "1900-01-01"),
+    ("59", False, "1900-02-28"),
+    ("60", False, "1900-02-29"),                # Excel's, not a real date
+    ("61", False, "1900-03-01"),
+    ("0", True, "1904-01-01"),
+])
+def test_format_date(serial, date1904, expect):
+    assert xlsx_reader.format_date(serial, date1904) == expect
+
+@pytest.mark.parametrize("value, expect", [
+    ("12", "12"),
+    ("-12.5", "-12.5"),
+    ("1.5E1", "15"),
+    ("1E-3", "0.001"),
+    ("2.2000000000000002", "2.2"),
+    ("0.30000000000000004", "0.3"),
+    ("123456789012345", "123456789012345"),
+])
+def test_format_number(value, expect):
+    assert xlsx_reader.format_number(value) == expect
+
+def test_read_first_sheet(xlsx_filepath):
+    assert list(xlsx_reader.Read(xlsx_filepath)) == [
+        {"CUSTOMER_NAME": "Anna Karenina", "QUANTITY": "15",
+         "SALE_DATE": "2021-01-01", "Total": ""},
+        {"CUSTOMER_NAME": "", "QUANTITY": "3",
+         "SALE_DATE": "", "Total": "45"}]
+
+def test_read_all_sheets(xlsx_filepath):
+    records = list(xlsx_reader.Read(xlsx_filepath,
+                                    sheets=ods_reader.ALL_SHEETS))
+    assert [record["SHEET"] for record in records] == [
+        "Baisakh", "Baisakh", "Jestha"]
+    assert records[-1]["CUSTOMER_NAME"] == "Vronsky"
+
+def test_read_not_an_xlsx(tmp_path):
+    not_xlsx = tmp_path/"not.xlsx"
+    not_xlsx.write_text("CUSTOMER_NAME,QUANTITY")
+    # Right away, not once the rows are asked for, and as a ReaderError
+    with pytest.raises(xlsx_reader.XLSXReadError):
+        xlsx_reader.Read(str(not_xlsx))
+    assert issubclass(xlsx_reader.XLSXReadError, registry.ReaderError)
+
+def test_unknown_sheet_is_refused_right_away(xlsx_filepath):
+    with pytest.raises(registry.ReaderError, match="Karenin"):
+        registry.Read(xlsx_filepath, sheets=["Baisakh", "Karenin"])
+
+def test_read_projection(xlsx_filepath, monkeypatch):
+    decoded = []
+    cell_text = xlsx_reader.cell_text
+    def counting_cell_text(cell, *args):
+        decoded.append(cell.get("r"))
+        return cell_text(cell, *args)
+    monkeypatch.setattr(xlsx_reader, "cell_text", counting_cell_text)
+    records = list(xlsx_reader.Read(xlsx_filepath, fields={"QUANTITY"},
+                                    require=["QUANTITY"],
+                                    row_field="SOURCE_ROW"))
+    assert records == [{"QUANTITY": "15", "SOURCE_ROW": "2"},
+                       {"QUANTITY": "3", "SOURCE_ROW": "5"}]
+    # The header, and then only the QUANTITY column
+    assert decoded == ["A1", "B1", "C1", "D1", "B2", "B5"]
+
+def test_read_projection_required_rows(xlsx_filepath):
+    records = list(xlsx_reader.Read(xlsx_filepath, require=["CUSTOMER_NAME"]))
+    assert records == [{"CUSTOMER_NAME": "Anna Karenina", "QUANTITY": "15",
+                        "SALE_DATE": "2021-01-01", "Total": ""}]